@@ -1,16 +1,22 @@
 """
 Run all analyzers and gather the results
 """
+import contextlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+from analyzer.cache import get_lint_cache
 from analyzer.code import (
     CountAnalyzer,
     PEP8LintAnalyzer,
     PyflakesLintAnalyzer,
     MyPyAnalyser,
 )
+from analyzer.index import build_index
 from analyzer.license import LicenseAnalyzer
 from analyzer.readme import ReadmeAnalyzer
 from analyzer.report import calculate_report_grade
+from analyzer.sharding import get_lint_pool
+from config import Config
 
 
 ANALYSER_CLASSES = (
@@ -24,37 +30,149 @@ DOC_ANALYSER_CLASSES = (
     ReadmeAnalyzer,
 )
 
+# Document names of the lint analyzers, whose errors are stored and paged apart
+LINT_ANALYZER_NAMES = frozenset(analyzer_class.document_name for analyzer_class in ANALYSER_CLASSES)
 
-def analyze(path):
-    """Run all analyzers and gather the results
+
+def _run_analyzers(analyzers, index, workers, on_done=None, timings=None):
+    """Run the given analyzers concurrently
+
+    Every analyzer is independent of the others and mostly waits on an
+    external tool, so they are all launched at once on a thread pool.
+
+    Args:
+        analyzers (list): Analyzer instances to run
+        index (RepositoryIndex): File index of the repository
+        workers (int): Maximum number of analyzers running at the same time
+        on_done (callable): Called with each analyzer in the calling thread
+            as soon as it finishes
+        timings (Timings): Measurements to record the run of each analyzer in
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        if timings is None:
+            futures = {executor.submit(analyzer.run, index): analyzer for analyzer in analyzers}
+        else:
+            futures = {executor.submit(timings.run_analyzer, analyzer, index): analyzer for analyzer in analyzers}
+        for future in as_completed(futures):
+            future.result()
+            if on_done is not None:
+                on_done(futures[future])
+
+
+def analyze(path, workers=None, lint_cache=None, processes=None, key=None, on_lint_errors=None, timings=None):
+    """Run all analyzers on a directory and gather the results
 
     Args:
         path (str): Path to repository
+        workers (int): Number of analyzers to run at once, defaults to
+            `Config.ANALYZER_WORKERS`
+        lint_cache (LintCache): Per-file lint result cache, defaults to the
+            one in `Config.LINT_CACHE_DIR` if it is set
+        processes (int): Number of worker processes linting shards of the
+            files, defaults to `Config.LINT_PROCESSES`
+        key (str): Identity of the repository across analyses, used to keep
+            per-repository caches, defaults to the absolute path
+        on_lint_errors (callable): Called with the document name and the
+            LintError list of each lint analyzer as soon as it finishes. If
+            it returns True, the errors are taken as written and left out of
+            the results
+        timings (Timings): Measurements to record the indexing and analysis
+            stages in, added to the results as 'timings'
+
+    Returns:
+        dict: All results as one dictionary
+    """
+    if timings is None:
+        index = build_index(path, key)
+    else:
+        with timings.stage('index') as measurement:
+            index = build_index(path, key)
+            measurement['files'] = len(index.files)
+            measurement['bytes'] = sum(f.size or 0 for f in index.python_files)
+    return analyze_index(index, workers, lint_cache, processes, on_lint_errors=on_lint_errors, timings=timings)
+
+
+def analyze_index(index, workers=None, lint_cache=None, processes=None, previous_results=None, changed_paths=(),
+                  on_lint_errors=None, timings=None):
+    """Run all analyzers on the files of an index and gather the results
+
+    The index is the source the analyzers read the files from, like a
+    cloned directory or the object store of a git repository.
+
+    Given the results of a previous analysis of the repository and the
+    files changed since, it is incremental: the per-file lint errors of
+    unchanged files are reused and only the other files are linted.
+    Counts, scores and the analyzers needing the whole repository are
+    always computed again.
+
+    Args:
+        index (RepositoryIndex): File index of the repository
+        workers (int): Number of analyzers to run at once, defaults to
+            `Config.ANALYZER_WORKERS`
+        lint_cache (LintCache): Per-file lint result cache, defaults to the
+            one in `Config.LINT_CACHE_DIR` if it is set
+        processes (int): Number of worker processes linting shards of the
+            files, defaults to `Config.LINT_PROCESSES`. The worker processes
+            are shared with the other analyses of the process
+        previous_results (dict): Results of a previous analysis to reuse
+        changed_paths (iterable): Paths of the files added, modified or
+            deleted since the previous analysis
+        on_lint_errors (callable): Called in the calling thread with the
+            document name and the LintError list of each lint analyzer as
+            soon as it finishes, before the scores are calculated. If it
+            returns True, the errors are taken as written: they are released
+            and left out of the results
+        timings (Timings): Measurements to record the analysis stage and each
+            analyzer in, added to the results as 'timings'
 
     Returns:
         dict: All results as one dictionary
     """
     count_analyzer = CountAnalyzer()
-    count_analyzer.run(path)
+    if lint_cache is None and Config.LINT_CACHE_DIR:
+        lint_cache = get_lint_cache(Config.LINT_CACHE_DIR, Config.LINT_CACHE_BUDGET)
+    if processes is None:
+        processes = Config.LINT_PROCESSES
+    lint_pool = None
+    if processes > 1 and len(index.python_files) >= Config.LINT_SHARD_MIN_FILES:
+        lint_pool = get_lint_pool(processes)
+    lint_analyzers = [analyzer_class(lint_cache, lint_pool) for analyzer_class in ANALYSER_CLASSES]
+    doc_analyzers = [analyzer_class() for analyzer_class in DOC_ANALYSER_CLASSES]
+    if previous_results is not None:
+        unchanged_paths = {f.path for f in index.python_files}.difference(changed_paths)
+        for analyzer in lint_analyzers:
+            analyzer.reuse_results(previous_results.get(analyzer.document_name), unchanged_paths)
+
+    def on_done(analyzer):
+        if on_lint_errors is not None and analyzer in lint_analyzers:
+            if on_lint_errors(analyzer.document_name, analyzer.lint_error_list):
+                analyzer.release_errors()
+
+    if timings is not None:
+        stage = timings.stage('analyze', len(index.python_files), sum(f.size or 0 for f in index.python_files))
+    else:
+        stage = contextlib.nullcontext()
+    with stage:
+        _run_analyzers([count_analyzer] + lint_analyzers + doc_analyzers,
+                       index,
+                       workers or Config.ANALYZER_WORKERS,
+                       on_done,
+                       timings)
     line_count = count_analyzer.total_line_count
 
     results = count_analyzer.to_document()
-    analyzers = []
 
-    for analyzer_class in ANALYSER_CLASSES:
-        analyzer = analyzer_class()
-        analyzers.append(analyzer)
-        analyzer.run(path)
+    for analyzer in lint_analyzers:
         analyzer.calculate_score(line_count)
         results.update(analyzer.to_document())
 
-    for analyzer_class in DOC_ANALYSER_CLASSES:
-        analyzer = analyzer_class()
-        analyzers.append(analyzer)
-        analyzer.run(path)
+    for analyzer in doc_analyzers:
         analyzer.calculate_score()
         results.update(analyzer.to_document())
 
-    results["report_grade"] = calculate_report_grade(*analyzers)
+    results["report_grade"] = calculate_report_grade(*lint_analyzers, *doc_analyzers)
+
+    if timings is not None:
+        results.update(timings.to_document())
 
     return results
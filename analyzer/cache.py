@@ -0,0 +1,255 @@
+"""
+A file-level cache of lint results keyed by the content of each file, and
+the size budgets of the caches kept across analyses
+"""
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from vcs.git import directory_size
+
+# Version of the entry format, part of the keys so entries of another format are never read
+ENTRY_FORMAT = '2'
+
+# Fraction of the budget a cache is pruned down to, so it is not pruned again on the next write
+PRUNE_RATIO = 0.8
+
+
+class LintCache:
+    """A directory store of per-file lint results
+
+    Each entry is keyed by the analyzer name, the tool version, the tool
+    options and the git blob hash of the file, so a changed file, tool or
+    option never hits a stale entry. If there is a budget, the least
+    recently used entries are removed when a write takes the total size
+    over it. The modification time of an entry is its last use.
+
+    path:   Cache directory path
+    budget: Maximum total size in bytes of the entries, unlimited if None
+    hits:   The number of lookups found in the cache
+    misses: The number of lookups not found in the cache
+    """
+
+    def __init__(self, path, budget=None):
+        self.path = path
+        self.budget = budget
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+        self._size_lock = threading.Lock()
+
+    @staticmethod
+    def make_key(analyzer_name, tool_version, tool_options, blob_hash):
+        """Make a cache key for a file linted by a tool
+
+        Args:
+            analyzer_name: Document name of the analyzer
+            tool_version: Version string of the lint tool
+            tool_options: Sequence of the lint tool options
+            blob_hash: Git blob hash of the file content
+
+        Returns:
+            A hex digest string
+        """
+        raw_key = '\0'.join((ENTRY_FORMAT, analyzer_name, tool_version, ' '.join(tool_options), blob_hash))
+        return hashlib.sha1(raw_key.encode()).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key[:2], key[2:] + '.json')
+
+    def get(self, key):
+        """Get the cached errors of a file
+
+        Args:
+            key: A cache key
+
+        Returns:
+            A list of [line, message] pairs of the file if cached, None otherwise
+        """
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path) as f:
+                error_docs = json.load(f)
+            if self.budget is not None:
+                os.utime(entry_path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return error_docs
+
+    def set(self, key, error_docs):
+        """Store the errors of a file
+
+        The entry is written to a temporary file first and renamed, so
+        concurrent readers never see a partial entry.
+
+        Args:
+            key: A cache key
+            error_docs: A list of [line, message] pairs of the file
+        """
+        entry_path = self._entry_path(key)
+        entry_dir = os.path.dirname(entry_path)
+        os.makedirs(entry_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=entry_dir, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(error_docs, f)
+        os.replace(tmp_path, entry_path)
+        if self.budget is None:
+            return
+        entry_size = os.path.getsize(entry_path)
+        with self._size_lock:
+            if self._size is None:
+                self._size = directory_size(self.path)
+            else:
+                self._size += entry_size
+            if self._size > self.budget:
+                self._size = self._prune()
+
+    def _prune(self):
+        """Remove the least recently used entries down to a fraction of the budget
+
+        Returns:
+            The total size in bytes of the remaining entries
+        """
+        entries = []
+        for folder, _, filenames in os.walk(self.path):
+            for filename in filenames:
+                if filename.endswith('.tmp'):
+                    continue
+                entry_path = os.path.join(folder, filename)
+                try:
+                    stat = os.stat(entry_path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry_path))
+        entries.sort()
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry_path in entries:
+            if total_size <= self.budget * PRUNE_RATIO:
+                break
+            try:
+                os.remove(entry_path)
+            except OSError:
+                continue
+            total_size -= size
+        return total_size
+
+
+class DirectoryBudget:
+    """A size budget of the subdirectories of a directory
+
+    After a subdirectory is used, the least recently used others are
+    removed while the total size is over the budget. The sizes of the
+    other subdirectories are measured once and then kept, so only the
+    used one is walked again. Subdirectories in use in this process are
+    never removed.
+
+    path:   Directory path
+    budget: Maximum total size in bytes of the subdirectories, unlimited if None
+    """
+
+    def __init__(self, path, budget=None):
+        self.path = path
+        self.budget = budget
+        self._sizes = None
+        self._in_use = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def use(self, name, on_remove=None):
+        """Use a subdirectory, then enforce the budget
+
+        Args:
+            name: Subdirectory name
+            on_remove: Function called with the path of each subdirectory before it is removed
+
+        Yields:
+            The subdirectory path
+        """
+        subdir = os.path.join(self.path, name)
+        with self._lock:
+            self._in_use[name] = self._in_use.get(name, 0) + 1
+        try:
+            yield subdir
+        finally:
+            size = directory_size(subdir)
+            with self._lock:
+                self._in_use[name] -= 1
+                if not self._in_use[name]:
+                    del self._in_use[name]
+            with contextlib.suppress(OSError):
+                os.utime(subdir)
+            self._enforce(name, size, on_remove)
+
+    def _enforce(self, name, size, on_remove):
+        with self._lock:
+            if self._sizes is None:
+                with os.scandir(self.path) as entries:
+                    self._sizes = {entry.name: directory_size(entry.path) for entry in entries if entry.is_dir()}
+            self._sizes[name] = size
+            total_size = sum(self._sizes.values())
+            if self.budget is None or total_size <= self.budget:
+                return
+            candidates = []
+            for other_name in self._sizes:
+                if other_name in self._in_use:
+                    continue
+                try:
+                    candidates.append((os.stat(os.path.join(self.path, other_name)).st_mtime, other_name))
+                except OSError:
+                    candidates.append((0, other_name))
+            for _, other_name in sorted(candidates):
+                if total_size <= self.budget:
+                    break
+                other_dir = os.path.join(self.path, other_name)
+                if on_remove is not None:
+                    on_remove(other_dir)
+                shutil.rmtree(other_dir, ignore_errors=True)
+                total_size -= self._sizes.pop(other_name)
+
+
+_lint_caches = {}
+_directory_budgets = {}
+_registry_lock = threading.Lock()
+
+
+def get_lint_cache(path, budget=None):
+    """Get the lint cache of a directory shared by the analyses of this process
+
+    Sharing it keeps the measured size of the cache, so the directory is
+    not walked again by each analysis.
+
+    Args:
+        path: Cache directory path
+        budget: Maximum total size in bytes of the entries, unlimited if None
+
+    Returns:
+        A LintCache instance
+    """
+    with _registry_lock:
+        key = (os.path.abspath(path), budget)
+        if key not in _lint_caches:
+            _lint_caches[key] = LintCache(path, budget)
+        return _lint_caches[key]
+
+
+def get_directory_budget(path, budget=None):
+    """Get the size budget of a directory shared by the analyses of this process
+
+    Args:
+        path: Directory path
+        budget: Maximum total size in bytes of the subdirectories, unlimited if None
+
+    Returns:
+        A DirectoryBudget instance
+    """
+    with _registry_lock:
+        key = (os.path.abspath(path), budget)
+        if key not in _directory_budgets:
+            _directory_budgets[key] = DirectoryBudget(path, budget)
+        return _directory_budgets[key]
@@ -1,23 +1,68 @@
 """
 A source code linting analyzer for checking PEP8 and Pyflakes warnings
 """
+import hashlib
 import os
+import re
 import subprocess
+import sys
+import tempfile
+from functools import lru_cache
 
+from analyzer.cache import get_directory_budget
 from analyzer.report import Grade
+from config import Config
+
+try:
+    import pycodestyle
+except ImportError:
+    pycodestyle = None
+
+try:
+    import pyflakes
+    from pyflakes.checker import Checker as PyflakesChecker
+except ImportError:
+    pyflakes = None
+
+# 'path:line: message' or 'path:line:column: message'
+LINT_MESSAGE_PATTERN = re.compile(r'^(?P<location>.+?):(?P<line>\d+):(?:\d+:)?\s*(?P<message>.*)$')
+
+# 'LOG:  Metadata fresh for module: file path' in the mypy verbose log
+MYPY_FRESH_PATTERN = re.compile(r'^LOG:\s+Metadata fresh for \S+: file (?P<path>.+)$')
+
+# The last line of the mypy output, missing if mypy or the daemon crashed
+MYPY_SUMMARY_PATTERN = re.compile(r'^(Found \d+ errors? in \d+ files?|Success: no issues found)')
+
+
+@lru_cache(maxsize=None)
+def get_tool_version(executable):
+    """Get the version string of a lint tool
+
+    Args:
+        executable: Name of the lint tool executable
+
+    Returns:
+        The output of `<executable> --version`
+    """
+    output = subprocess.check_output([executable, '--version'], stderr=subprocess.DEVNULL)
+    return output.decode().strip()
 
 
 class LintError:
     """A struct for lint error message
 
+    Errors are slotted and share their interned location string, since a
+    repository can have hundreds of thousands of them.
+
     location: File path location of error or warning
     line:     The number of line where the error or warning occurred
     message:  Lint error or warning message
     """
+    __slots__ = ('location', 'line', 'message')
 
     def __init__(self, location, line, message):
-        self.location = location
-        self.line = line
+        self.location = sys.intern(location)
+        self.line = int(line)
         self.message = message
 
     def to_document(self):
@@ -29,16 +74,77 @@ class LintError:
         }
 
 
+def group_errors(errors):
+    """Group lint errors per file for the stored document
+
+    Args:
+        errors: An iterable of (location, line, message) tuples
+
+    Returns:
+        A list of {'location', 'errors'} dicts in order of first
+        appearance, where errors is a list of [line, message] pairs
+    """
+    error_files = {}
+    for location, line, message in errors:
+        error_files.setdefault(location, []).append([line, message])
+    return [{'location': location, 'errors': pairs} for location, pairs in error_files.items()]
+
+
+def iter_errors(document):
+    """Iterate over the errors of a stored lint document
+
+    Documents stored before the errors were grouped per file are read as
+    well.
+
+    Args:
+        document: A lint document with 'error_files' or 'error_list'
+
+    Yields:
+        (location, line, message) tuples
+    """
+    if 'error_files' in document:
+        for error_file in document['error_files']:
+            for line, message in error_file['errors']:
+                yield error_file['location'], line, message
+    else:
+        for doc in document.get('error_list', ()):
+            yield doc['location'], int(doc['line']), doc['message']
+
+
 class LintAnalyzer(Grade):
     """A common analyzer struct
 
     lint_error_list: LintError list for linting
+    lint_cache:      LintCache to reuse the results of unchanged files, only
+                     used if the analyzer lints each file independently
+    lint_pool:       LintPool to lint shards of files on worker processes,
+                     only used if the analyzer lints each file independently
+    tool_signature:  Hash of the tool version and options, stored with the
+                     results of the analyzers linting each file independently
+    reused_files:    The number of files whose errors were reused from the
+                     previous analysis
+    linted_files:    The number of files the lint tool was run on
+    cache_hits:      The number of files whose errors were found in the lint cache
+    cache_misses:    The number of files looked up in the lint cache but not found
+    released_errors: The number of errors released after they were written
+                     elsewhere, None if they are still in lint_error_list
     """
     document_name = ''
-    message_column = 2
+    command = ()
+    cacheable = False
 
-    def __init__(self):
+    def __init__(self, lint_cache=None, lint_pool=None):
         self.lint_error_list = []
+        self.released_errors = None
+        self.lint_cache = lint_cache if self.cacheable else None
+        self.lint_pool = lint_pool if self.cacheable else None
+        self.tool_signature = None
+        self.reused_files = 0
+        self.linted_files = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.previous_document = None
+        self.unchanged_paths = frozenset()
 
     def _parse_lint_message(self, line):
         """Parse a lint message line
@@ -47,95 +153,471 @@ class LintAnalyzer(Grade):
             line: A line of lint message
 
         Returns:
-            A tuple of location, line, message of LintError
+            A tuple of location, line, message of LintError, None if the
+            line is not a message for a source line
         """
-        tokenized_by_colon = line.split(':')
-        location = tokenized_by_colon[0]
+        matched = LINT_MESSAGE_PATTERN.match(line)
+        if matched is None:
+            return None
+        location = matched.group('location')
         if location.startswith("./"):
             location = location[2:]
-        line = tokenized_by_colon[1]
-        message = tokenized_by_colon[self.message_column:]
-        return location, line, ''.join(message)
+        return location, int(matched.group('line')), matched.group('message')
+
+    def _tool_version(self):
+        """Version of the lint tool used as part of the cache key"""
+        return get_tool_version(self.command[0])
+
+    def _tool_options(self, index):
+        """Options of the lint tool used as part of the cache key"""
+        return self.command[1:]
+
+    def _lint_files(self, index, files):
+        """Lint the given python source files
+
+        Args:
+            index: RepositoryIndex of the cloned repository
+            files: IndexedFile list to lint
+        """
+        self._run_command(index.local_path(), files)
+
+    def _lint(self, index, files):
+        """Lint the given files, sharded on the lint pool if there is one
+
+        Args:
+            index: RepositoryIndex of the cloned repository
+            files: IndexedFile list to lint
+        """
+        if self.lint_pool is not None and len(files) > 1:
+            for location, line, message in self.lint_pool.lint(self, index, files):
+                self.lint_error_list.append(LintError(location, line, message))
+        else:
+            self._lint_files(index, files)
+
+    def _run_command(self, path, files):
+        """Run the lint command for the given python source files
+
+        Args:
+            path: Path of a directory with the files
+            files: IndexedFile list to lint
+        """
+        if not files:
+            return
+        proc = subprocess.Popen(list(self.command) + [f.path for f in files],
+                                stdout=subprocess.PIPE,
+                                cwd=path)
+        with proc.stdout:
+            self._save_lint_results(proc.stdout)
+        proc.wait()
+
+    def _tool_signature(self, index):
+        """Hash of the lint tool version and options the results depend on"""
+        return hashlib.sha1(repr((self._tool_version(), self._tool_options(index))).encode()).hexdigest()
+
+    def reuse_results(self, document, paths):
+        """Reuse the errors of a previous analysis for unchanged files
+
+        They are only reused if the previous analysis was made with the
+        same tool version and options.
+
+        Args:
+            document: The previous document of the analyzer
+            paths: Paths of the python files unchanged since then
+        """
+        self.previous_document = document
+        self.unchanged_paths = paths
+
+    def _previous_error_docs(self, index):
+        """Group the reusable previous errors by file
+
+        Returns:
+            A dict of unchanged file path to its [line, message] pairs
+        """
+        if self.previous_document is None or self.previous_document.get('tool') != self.tool_signature:
+            return {}
+        error_docs = {f.path: [] for f in index.python_files if f.path in self.unchanged_paths}
+        for location, line, message in iter_errors(self.previous_document):
+            if location in error_docs:
+                error_docs[location].append([line, message])
+        return error_docs
+
+    def _run_reusing(self, index):
+        """Lint only the files whose results are not known yet
+
+        The results of unchanged files are taken from the previous
+        analysis first, and from the lint cache next.
+
+        index: RepositoryIndex of the cloned repository
+        """
+        error_docs = self._previous_error_docs(index)
+        self.reused_files = len(error_docs)
+        keys = {}
+        if self.lint_cache is not None:
+            tool_version = self._tool_version()
+            tool_options = self._tool_options(index)
+            keys = {
+                f.path: self.lint_cache.make_key(self.document_name, tool_version, tool_options, f.blob_hash)
+                for f in index.python_files if f.path not in error_docs
+            }
+            for file_path, key in keys.items():
+                cached_docs = self.lint_cache.get(key)
+                if cached_docs is not None:
+                    error_docs[file_path] = cached_docs
+                    self.cache_hits += 1
+                else:
+                    self.cache_misses += 1
+
+        changed_files = [f for f in index.python_files if f.path not in error_docs]
+        self.linted_files = len(changed_files)
+        self._lint(index, changed_files)
+
+        linted_docs = {f.path: [] for f in changed_files}
+        unknown_errors = []
+        for err in self.lint_error_list:
+            if err.location in linted_docs:
+                linted_docs[err.location].append([err.line, err.message])
+            else:
+                unknown_errors.append(err)
+        if self.lint_cache is not None:
+            for file_path, docs in linted_docs.items():
+                self.lint_cache.set(keys[file_path], docs)
+        error_docs.update(linted_docs)
+
+        self.lint_error_list = [
+            LintError(f.path, line, message) for f in index.python_files for line, message in error_docs[f.path]
+        ] + unknown_errors
+
+    def run(self, index):
+        """Run the lint command for all python source files
+
+        index: RepositoryIndex of the cloned repository
+        """
+        if not self.cacheable:
+            self.linted_files = len(index.python_files)
+            self._lint(index, index.python_files)
+            return
+        self.tool_signature = self._tool_signature(index)
+        if self.lint_cache is not None or self.previous_document is not None:
+            self._run_reusing(index)
+        else:
+            self.linted_files = len(index.python_files)
+            self._lint(index, index.python_files)
 
     def _save_lint_results(self, output):
-        """Save the linting results
+        """Save the linting results, parsing the output line by line as it is read
 
         Args:
-            output: Output result of linter command
+            output: Output lines of linter command, as bytes
         """
-        if output:
-            for line in output.decode().split('\n')[:-1]:
-                self.lint_error_list.append(LintError(*self._parse_lint_message(line)))
+        for raw_line in output:
+            parsed = self._parse_lint_message(raw_line.decode(errors='replace').rstrip('\r\n'))
+            if parsed is not None:
+                self.lint_error_list.append(LintError(*parsed))
+
+    def release_errors(self):
+        """Drop the LintError list once it was written elsewhere
+
+        Only the number of errors is kept, for the score and the document,
+        which then leaves the errors out.
+        """
+        self.released_errors = self.error_count()
+        self.lint_error_list = []
+
+    def error_count(self):
+        """The number of errors found, including released ones"""
+        if self.released_errors is not None:
+            return self.released_errors
+        return len(self.lint_error_list)
 
     def calculate_score(self, total_line_count):
         """Calculate the linting score"""
-        self.score = int(100 * ((total_line_count - len(self.lint_error_list)) / total_line_count))
+        if not total_line_count:
+            self.score = 0 if self.error_count() else 100
+            return
+        self.score = int(100 * ((total_line_count - self.error_count()) / total_line_count))
 
     def to_document(self):
         """Make document dict of instance to store to db"""
-        error_list = [err.to_document() for err in self.lint_error_list]
         document = {
-            self.document_name: {'error_list': error_list, 'score': self.score}
+            self.document_name: {
+                'error_count': self.error_count(),
+                'score': self.score,
+            }
         }
+        if self.released_errors is None:
+            document[self.document_name]['error_files'] = group_errors(
+                (err.location, err.line, err.message) for err in self.lint_error_list
+            )
+        if self.tool_signature is not None:
+            document[self.document_name]['tool'] = self.tool_signature
         return document
 
 
+class _LintErrorReport(pycodestyle.BaseReport if pycodestyle else object):
+    """A pycodestyle report collecting LintError instead of printing"""
+
+    def __init__(self, options):
+        super().__init__(options)
+        self.lint_errors = []
+
+    def error(self, line_number, offset, text, check):
+        code = super().error(line_number, offset, text, check)
+        if code:
+            self.lint_errors.append(LintError(self.filename, line_number, text))
+        return code
+
+
 class PEP8LintAnalyzer(LintAnalyzer):
-    """An analyzer for PEP8 linting"""
+    """An analyzer for PEP8 linting
+
+    It runs pycodestyle in-process if it is installed, and the pep8
+    command otherwise.
+    """
     document_name = 'pep8_lint'
     weight = 0.5
-    message_column = 3
+    command = ('pep8',)
+    cacheable = True
 
-    def run(self, path):
-        """Run pep8 command for all python source files
+    def __init__(self, lint_cache=None, lint_pool=None):
+        super().__init__(lint_cache, lint_pool)
+        self._style_guides = {}
 
-        path: Cloned repository path
+    def _style_guide(self, index):
+        """Style guide reading the configuration of the repository like the pep8 command does
+
+        Only the configuration files at the root of the repository are
+        read. pycodestyle looks for them from the given path up to the
+        file system root, so no path is given to it if there are none, or
+        those of the directories the clone is in would be read instead.
         """
-        proc = subprocess.Popen(['pep8', '.'],
-                                stdout=subprocess.PIPE,
-                                cwd=path)
-        output, _ = proc.communicate()
-        self._save_lint_results(output)
+        config_path = index.config_path()
+        if config_path not in self._style_guides:
+            has_config = any(os.path.isfile(os.path.join(config_path, name)) for name in pycodestyle.PROJECT_CONFIG)
+            self._style_guides[config_path] = pycodestyle.StyleGuide(paths=[config_path] if has_config else [],
+                                                                     reporter=_LintErrorReport)
+        return self._style_guides[config_path]
+
+    def _tool_version(self):
+        if pycodestyle is None:
+            return super()._tool_version()
+        return 'pycodestyle {}'.format(pycodestyle.__version__)
+
+    def _tool_options(self, index):
+        if pycodestyle is None:
+            return super()._tool_options(index)
+        options = self._style_guide(index).options
+        return tuple(str(option) for option in (
+            options.select, options.ignore, options.max_line_length, options.max_doc_length, options.hang_closing
+        ))
+
+    def _lint_files(self, index, files):
+        if pycodestyle is None:
+            super()._lint_files(index, files)
+            return
+        options = self._style_guide(index).options
+        for indexed_file in files:
+            source = index.read_source(indexed_file)
+            report = _LintErrorReport(options)
+            pycodestyle.Checker(indexed_file.path, lines=source.lines, options=options, report=report).check_all()
+            self.lint_error_list.extend(report.lint_errors)
 
 
 class PyflakesLintAnalyzer(LintAnalyzer):
-    """An analyzer for Pyflakes linting"""
+    """An analyzer for Pyflakes linting
+
+    It runs pyflakes in-process on the shared source AST if it is
+    installed, and the pyflakes command otherwise.
+    """
     document_name = 'pyflakes_lint'
     weight = 0.5
-
-    def run(self, path):
-        """Run pyflakes command for all python source files
-
-        path: Cloned repository path
-        """
-        proc = subprocess.Popen(['pyflakes', '.'],
-                                stdout=subprocess.PIPE,
-                                cwd=path)
-        output, _ = proc.communicate()
-        self._save_lint_results(output)
+    command = ('pyflakes',)
+    cacheable = True
+
+    def _tool_version(self):
+        if pyflakes is None:
+            return super()._tool_version()
+        return 'pyflakes {} Python {}.{}'.format(pyflakes.__version__, *sys.version_info[:2])
+
+    def _lint_files(self, index, files):
+        if pyflakes is None:
+            super()._lint_files(index, files)
+            return
+        for indexed_file in files:
+            source = index.read_source(indexed_file)
+            try:
+                tree = source.parse()
+            except SyntaxError as e:
+                self.lint_error_list.append(LintError(indexed_file.path, e.lineno or 1, e.msg))
+                continue
+            checker = PyflakesChecker(tree, filename=indexed_file.path)
+            for message in sorted(checker.messages, key=lambda m: m.lineno):
+                self.lint_error_list.append(
+                    LintError(indexed_file.path, message.lineno, message.message % message.message_args)
+                )
 
 
 class MyPyAnalyser(LintAnalyzer):
-    """An analyzer for MyPy linting"""
+    """An analyzer for MyPy linting
+
+    The files are passed to mypy through a file list. If
+    `Config.MYPY_CACHE_DIR` is set, each repository keeps its own
+    incremental cache there and the analyzer counts the files whose
+    cache entry was still fresh. The caches of the least recently
+    analyzed repositories are removed beyond `Config.MYPY_CACHE_BUDGET`,
+    stopping their daemon first. If `Config.MYPY_DAEMON` is also set, a
+    dmypy daemon is kept per repository instead, restarted whenever the
+    repository is read from another directory than the daemon was
+    started in. A crash of mypy or of the daemon raises an error rather
+    than passing for a clean run.
+
+    cache_stats: A dict of fresh and stale file counts of the incremental
+                 cache, None if it was not used
+    """
     document_name = 'mypy_lint'
     weight = 0.5
+    command = ('mypy', '--ignore-missing-imports', '--allow-untyped-globals')
 
-    def run(self, path):
-        """Run mypy command for all python source files
+    def __init__(self, lint_cache=None, lint_pool=None):
+        super().__init__(lint_cache, lint_pool)
+        self.cache_stats = None
 
-        path: Cloned repository path
+    def _cache_dir(self, index):
+        """Incremental cache directory of the repository"""
+        repo_hash = hashlib.sha1(index.key.encode()).hexdigest()[:16]
+        return os.path.abspath(os.path.join(Config.MYPY_CACHE_DIR, repo_hash))
+
+    def _make_command(self, index, file_list_path):
+        """Make the mypy or dmypy command line
+
+        Args:
+            index: RepositoryIndex of the cloned repository
+            file_list_path: Path to the file listing the files to check
+
+        Returns:
+            A list of command arguments
+        """
+        options = list(self.command[1:])
+        if not Config.MYPY_CACHE_DIR:
+            return [self.command[0]] + options + ['@' + file_list_path]
+
+        cache_dir = self._cache_dir(index)
+        options += ['--cache-dir', cache_dir]
+        if Config.MYPY_DAEMON:
+            command = self._daemon_command(cache_dir) + ['run', '--timeout', str(Config.MYPY_DAEMON_TIMEOUT), '--']
+            return command + options + ['@' + file_list_path]
+        return [self.command[0], '--verbose'] + options + ['@' + file_list_path]
+
+    def _daemon_command(self, cache_dir):
+        """Make the dmypy command line prefix of the daemon of a repository"""
+        return ['dmypy', '--status-file', os.path.join(cache_dir, 'dmypy.json')]
+
+    def _stop_daemon(self, cache_dir):
+        """Stop the daemon of a repository cache directory if there is one, killing it if it does not stop"""
+        status_path = os.path.join(cache_dir, 'dmypy.json')
+        if not os.path.exists(status_path):
+            return
+        stopped = subprocess.run(self._daemon_command(cache_dir) + ['stop'],
+                                 stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if stopped.returncode:
+            subprocess.run(self._daemon_command(cache_dir) + ['kill'],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if os.path.exists(status_path):
+            os.remove(status_path)
+
+    def _prepare_daemon(self, index):
+        """Stop the daemon of the repository if it was started in another directory
+
+        The daemon keeps the working directory it was started in, while
+        each clone or object index of the repository is in a new one.
         """
-        cmd = ['mypy', '--ignore-missing-imports', '--allow-untyped-globals']
-        for folder, _, filenames in os.walk(path):
-            for filename in filenames:
-                if filename.lower().endswith(".py"):
-                    cmd.append("/".join((folder, filename)))
+        cache_dir = self._cache_dir(index)
+        root_path = os.path.join(cache_dir, 'dmypy.root')
+        root = index.local_path()
+        try:
+            with open(root_path) as f:
+                started_root = f.read()
+        except OSError:
+            started_root = None
+        if started_root != root:
+            self._stop_daemon(cache_dir)
+            with open(root_path, 'w') as f:
+                f.write(root)
+
+    def _save_cache_stats(self, log, files):
+        """Count the files whose incremental cache entry was fresh
 
-        proc = subprocess.Popen(cmd,
-                                stdout=subprocess.PIPE,
-                                cwd=path)
-        output, _ = proc.communicate()
-        self._save_lint_results(output)
+        Args:
+            log: Verbose log lines of mypy, as bytes
+            files: IndexedFile list that was checked
+        """
+        paths = {f.path for f in files}
+        fresh_paths = set()
+        for raw_line in log:
+            matched = MYPY_FRESH_PATTERN.match(raw_line.decode(errors='replace').rstrip('\r\n'))
+            if matched is not None:
+                fresh_paths.add(matched.group('path'))
+        fresh_count = len(paths & fresh_paths)
+        self.cache_stats = {'fresh_files': fresh_count, 'stale_files': len(paths) - fresh_count}
+
+    def _lint_files(self, index, files):
+        if not files:
+            return
+        if not Config.MYPY_CACHE_DIR:
+            self._check_files(index, files)
+            return
+        cache_dir = self._cache_dir(index)
+        os.makedirs(cache_dir, exist_ok=True)
+        budget = get_directory_budget(Config.MYPY_CACHE_DIR, Config.MYPY_CACHE_BUDGET)
+        with budget.use(os.path.basename(cache_dir), on_remove=self._stop_daemon):
+            if Config.MYPY_DAEMON:
+                self._prepare_daemon(index)
+            self._check_files(index, files)
+
+    def _check_files(self, index, files):
+        """Run mypy or dmypy on the files and save the errors
+
+        Raises:
+            subprocess.CalledProcessError: mypy or the daemon crashed
+        """
+        with tempfile.NamedTemporaryFile('w', suffix='.txt', delete=False) as file_list:
+            file_list.write(''.join(f.path + '\n' for f in files))
+        collect_log = Config.MYPY_CACHE_DIR and not Config.MYPY_DAEMON
+        # The verbose log goes to a file, so the errors are parsed while mypy writes them
+        log = tempfile.TemporaryFile() if collect_log else None
+        try:
+            command = self._make_command(index, file_list.name)
+            proc = subprocess.Popen(command,
+                                    stdout=subprocess.PIPE,
+                                    stderr=log,
+                                    cwd=index.local_path())
+            summary = []
+
+            def watch_summary(output):
+                for raw_line in output:
+                    if MYPY_SUMMARY_PATTERN.match(raw_line.decode(errors='replace')):
+                        summary.append(raw_line)
+                    yield raw_line
+
+            with proc.stdout:
+                self._save_lint_results(watch_summary(proc.stdout))
+            # mypy also exits with 2 on blocking errors of the repository like syntax errors, but then still
+            # reports them as usual
+            if proc.wait() not in (0, 1) and not summary:
+                raise subprocess.CalledProcessError(proc.returncode, command)
+            if collect_log:
+                log.seek(0)
+                self._save_cache_stats(log, files)
+        finally:
+            os.remove(file_list.name)
+            if log is not None:
+                log.close()
+
+    def to_document(self):
+        """Make document dict of instance to store to db"""
+        document = super().to_document()
+        if self.cache_stats is not None:
+            document[self.document_name]['cache_stats'] = self.cache_stats
+        return document
 
 
 class CountAnalyzer:
@@ -144,50 +626,33 @@ class CountAnalyzer:
     file_count:         The number of all python files
     total_line_count:   The number of lines of all python files
     average_line_count: The average number of lines of all python files
+    line_counts:        A dict of the number of lines per python file path
     """
+    document_name = 'count'
 
     def __init__(self):
         self.file_count = 0
         self.total_line_count = 0
         self.average_line_count = 0
+        self.line_counts = {}
 
-    def _count_files(self, path):
-        """Count the all python files
-
-        path: Cloned repository path
-        """
-        proc = subprocess.Popen(['find', '.', '-name', '*.py'],
-                                stdout=subprocess.PIPE,
-                                cwd=path)
-        output = subprocess.check_output(['wc', '-l'], stdin=proc.stdout)
-        file_count = int(output.decode().split()[0])
-        return file_count
-
-    def _count_lines(self, path):
-        """Count the lines of all python files
-
-        path: Cloned repository path
-        """
-        proc = subprocess.Popen(['find', '.', '-name', '*.py', '-exec', 'cat', '{}', '+'],
-                                stdout=subprocess.PIPE,
-                                cwd=path)
-        output = subprocess.check_output(['wc', '-l'], stdin=proc.stdout)
-        line_count = int(output.decode().split()[0])
-        return line_count
-
-    def run(self, path):
-        """Run count-related command for counting the files and lines
+    def run(self, index):
+        """Count the files and lines of all python source files
 
-        path: Cloned repository path
+        index: RepositoryIndex of the cloned repository
         """
-        self.file_count = self._count_files(path)
-        self.total_line_count = self._count_lines(path)
-        self.average_line_count = round(self.total_line_count / self.file_count)
+        self.line_counts = {f.path: f.line_count for f in index.python_files}
+        self.file_count = len(self.line_counts)
+        self.total_line_count = sum(self.line_counts.values())
+        if self.file_count:
+            self.average_line_count = round(self.total_line_count / self.file_count)
+        else:
+            self.average_line_count = 0
 
     def to_document(self):
         """Make document dict of instance to store to db"""
         return {
-            'count': {
+            self.document_name: {
                 'file_count': self.file_count,
                 'line_count': self.total_line_count,
                 'avg_line_count': self.average_line_count
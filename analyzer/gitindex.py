@@ -0,0 +1,227 @@
+"""
+A file index of a commit read straight from the git object store of a
+repository, without checking out a work tree
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+from analyzer.index import (
+    LINT_CONFIG_FILES,
+    VIRTUALENV_MARKER,
+    IndexedFile,
+    RepositoryIndex,
+    is_excluded_dirname,
+)
+from vcs.git import list_tree, local_git_env, missing_objects
+
+
+def _git(git_dir, args):
+    """Run a local git command in the git directory
+
+    Returns:
+        The standard output bytes
+
+    Raises:
+        subprocess.CalledProcessError: The command failed
+    """
+    return subprocess.run(['git'] + args,
+                          stdout=subprocess.PIPE,
+                          stderr=subprocess.DEVNULL,
+                          cwd=git_dir,
+                          env=local_git_env(git_dir),
+                          check=True).stdout
+
+
+def changed_paths(git_dir, base_hash, commit_hash):
+    """List the files added, modified or deleted between two commits
+
+    Only the trees are compared, so no blob is read or fetched.
+
+    Args:
+        git_dir: Git directory of the repository
+        base_hash: The older commit
+        commit_hash: The newer commit
+
+    Returns:
+        A set of file paths
+
+    Raises:
+        subprocess.CalledProcessError: One of the commits is not in the repository
+    """
+    diff = _git(git_dir, ['diff-tree', '-r', '-z', '--no-renames', '--name-only', base_hash, commit_hash])
+    return {path for path in diff.decode('utf-8', 'surrogateescape').split('\0') if path}
+
+
+def read_blobs(git_dir, blob_hashes):
+    """Stream the content of blobs through a single git process
+
+    Args:
+        git_dir: Git directory of the repository
+        blob_hashes: Hashes of blobs present in the repository
+
+    Returns:
+        A dict of blob hash to content bytes
+
+    Raises:
+        subprocess.CalledProcessError: A blob could not be read
+    """
+    proc = subprocess.Popen(['git', 'cat-file', '--batch'],
+                            stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL,
+                            cwd=git_dir,
+                            env=local_git_env(git_dir))
+    request = ''.join(blob_hash + '\n' for blob_hash in blob_hashes).encode()
+
+    def write_request():
+        # Written from another thread, so the output pipe is drained while the input is written
+        try:
+            proc.stdin.write(request)
+        finally:
+            proc.stdin.close()
+
+    writer = threading.Thread(target=write_request, daemon=True)
+    writer.start()
+    blobs = {}
+    try:
+        for blob_hash in blob_hashes:
+            header = proc.stdout.readline().split()
+            if len(header) != 3:
+                raise subprocess.CalledProcessError(1, ['git', 'cat-file', '--batch'], b' '.join(header))
+            blobs[blob_hash] = proc.stdout.read(int(header[2]))
+            proc.stdout.read(1)
+    finally:
+        writer.join()
+        proc.stdout.close()
+        proc.wait()
+    return blobs
+
+
+class GitObjectIndex(RepositoryIndex):
+    """All files of a commit of a git repository
+
+    The python sources and root lint configuration files are kept in
+    memory, so the in-process linters and the counter never touch the
+    disk. Tools reading files from disk get a temporary copy of them,
+    written on first use and removed by `close`.
+
+    path:        Git directory of the repository
+    commit_hash: The indexed commit
+    """
+
+    def __init__(self, path, commit_hash, files, blobs, key=None):
+        super().__init__(path, files, key)
+        self.commit_hash = commit_hash
+        self._blobs = blobs
+        self._config_files = [name for name in LINT_CONFIG_FILES if name in blobs]
+        self._local_path = None
+        self._written = set()
+        self._local_lock = threading.Lock()
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        del state['_local_lock']
+        state['_local_path'] = None
+        state['_written'] = set()
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self._local_lock = threading.Lock()
+
+    def _materialize(self, paths):
+        """Write the given files into the temporary copy if not written yet
+
+        Returns:
+            The temporary directory path
+        """
+        with self._local_lock:
+            if self._local_path is None:
+                self._local_path = tempfile.mkdtemp(prefix='pyreportcard-')
+            for path in paths:
+                if path in self._written:
+                    continue
+                file_path = os.path.join(self._local_path, path)
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                with open(file_path, 'wb') as f:
+                    f.write(self._blobs[path])
+                self._written.add(path)
+            return self._local_path
+
+    def local_path(self):
+        return self._materialize(self._config_files + [f.path for f in self.python_files])
+
+    def config_path(self):
+        return self._materialize(self._config_files)
+
+    def subset(self, files):
+        paths = self._config_files + [f.path for f in files]
+        return GitObjectIndex(self.path, self.commit_hash, files, {path: self._blobs[path] for path in paths},
+                              self.key)
+
+    def close(self):
+        with self._local_lock:
+            if self._local_path is not None:
+                shutil.rmtree(self._local_path, ignore_errors=True)
+                self._local_path = None
+                self._written = set()
+
+    def _read_bytes(self, indexed_file):
+        return self._blobs[indexed_file.path]
+
+
+def _is_excluded(path, virtualenv_dirs):
+    """Check if a file is in a directory left out of the analysis"""
+    parts = path.split('/')[:-1]
+    for i, dirname in enumerate(parts):
+        if is_excluded_dirname(dirname) or '/'.join(parts[:i + 1]) in virtualenv_dirs:
+            return True
+    return False
+
+
+def build_git_index(git_dir, commit_hash, key=None):
+    """Index the files of a commit reading its blobs from the object store
+
+    The blobs of the python sources and root lint configuration files are
+    read by one `git cat-file --batch` process. Blobs missing from a
+    partial clone are never fetched; their python files are left out like
+    a sparse checkout does, and other files are only listed by name.
+
+    Args:
+        git_dir: Git directory of the repository
+        commit_hash: The commit to index
+        key: Identity of the repository across analyses
+
+    Returns:
+        A GitObjectIndex instance
+
+    Raises:
+        subprocess.CalledProcessError: The commit could not be read
+    """
+    entries = list_tree(git_dir, commit_hash)
+    virtualenv_dirs = {
+        os.path.dirname(path) for path, _ in entries
+        if os.path.basename(path) == VIRTUALENV_MARKER and '/' in path
+    }
+    entries = [(path, blob_hash) for path, blob_hash in entries if not _is_excluded(path, virtualenv_dirs)]
+    missing = missing_objects(git_dir, commit_hash)
+    mtime = int(_git(git_dir, ['log', '-1', '--format=%ct', commit_hash]).decode().strip())
+
+    wanted = {
+        path: blob_hash for path, blob_hash in entries
+        if (path.endswith('.py') or path in LINT_CONFIG_FILES) and blob_hash not in missing
+    }
+    contents = read_blobs(git_dir, sorted(set(wanted.values())))
+    blobs = {path: contents[blob_hash] for path, blob_hash in wanted.items()}
+
+    files = []
+    for path, blob_hash in entries:
+        if not path.endswith('.py'):
+            files.append(IndexedFile(path, len(blobs[path]) if path in blobs else None, mtime))
+        elif path in blobs:
+            data = blobs[path]
+            files.append(IndexedFile(path, len(data), mtime, data.count(b'\n'), blob_hash))
+    return GitObjectIndex(git_dir, commit_hash, files, blobs, key)
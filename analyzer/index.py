@@ -0,0 +1,275 @@
+"""
+A file index of a repository built by a single directory walk and shared
+by all analyzers
+"""
+import ast
+import hashlib
+import io
+import os
+import threading
+import tokenize
+from collections import OrderedDict
+from functools import partial
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+# The number of decoded python sources kept in memory for the linters
+SOURCE_CACHE_SIZE = 512
+
+EXCLUDED_DIRS = frozenset((
+    '.git', '.hg', '.svn',
+    '.tox', '.nox', '.eggs', '.venv', 'venv',
+    '.mypy_cache', '.pytest_cache', '__pycache__',
+    'build', 'dist', 'node_modules',
+))
+
+VIRTUALENV_MARKER = 'pyvenv.cfg'
+
+# Root configuration files read by the lint tools
+LINT_CONFIG_FILES = ('setup.cfg', 'tox.ini', '.pep8', '.pycodestyle', 'mypy.ini', '.mypy.ini', 'pyproject.toml')
+
+
+def scan_python_file(path, size):
+    """Count the lines of a file and hash it without decoding it
+
+    Newline bytes are counted the same way as `wc -l` does, reading the
+    file in large binary chunks. The hash is the git blob hash of the
+    content, so it matches the object id stored in the repository.
+
+    Args:
+        path: Path to the file
+        size: File size in bytes
+
+    Returns:
+        A tuple of the number of lines and the blob hash
+    """
+    line_count = 0
+    blob_hash = hashlib.sha1(b'blob %d\0' % size)
+    with open(path, 'rb') as f:
+        for chunk in iter(partial(f.read, READ_CHUNK_SIZE), b''):
+            line_count += chunk.count(b'\n')
+            blob_hash.update(chunk)
+    return line_count, blob_hash.hexdigest()
+
+
+def is_excluded_dirname(dirname):
+    """Check if a directory name is one of a vcs, build or cache directory"""
+    return dirname in EXCLUDED_DIRS or dirname.endswith('.egg-info')
+
+
+def is_excluded_dir(folder, dirname):
+    """Check if a directory should be left out of the analysis
+
+    Args:
+        folder: Parent directory path
+        dirname: Name of the directory
+
+    Returns:
+        True for vcs, build, cache and virtualenv directories
+    """
+    if is_excluded_dirname(dirname):
+        return True
+    return os.path.isfile(os.path.join(folder, dirname, VIRTUALENV_MARKER))
+
+
+class IndexedFile:
+    """A struct for a file of the repository
+
+    path:       File path relative to the repository root
+    size:       File size in bytes, None if unknown
+    mtime:      Last modification time
+    line_count: The number of lines, only counted for python files
+    blob_hash:  Git blob hash of the content, only hashed for python files
+    """
+
+    def __init__(self, path, size, mtime, line_count=None, blob_hash=None):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.line_count = line_count
+        self.blob_hash = blob_hash
+
+    @property
+    def is_python(self):
+        return self.path.endswith('.py')
+
+
+def decode_source_lines(data):
+    """Decode python source bytes into lines like the interpreter does
+
+    The encoding is detected from the coding cookie or BOM, falling back
+    to latin-1 for undecodable files, and newlines are normalized.
+
+    Args:
+        data: Raw content of the file
+
+    Returns:
+        A list of lines with line endings
+    """
+    try:
+        encoding, _ = tokenize.detect_encoding(io.BytesIO(data).readline)
+        return io.TextIOWrapper(io.BytesIO(data), encoding).readlines()
+    except (LookupError, SyntaxError, UnicodeError):
+        return io.TextIOWrapper(io.BytesIO(data), 'latin-1').readlines()
+
+
+class SourceFile:
+    """Decoded content of a python file shared by the in-process linters
+
+    path:  File path relative to the repository root
+    lines: Decoded source lines
+    """
+
+    def __init__(self, path, lines):
+        self.path = path
+        self.lines = lines
+        self._tree = None
+        self._syntax_error = None
+
+    def parse(self):
+        """Parse the source into an AST only once
+
+        Returns:
+            The module AST
+
+        Raises:
+            SyntaxError: The source could not be parsed
+        """
+        if self._tree is None and self._syntax_error is None:
+            try:
+                self._tree = ast.parse(''.join(self.lines), filename=self.path)
+            except (SyntaxError, ValueError) as e:
+                self._syntax_error = e if isinstance(e, SyntaxError) else SyntaxError(str(e))
+        if self._syntax_error is not None:
+            raise self._syntax_error
+        return self._tree
+
+
+class RepositoryIndex:
+    """All files of a repository
+
+    It is also the source the analyzers read the files from, here the
+    cloned directory itself.
+
+    path:            Repository root path
+    key:             Identity of the repository across analyses, the
+                     absolute path by default
+    files:           IndexedFile list sorted by path
+    python_files:    IndexedFile list of the python source files
+    top_level_files: Names of the files in the repository root
+    """
+
+    def __init__(self, path, files, key=None):
+        self.path = path
+        self.key = key or os.path.abspath(path)
+        self.files = sorted(files, key=lambda f: f.path)
+        self.python_files = [f for f in self.files if f.is_python]
+        self.top_level_files = [f.path for f in self.files if os.sep not in f.path]
+        self._filenames = {os.path.basename(f.path).lower() for f in self.files}
+        self._sources = OrderedDict()
+        self._sources_lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_sources'], state['_sources_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._sources = OrderedDict()
+        self._sources_lock = threading.Lock()
+
+    def has_file(self, names):
+        """Check if a file with one of the given names exists
+
+        Args:
+            names: Lowercase file names to look for
+
+        Returns:
+            Whether if there is such a file anywhere in the repository
+        """
+        return any(name in self._filenames for name in names)
+
+    def local_path(self):
+        """Path of a directory with the python files for tools reading them from disk"""
+        return self.path
+
+    def config_path(self):
+        """Path of a directory with the root lint configuration files"""
+        return self.path
+
+    def absolute_path(self, indexed_file):
+        return os.path.join(self.local_path(), indexed_file.path)
+
+    def subset(self, files):
+        """Make an index of some of the files to send to a worker process
+
+        Args:
+            files: IndexedFile list of the subset
+
+        Returns:
+            A RepositoryIndex instance
+        """
+        return RepositoryIndex(self.path, files, self.key)
+
+    def close(self):
+        """Release the resources of the index"""
+
+    def _read_bytes(self, indexed_file):
+        """Read the raw content of a file"""
+        with open(self.absolute_path(indexed_file), 'rb') as f:
+            return f.read()
+
+    def read_source(self, indexed_file):
+        """Read and decode a python file
+
+        Recently read sources are kept, so linters going through the files
+        at the same time read and parse each of them only once.
+
+        Args:
+            indexed_file: IndexedFile of a python file
+
+        Returns:
+            A SourceFile instance
+        """
+        with self._sources_lock:
+            source = self._sources.get(indexed_file.path)
+            if source is not None:
+                self._sources.move_to_end(indexed_file.path)
+                return source
+
+        source = SourceFile(indexed_file.path, decode_source_lines(self._read_bytes(indexed_file)))
+
+        with self._sources_lock:
+            source = self._sources.setdefault(indexed_file.path, source)
+            if len(self._sources) > SOURCE_CACHE_SIZE:
+                self._sources.popitem(last=False)
+        return source
+
+
+def build_index(path, key=None):
+    """Walk the repository once and index its files
+
+    Args:
+        path: Repository path
+        key: Identity of the repository across analyses
+
+    Returns:
+        A RepositoryIndex instance
+    """
+    files = []
+    for folder, dirnames, filenames in os.walk(path):
+        dirnames[:] = [d for d in dirnames if not is_excluded_dir(folder, d)]
+        for filename in filenames:
+            file_path = os.path.join(folder, filename)
+            try:
+                stat = os.stat(file_path)
+                if filename.endswith('.py'):
+                    line_count, blob_hash = scan_python_file(file_path, stat.st_size)
+                else:
+                    line_count, blob_hash = None, None
+            except OSError:
+                continue
+            files.append(IndexedFile(os.path.relpath(file_path, path), stat.st_size, stat.st_mtime,
+                                     line_count, blob_hash))
+    return RepositoryIndex(path, files, key)
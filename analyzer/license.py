@@ -1,5 +1,3 @@
-import os
-
 from analyzer.report import Grade
 
 
@@ -11,6 +9,7 @@ class LicenseAnalyzer(Grade):
 
     LICENSE_PATTERN = ('license', 'license.md', 'license.rst', 'license.txt')
 
+    document_name = 'license'
     weight = 0.01
 
     def __init__(self):
@@ -20,21 +19,17 @@ class LicenseAnalyzer(Grade):
         """Calculate the analyzer score"""
         self.score = 100 if self.has_license else 0
 
-    def run(self, path):
+    def run(self, index):
         """Check if license file exists
 
-        path: Cloned repository path
+        index: RepositoryIndex of the cloned repository
         """
-        for _, _, filenames in os.walk(path):
-            for filename in filenames:
-                if filename.lower() in self.LICENSE_PATTERN:
-                    self.has_license = True
-                    return
+        self.has_license = index.has_file(self.LICENSE_PATTERN)
 
     def to_document(self):
         """Make document dict of instance to store to db"""
         return {
-            'license': {
+            self.document_name: {
                 'has_license': self.has_license
             }
         }
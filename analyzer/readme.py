@@ -1,5 +1,3 @@
-import os
-
 from analyzer.report import Grade
 
 
@@ -11,6 +9,7 @@ class ReadmeAnalyzer(Grade):
 
     README_PATTERN = ('readme', 'readme.md', 'readme.rst', 'readme.txt')
 
+    document_name = 'readme'
     weight = 0.01
 
     def __init__(self):
@@ -20,21 +19,17 @@ class ReadmeAnalyzer(Grade):
         """Calculate the analyzer score"""
         self.score = 100 if self.has_readme else 0
 
-    def run(self, path):
+    def run(self, index):
         """Check if readme file exists
 
-        path: Cloned repository path
+        index: RepositoryIndex of the cloned repository
         """
-        for _, _, filenames in os.walk(path):
-            for filename in filenames:
-                if filename.lower() in self.README_PATTERN:
-                    self.has_readme = True
-                    return
+        self.has_readme = index.has_file(self.README_PATTERN)
 
     def to_document(self):
         """Make document dict of instance to store to db"""
         return {
-            'readme': {
+            self.document_name: {
                 'has_readme': self.has_readme
             }
         }
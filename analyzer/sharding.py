@@ -0,0 +1,136 @@
+"""
+Sharded linting of large repositories on a pool of worker processes
+"""
+import atexit
+import heapq
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+
+def shard_files(files, shard_count):
+    """Split files into shards of balanced byte size
+
+    The biggest files are assigned first, each to the lightest shard.
+
+    Args:
+        files: IndexedFile list
+        shard_count: Maximum number of shards
+
+    Returns:
+        A list of non-empty IndexedFile lists
+    """
+    shards = [[] for _ in range(max(1, min(shard_count, len(files))))]
+    heap = [(0, i) for i in range(len(shards))]
+    for indexed_file in sorted(files, key=lambda f: (-f.size, f.path)):
+        size, i = heapq.heappop(heap)
+        shards[i].append(indexed_file)
+        heapq.heappush(heap, (size + indexed_file.size, i))
+    return [shard for shard in shards if shard]
+
+
+def _lint_shard(analyzer_class, index):
+    """Lint a shard of files in a worker process
+
+    Args:
+        analyzer_class: LintAnalyzer class to lint with
+        index: RepositoryIndex of the files of the shard
+
+    Returns:
+        A list of (location, line, message) tuples
+    """
+    analyzer = analyzer_class()
+    try:
+        analyzer._lint_files(index, index.python_files)
+    finally:
+        index.close()
+    return [(err.location, err.line, err.message) for err in analyzer.lint_error_list]
+
+
+class LintPool:
+    """A process pool linting the shards of a repository
+
+    processes: The number of worker processes
+    """
+
+    def __init__(self, processes):
+        self.processes = processes
+        self._executor = ProcessPoolExecutor(max_workers=processes,
+                                             mp_context=multiprocessing.get_context('spawn'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    def shutdown(self):
+        self._executor.shutdown()
+
+    def lint(self, analyzer, index, files):
+        """Lint files with the analyzer on all worker processes
+
+        The errors are merged back in the index order of the files, keeping
+        the order the tool reported them in for each file, so the result is
+        the same as linting all files in one process.
+
+        Args:
+            analyzer: LintAnalyzer linting each file independently
+            index: RepositoryIndex of the repository
+            files: IndexedFile list to lint
+
+        Returns:
+            A list of (location, line, message) tuples
+        """
+        futures = [
+            self._executor.submit(_lint_shard, type(analyzer), index.subset(shard))
+            for shard in shard_files(files, self.processes)
+        ]
+        errors_by_file = {f.path: [] for f in files}
+        unknown_errors = []
+        for future in futures:
+            for error in future.result():
+                errors_by_file.get(error[0], unknown_errors).append(error)
+        return [error for f in files for error in errors_by_file[f.path]] + unknown_errors
+
+
+_lint_pools = {}
+_lint_pools_pid = None
+_lint_pools_lock = threading.Lock()
+
+
+def get_lint_pool(processes):
+    """Getting the process-wide lint pool with the given number of worker processes
+
+    The pool is created on the first call and shared by all analyses of
+    the process, so the worker processes are started once and the
+    analyses running at once never use more of them. A forked process
+    creates its own pool instead of using the one inherited from its
+    parent. The pools are shut down at exit.
+
+    Args:
+        processes: The number of worker processes
+
+    Returns:
+        A LintPool instance
+    """
+    global _lint_pools_pid
+    pid = os.getpid()
+    with _lint_pools_lock:
+        if _lint_pools_pid != pid:
+            _lint_pools.clear()
+            _lint_pools_pid = pid
+        if processes not in _lint_pools:
+            _lint_pools[processes] = LintPool(processes)
+        return _lint_pools[processes]
+
+
+@atexit.register
+def shutdown_lint_pools():
+    """Shut down the lint pools of the process"""
+    with _lint_pools_lock:
+        lint_pools = list(_lint_pools.values()) if _lint_pools_pid == os.getpid() else []
+        _lint_pools.clear()
+    for lint_pool in lint_pools:
+        lint_pool.shutdown()
@@ -0,0 +1,71 @@
+"""
+Wall-clock and CPU time measurements of the analysis pipeline
+"""
+import contextlib
+import time
+
+
+def _measure_since(measurement, wall_started, cpu_started):
+    measurement['wall_seconds'] = round(time.perf_counter() - wall_started, 4)
+    measurement['cpu_seconds'] = round(time.thread_time() - cpu_started, 4)
+    return measurement
+
+
+class Timings:
+    """Measurements of the stages of an analysis and of each analyzer
+
+    The CPU time is the one of the measuring thread, so the time spent by
+    external lint tools and lint worker processes only shows in the
+    wall-clock time.
+
+    stages:    A dict of stage name to the measurement of the stage
+    analyzers: A dict of analyzer document name to the measurement of its run
+    """
+
+    def __init__(self):
+        self.stages = {}
+        self.analyzers = {}
+
+    @contextlib.contextmanager
+    def stage(self, name, files=0, size=0):
+        """Measure a stage run by the block
+
+        Args:
+            name: Stage name
+            files: The number of files the stage handles
+            size: The number of bytes the stage handles
+
+        Yields:
+            The measurement dict, whose 'files' and 'bytes' may be updated
+            by the block once they are known
+        """
+        measurement = {'files': files, 'bytes': size}
+        wall_started, cpu_started = time.perf_counter(), time.thread_time()
+        try:
+            yield measurement
+        finally:
+            self.stages[name] = _measure_since(measurement, wall_started, cpu_started)
+
+    def run_analyzer(self, analyzer, index):
+        """Run an analyzer on the index and measure it
+
+        Args:
+            analyzer: Analyzer instance with a `document_name`
+            index: RepositoryIndex of the repository
+        """
+        wall_started, cpu_started = time.perf_counter(), time.thread_time()
+        analyzer.run(index)
+        measurement = {'files': len(index.python_files)}
+        for name in ('linted_files', 'reused_files', 'cache_hits', 'cache_misses'):
+            if hasattr(analyzer, name):
+                measurement[name] = getattr(analyzer, name)
+        self.analyzers[analyzer.document_name] = _measure_since(measurement, wall_started, cpu_started)
+
+    def to_document(self):
+        """Make document dict of instance to store to db"""
+        return {
+            'timings': {
+                'stages': {name: dict(measurement) for name, measurement in self.stages.items()},
+                'analyzers': {name: dict(measurement) for name, measurement in self.analyzers.items()}
+            }
+        }
@@ -1,11 +1,59 @@
 from flask import Flask
-from flask_pymongo import PyMongo
+from pymongo.errors import PyMongoError
+
 from config import Config
+from db.collection import connection_counter, ensure_indexes
+from db.memory import TTLCache
+from jobs.metrics import CallbackMetric, registry
+from jobs.queue import JobQueue
+from jobs.scheduler import RegradeScheduler
+from vcs.repository import latest_hash_cache
 
 app = Flask(__name__)
 app.config.from_object(Config)
 
-# Create mongodb client
-mongo = PyMongo(app)
+# Create the rendered report cache keyed by url and commit hash
+report_cache = TTLCache(Config.REPORT_CACHE_SIZE, Config.REPORT_CACHE_TTL)
+
+# Create background analysis workers, their threads are started by the first job
+job_queue = JobQueue(Config.JOB_WORKERS, Config.JOB_RETENTION)
+
+# Create the background re-grading scheduler
+scheduler = RegradeScheduler(job_queue, Config.REGRADE_MAX_RUNNING, Config.REGRADE_RATE, Config.REGRADE_BURST,
+                             Config.REGRADE_STALE_AFTER, Config.REGRADE_SCAN_INTERVAL, Config.REGRADE_SCAN_LIMIT)
+
+# Expose the queue depths, in-memory cache lookups and mongodb connections as metrics
+registry.register(CallbackMetric('pyreportcard_job_queue_depth', 'Analysis jobs waiting for a worker',
+                                 lambda: job_queue.depth))
+registry.register(CallbackMetric('pyreportcard_jobs_coalesced_total', 'Submissions that joined an unfinished job',
+                                 lambda: job_queue.coalesced, 'counter'))
+registry.register(CallbackMetric('pyreportcard_regrade_queue_depth', 'Repositories waiting to be re-graded',
+                                 lambda: scheduler.depth))
+registry.register(CallbackMetric('pyreportcard_cache_lookups_total', 'In-memory cache lookups by result',
+                                 lambda: {('report', 'hit'): report_cache.hits, ('report', 'miss'): report_cache.misses,
+                                          ('head', 'hit'): latest_hash_cache.hits,
+                                          ('head', 'miss'): latest_hash_cache.misses},
+                                 'counter', ('cache', 'result')))
+registry.register(CallbackMetric('pyreportcard_mongo_connections_total', 'MongoDB connections by event',
+                                 lambda: {('opened',): connection_counter.opened,
+                                          ('closed',): connection_counter.closed},
+                                 'counter', ('event',)))
+
+
+def start_background():
+    """Start the process-wide background work of the web server
+
+    It creates the cache lookup indexes and starts the re-grading
+    scheduler. It is called once by the server entrypoint rather than on
+    import, so the processes importing the app for other purposes, like
+    the spawned lint workers, never start any of it.
+    """
+    try:
+        ensure_indexes()
+    except PyMongoError as e:
+        app.logger.warning('Could not create mongodb indexes: %s', e)
+    if Config.REGRADE_INTERVAL:
+        scheduler.start(Config.REGRADE_INTERVAL)
+
 
 from .report.views import *  # flake8: noqa
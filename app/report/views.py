@@ -1,9 +1,20 @@
-from flask import flash, redirect, render_template, request, url_for
+from flask import abort, flash, jsonify, redirect, render_template, request, url_for
 
-from analyzer import analyze
-from app import app, mongo
-from vcs.repository import (cache, clear, clone, create_repository, is_cached,
-                            parse_url)
+from analyzer import LINT_ANALYZER_NAMES
+from analyzer.timing import Timings
+from app import app, job_queue, report_cache, scheduler
+from config import Config
+from jobs.metrics import observe_timings, registry
+from jobs.webhook import parse_push_event, verify_signature
+from vcs.repository import create_repository, get_cached_document, get_error_page, is_cached, is_tracked, parse_url
+
+
+def _job_document(job):
+    """Make the job status document with the urls to poll and to show"""
+    document = job.to_document()
+    document['status_url'] = url_for('job_status', job_id=job.id)
+    document['report_url'] = url_for('report', repo_url=job.repo.url)
+    return document
 
 
 @app.route('/')
@@ -29,21 +40,95 @@ def check():
 
 @app.route('/report/<path:repo_url>', methods=['GET'])
 def report(repo_url):
-    repo = create_repository(repo_url)
+    timings = Timings()
+    try:
+        with timings.stage('resolve'):
+            repo = create_repository(repo_url)
+        if repo is None:
+            flash('Given repository does not exists or could not be accessed')
+            return redirect(url_for('index'))
+
+        rendered = report_cache.get((repo.url, repo.latest_hash))
+        if rendered is not None:
+            scheduler.record_view(repo.url)
+            return rendered
+
+        with timings.stage('lookup'):
+            results = get_cached_document(repo)
+        if results is not None:
+            with timings.stage('render'):
+                rendered = render_template('report/results.html', report=results)
+            report_cache.set((repo.url, repo.latest_hash), rendered)
+            scheduler.record_view(repo.url)
+            return rendered
+
+        job = job_queue.submit(repo)
+        return render_template('report/pending.html', job=_job_document(job))
+    finally:
+        observe_timings(timings)
+
+
+@app.route('/lints/<analyzer_name>/<path:repo_url>', methods=['GET'])
+def lint_errors(analyzer_name, repo_url):
+    if analyzer_name not in LINT_ANALYZER_NAMES:
+        abort(404)
+    commit_hash = request.args.get('commit', '')
+    page = max(request.args.get('page', 1, type=int), 1)
+    error_files, page_count = get_error_page(repo_url, commit_hash, analyzer_name, page, Config.LINT_ERROR_PAGE_SIZE)
+    return render_template('report/lint_errors.html', url=repo_url, commit_hash=commit_hash,
+                           analyzer_name=analyzer_name, error_files=error_files, page=page, page_count=page_count)
+
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    url = request.form.get('url') or (request.get_json(silent=True) or {}).get('url', '')
+    try:
+        parse_url(url)
+    except ValueError:
+        return jsonify(error='Given repository url is not valid'), 400
+
+    repo = create_repository(url)
     if repo is None:
-        flash('Given repository does not exists or could not be accessed')
-        return redirect(url_for('index'))
+        return jsonify(error='Given repository does not exists or could not be accessed'), 404
 
     if is_cached(repo):
-        results = mongo.db.repositories.find_one({'url': repo.url})
-    else:
-        path = clone(repo)
+        return jsonify(url=repo.url, latest_hash=repo.latest_hash, status='done',
+                       report_url=url_for('report', repo_url=repo.url))
+
+    job = job_queue.submit(repo)
+    return jsonify(_job_document(job)), 202
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify(error='Given job does not exists'), 404
+    return jsonify(_job_document(job))
+
+
+@app.route('/webhooks/push', methods=['POST'])
+def push_webhook():
+    if not Config.WEBHOOK_SECRET:
+        return jsonify(error='Push webhooks are disabled'), 403
+    if not verify_signature(Config.WEBHOOK_SECRET, request.get_data(), request.headers.get('X-Hub-Signature-256')):
+        return jsonify(error='Invalid payload signature'), 403
+    if request.headers.get('X-GitHub-Event', 'push') == 'ping':
+        return jsonify(status='pong')
+
+    try:
+        repo = parse_push_event(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    if repo is None:
+        return jsonify(status='ignored')
+    if not is_tracked(repo.url):
+        return jsonify(error='Given repository is not tracked'), 404
 
-        results = analyze(path)
-        repo.save_analysis_results(results)
+    scheduler.push(repo)
+    return jsonify(url=repo.url, latest_hash=repo.latest_hash, status='scheduled'), 202
 
-        cache(repo)
-        clear(path)
 
-        results = repo.to_document()
-    return render_template('report/results.html', report=results)
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return app.response_class(registry.render(), mimetype='text/plain; version=0.0.4')
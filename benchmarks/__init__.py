@@ -0,0 +1,3 @@
+"""
+Benchmarks of the analysis pipeline, run as modules
+"""
@@ -0,0 +1,100 @@
+"""
+Memory and stored document size of lint errors, before and after they
+were slotted and grouped per file
+
+Run with `python -m benchmarks.lint_errors [--errors N] [--files N]`, the
+measurements are printed as JSON.
+"""
+import argparse
+import io
+import json
+import tracemalloc
+
+import bson
+
+from analyzer.code import LINT_MESSAGE_PATTERN, PEP8LintAnalyzer
+
+
+class LegacyLintError:
+    """The lint error record before it was slotted"""
+
+    def __init__(self, location, line, message):
+        self.location = location
+        self.line = line
+        self.message = message
+
+
+def make_output(error_count, file_count):
+    """Make the pycodestyle output of a synthetic repository
+
+    Returns:
+        The output bytes
+    """
+    lines = []
+    for i in range(error_count):
+        location = './package/module_%d/source_file_%d.py' % (i % file_count % 50, i % file_count)
+        lines.append('%s:%d:1: E225 missing whitespace around operator\n' % (location, i // file_count + 1))
+    return ''.join(lines).encode()
+
+
+def legacy_document(output):
+    """Parse the output and make the document the way it was done before"""
+    errors = []
+    for line in output.decode().split('\n'):
+        matched = LINT_MESSAGE_PATTERN.match(line)
+        if matched is None:
+            continue
+        location = matched.group('location')
+        if location.startswith('./'):
+            location = location[2:]
+        errors.append(LegacyLintError(location, matched.group('line'), matched.group('message')))
+    error_list = [{'location': err.location, 'line': err.line, 'message': err.message} for err in errors]
+    return errors, {'pep8_lint': {'error_list': error_list, 'score': 0}}
+
+
+def compact_document(output):
+    """Parse the output and make the document with the current analyzer"""
+    analyzer = PEP8LintAnalyzer()
+    analyzer._save_lint_results(io.BytesIO(output))
+    analyzer.score = 0
+    return analyzer.lint_error_list, analyzer.to_document()
+
+
+def measure(make_document, output):
+    """Measure the peak memory of parsing and the size of the document
+
+    Returns:
+        A dict of measurements
+    """
+    tracemalloc.start()
+    errors, document = make_document(output)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'errors': len(errors),
+        'retained_bytes': current,
+        'peak_bytes': peak,
+        'document_bytes': len(bson.encode(document)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--errors', type=int, default=100000, help='Number of lint errors')
+    parser.add_argument('--files', type=int, default=1000, help='Number of files with errors')
+    args = parser.parse_args()
+
+    output = make_output(args.errors, args.files)
+    legacy = measure(legacy_document, output)
+    compact = measure(compact_document, output)
+    print(json.dumps({
+        'output_bytes': len(output),
+        'legacy': legacy,
+        'compact': compact,
+        'peak_ratio': round(compact['peak_bytes'] / legacy['peak_bytes'], 3),
+        'document_ratio': round(compact['document_bytes'] / legacy['document_bytes'], 3),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
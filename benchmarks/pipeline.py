@@ -0,0 +1,254 @@
+"""
+Benchmark of the clone and analysis pipeline on synthetic repositories
+
+Each scenario generates a repository of a given shape as a local bare
+repository, then in a fresh process clones it, analyzes the clone with a
+cold and a warm lint cache, analyzes the commit straight from a mirror,
+and times the line counter and the lint output parser alone. The
+throughput, peak memory and stage timings are printed as JSON.
+
+Run with `python -m benchmarks.pipeline [--scenario NAME] [--scale N]`.
+Given the JSON of an earlier run with `--baseline`, the stages slower
+than the tolerance allows are listed and the exit status is 1.
+"""
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from analyzer import ANALYSER_CLASSES, analyze, analyze_index
+from analyzer.cache import LintCache
+from analyzer.code import CountAnalyzer, PEP8LintAnalyzer
+from analyzer.gitindex import build_git_index
+from analyzer.index import build_index
+from analyzer.timing import Timings
+from benchmarks.synthetic import Shape, make_repository
+from config import Config
+from vcs.git import clone_url
+from vcs.mirror import MirrorStore
+
+# Version of the output format, compared runs must have the same
+FORMAT_VERSION = 1
+
+SCENARIOS = {
+    'small': Shape(files=50, lines=100),
+    'many_files': Shape(files=2000, lines=60),
+    'long_files': Shape(files=40, lines=5000),
+    'noisy': Shape(files=200, lines=200, warning_density=0.5),
+    'deep_tree': Shape(files=500, lines=100, depth=24),
+    'large_blobs': Shape(files=100, lines=100, blobs=4, blob_size=8 * 1024 * 1024),
+}
+
+# Stages whose wall-clock time is compared with the baseline
+COMPARED_STAGES = ('clone', 'analyze_cold', 'analyze_warm', 'objects', 'count', 'parse')
+
+
+def _peak_rss(who):
+    """Peak resident set size in bytes of this process or of its waited children"""
+    peak = resource.getrusage(who).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def _throughput(measurement, lines, files):
+    seconds = measurement['wall_seconds']
+    measurement['lines_per_second'] = round(lines / seconds) if seconds else None
+    measurement['files_per_second'] = round(files / seconds, 1) if seconds else None
+    return measurement
+
+
+def _timed(function, *args, **kwargs):
+    """Call a function and measure its wall-clock time
+
+    Returns:
+        A tuple of the return value and the seconds taken
+    """
+    started = time.perf_counter()
+    value = function(*args, **kwargs)
+    return value, round(time.perf_counter() - started, 6)
+
+
+def run_scenario(name, git_url, repository):
+    """Run the pipeline stages on a synthetic repository
+
+    Meant to run in a fresh process, so the peak memory is the one of the
+    scenario alone.
+
+    Args:
+        name: Scenario name, used as the repository name
+        git_url: 'file://' URL of the bare repository
+        repository: The dict of the files and lines written
+
+    Returns:
+        A dict of the measurements of each stage and the peak memory
+    """
+    work_dir = tempfile.mkdtemp(prefix='pyreportcard-benchmark-')
+    Config.MYPY_CACHE_DIR = ''
+    lines, files = repository['lines'], repository['python_files']
+    stages = {}
+    try:
+        clone_dir = os.path.join(work_dir, 'clone')
+        clone_stats = clone_url(git_url, clone_dir, sparse=Config.CLONE_SPARSE,
+                                max_blob_size=Config.CLONE_MAX_BLOB_SIZE, timeout=600)
+        stages['clone'] = {'wall_seconds': clone_stats['seconds'], 'bytes': clone_stats['bytes']}
+
+        lint_cache = LintCache(os.path.join(work_dir, 'lint_cache'))
+        for stage in ('analyze_cold', 'analyze_warm'):
+            timings = Timings()
+            results, seconds = _timed(analyze, clone_dir, lint_cache=lint_cache, key=name, timings=timings)
+            stages[stage] = _throughput({'wall_seconds': seconds, 'grade': results['report_grade']}, lines, files)
+            stages[stage].update(timings.to_document())
+
+        timings = Timings()
+        started = time.perf_counter()
+        mirror_store = MirrorStore(os.path.join(work_dir, 'mirrors'), sparse=Config.CLONE_SPARSE,
+                                   max_blob_size=Config.CLONE_MAX_BLOB_SIZE)
+        with contextlib.ExitStack() as stack:
+            with timings.stage('fetch') as measurement:
+                git_dir, fetch_stats = stack.enter_context(mirror_store.open_commit('benchmark', name, git_url,
+                                                                                    timeout=600))
+                measurement['bytes'] = fetch_stats['bytes']
+            with timings.stage('index') as measurement:
+                index = build_git_index(git_dir, fetch_stats['commit_hash'], key=name)
+                measurement['files'] = len(index.files)
+        try:
+            analyze_index(index, lint_cache=LintCache(os.path.join(work_dir, 'objects_lint_cache')), timings=timings)
+        finally:
+            index.close()
+        stages['objects'] = _throughput({'wall_seconds': round(time.perf_counter() - started, 4)}, lines, files)
+        stages['objects'].update(timings.to_document())
+
+        index = build_index(clone_dir, name)
+        _, seconds = _timed(CountAnalyzer().run, index)
+        stages['count'] = _throughput({'wall_seconds': seconds}, lines, files)
+
+        output = ''.join(
+            './module_{}.py:{}:5: E225 missing whitespace around operator\n'.format(i % files, i)
+            for i in range(max(repository['warnings'], 1))
+        ).encode()
+        _, seconds = _timed(PEP8LintAnalyzer()._save_lint_results, io.BytesIO(output))
+        stages['parse'] = {'wall_seconds': seconds, 'messages': repository['warnings'],
+                           'messages_per_second': round(repository['warnings'] / seconds) if seconds else None}
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        'stages': stages,
+        'peak_rss_bytes': _peak_rss(resource.RUSAGE_SELF),
+        'children_peak_rss_bytes': _peak_rss(resource.RUSAGE_CHILDREN),
+    }
+
+
+def _environment():
+    """Describe the machine and tools the benchmark ran with"""
+    git_version = subprocess.check_output(['git', '--version']).decode().strip()
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'git': git_version,
+        'lint_tools': {
+            analyzer_class.document_name: analyzer_class()._tool_version() for analyzer_class in ANALYSER_CLASSES
+        },
+        'analyzer_workers': Config.ANALYZER_WORKERS,
+        'lint_processes': Config.LINT_PROCESSES,
+        'clone_sparse': Config.CLONE_SPARSE,
+        'clone_max_blob_size': Config.CLONE_MAX_BLOB_SIZE,
+    }
+
+
+def run_benchmark(names, scale=1.0):
+    """Generate the repositories of the scenarios and run each in a fresh process
+
+    Args:
+        names: Names of the scenarios to run
+        scale: Multiplier of the file counts and blob sizes
+
+    Returns:
+        The report dict
+    """
+    report = {'format': FORMAT_VERSION, 'scale': scale, 'environment': _environment(), 'scenarios': {}}
+    context = multiprocessing.get_context('spawn')
+    for name in names:
+        shape = SCENARIOS[name].scaled(scale)
+        root = tempfile.mkdtemp(prefix='pyreportcard-synthetic-')
+        try:
+            (git_url, repository), seconds = _timed(make_repository, root, shape)
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                scenario = executor.submit(run_scenario, name, git_url, repository).result()
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+        scenario['shape'] = shape.to_document()
+        scenario['repository'] = dict(repository, generate_seconds=seconds)
+        report['scenarios'][name] = scenario
+    return report
+
+
+def compare(report, baseline, tolerance):
+    """Compare the stage timings with those of an earlier run
+
+    Args:
+        report: The report of this run
+        baseline: The report of an earlier run
+        tolerance: Allowed slowdown as a fraction of the baseline time
+
+    Returns:
+        A dict of the time ratio per scenario and stage, and the list of
+        regressions beyond the tolerance
+
+    Raises:
+        ValueError: The reports cannot be compared
+    """
+    if baseline.get('format') != report['format'] or baseline.get('scale') != report['scale']:
+        raise ValueError('The baseline has another format or scale')
+    ratios = {}
+    regressions = []
+    for name, scenario in report['scenarios'].items():
+        baseline_stages = baseline['scenarios'].get(name, {}).get('stages', {})
+        for stage in COMPARED_STAGES:
+            seconds = scenario['stages'].get(stage, {}).get('wall_seconds')
+            baseline_seconds = baseline_stages.get(stage, {}).get('wall_seconds')
+            if not seconds or not baseline_seconds:
+                continue
+            ratio = round(seconds / baseline_seconds, 3)
+            ratios.setdefault(name, {})[stage] = ratio
+            if ratio > 1 + tolerance:
+                regressions.append({'scenario': name, 'stage': stage, 'ratio': ratio})
+    return {'tolerance': tolerance, 'ratios': ratios, 'regressions': regressions}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help='Scenario to run, can be repeated, all by default')
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiplier of the file counts and blob sizes')
+    parser.add_argument('--output', help='File to write the JSON report to, stdout by default')
+    parser.add_argument('--baseline', help='JSON report of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Allowed slowdown compared with the baseline, as a fraction')
+    args = parser.parse_args()
+
+    report = run_benchmark(args.scenario or list(SCENARIOS), args.scale)
+    if args.baseline:
+        with open(args.baseline) as f:
+            report['comparison'] = compare(report, json.load(f), args.tolerance)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if report.get('comparison', {}).get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
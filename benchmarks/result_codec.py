@@ -0,0 +1,90 @@
+"""
+Stored size, encode and decode cost of the lint error documents with each
+results codec
+
+Run with `python -m benchmarks.result_codec [--errors N] [--files N]`, the
+measurements are printed as JSON.
+"""
+import argparse
+import json
+import time
+
+import bson
+
+from db import codec
+from vcs.repository import split_errors
+
+# Messages the synthetic errors are made of, with a varying part
+MESSAGES = (
+    'E501 line too long ({} > 79 characters)',
+    'E302 expected 2 blank lines, found {}',
+    'E231 missing whitespace after \',\'',
+    'W291 trailing whitespace',
+    'E128 continuation line under-indented for visual indent',
+    '\'module_{}\' imported but unused',
+    'undefined name \'name_{}\'',
+    'local variable \'value_{}\' is assigned to but never used',
+)
+
+
+def make_results(error_count, file_count):
+    """Make the analysis results of a synthetic repository
+
+    Returns:
+        A dict of analysis results with a lint document
+    """
+    error_files = {}
+    for i in range(error_count):
+        location = 'package/module_{}/source_file_{}.py'.format(i % file_count % 50, i % file_count)
+        message = MESSAGES[i % len(MESSAGES)].format(80 + i % 40)
+        error_files.setdefault(location, []).append([i // file_count + 1, message])
+    return {
+        'pep8_lint': {
+            'error_files': [{'location': location, 'errors': errors} for location, errors in error_files.items()],
+            'error_count': error_count,
+            'score': 0,
+        }
+    }
+
+
+def measure(error_docs, codec_name):
+    """Measure the stored size of the error documents and the encoding time
+
+    Returns:
+        A dict of measurements
+    """
+    started = time.perf_counter()
+    encoded_docs = [dict(doc, errors=codec.encode(doc['errors'], codec_name)) for doc in error_docs]
+    encode_seconds = time.perf_counter() - started
+    raw_docs = [bson.encode(doc) for doc in encoded_docs]
+
+    started = time.perf_counter()
+    for raw_doc in raw_docs:
+        codec.decode(bson.decode(raw_doc)['errors'])
+    decode_seconds = time.perf_counter() - started
+    return {
+        'codec': codec_name or 'raw',
+        'stored_bytes': sum(len(raw_doc) for raw_doc in raw_docs),
+        'encode_seconds': round(encode_seconds, 4),
+        'decode_seconds': round(decode_seconds, 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--errors', type=int, default=100000, help='Number of lint errors')
+    parser.add_argument('--files', type=int, default=1000, help='Number of files with errors')
+    args = parser.parse_args()
+
+    _, error_docs = split_errors('github.com/user/repository', '0' * 40, make_results(args.errors, args.files),
+                                 500)
+    codec_names = dict.fromkeys(('',) + tuple(codec.available_codec(codec_name) for codec_name in codec.CODECS))
+    measurements = [measure(error_docs, codec_name) for codec_name in codec_names]
+    raw_bytes = measurements[0]['stored_bytes']
+    for measurement in measurements:
+        measurement['size_ratio'] = round(measurement['stored_bytes'] / raw_bytes, 3)
+    print(json.dumps({'documents': len(error_docs), 'codecs': measurements}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""
+Synthetic repositories of controlled shape for the benchmarks
+
+The content only depends on the parameters and the seed, and commits are
+made with fixed dates, so the same parameters always give the same commit.
+"""
+import os
+import random
+import subprocess
+
+# Environment of the git commands, so commits never depend on the user or the time
+GIT_ENV = {
+    'GIT_AUTHOR_NAME': 'benchmark',
+    'GIT_AUTHOR_EMAIL': 'benchmark@example.com',
+    'GIT_AUTHOR_DATE': '2000-01-01T00:00:00+0000',
+    'GIT_COMMITTER_NAME': 'benchmark',
+    'GIT_COMMITTER_EMAIL': 'benchmark@example.com',
+    'GIT_COMMITTER_DATE': '2000-01-01T00:00:00+0000',
+}
+
+# Body lines of the generated functions, each with the pycodestyle or pyflakes warning it raises
+CLEAN_LINE = '    value_{0} = compute({0}) + {1}\n'
+WARNING_LINES = (
+    '    value_{0}=compute({0}) + {1}\n',
+    '    value_{0} = compute({0}) + {1} \n',
+    '    value_{0} = compute({0}) + {1}  # ' + 'x' * 80 + '\n',
+    '    import os as module_{0}\n',
+)
+
+HEADER_LINES = ('"""Generated module"""\n', '\n', '\n', 'def compute(value):\n', '    return value\n', '\n', '\n',
+                'def main():\n')
+FOOTER_LINES = ('    return None\n',)
+
+# Bytes of the large blobs written at once
+BLOB_CHUNK_SIZE = 1024 * 1024
+
+
+class Shape:
+    """Parameters of a synthetic repository
+
+    files:            The number of python files
+    lines:            The number of lines per python file
+    warning_density:  Share of the function body lines raising a warning
+    depth:            The number of directory levels the python files are nested in
+    blobs:            The number of large non-python files
+    blob_size:        Size in bytes of each large non-python file
+    seed:             Seed of the random choices
+    """
+
+    def __init__(self, files=100, lines=100, warning_density=0.05, depth=1, blobs=0, blob_size=0, seed=0):
+        self.files = files
+        self.lines = max(lines, len(HEADER_LINES) + len(FOOTER_LINES) + 1)
+        self.warning_density = warning_density
+        self.depth = depth
+        self.blobs = blobs
+        self.blob_size = blob_size
+        self.seed = seed
+
+    def scaled(self, scale):
+        """Make a shape with the file count and blob size multiplied by the scale"""
+        return Shape(max(int(self.files * scale), 1), self.lines, self.warning_density, self.depth, self.blobs,
+                     int(self.blob_size * scale), self.seed)
+
+    def to_document(self):
+        """Make document dict of instance to report"""
+        return dict(vars(self))
+
+
+def _module_path(number, depth):
+    """Make the path of a python file, spreading the files over a binary tree of directories"""
+    dirs = ['level{}_{}'.format(level, (number >> level) % 2) for level in range(depth)]
+    return '/'.join(dirs + ['module_{}.py'.format(number)])
+
+
+def _module_lines(rng, shape):
+    """Make the lines of a python file
+
+    Returns:
+        A tuple of the list of lines and the number of lines raising a warning
+    """
+    lines = list(HEADER_LINES)
+    warnings = 0
+    for i in range(shape.lines - len(HEADER_LINES) - len(FOOTER_LINES)):
+        if rng.random() < shape.warning_density:
+            lines.append(rng.choice(WARNING_LINES).format(i, rng.randrange(1000)))
+            warnings += 1
+        else:
+            lines.append(CLEAN_LINE.format(i, rng.randrange(1000)))
+    lines.extend(FOOTER_LINES)
+    return lines, warnings
+
+
+def _git(args, cwd):
+    env = dict(os.environ, **GIT_ENV)
+    subprocess.run(['git', '-c', 'init.defaultBranch=master'] + args, cwd=cwd, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def make_repository(root, shape):
+    """Write a synthetic repository and a bare copy to clone from
+
+    Args:
+        root: Empty directory to write the repositories into
+        shape: Shape of the repository
+
+    Returns:
+        A tuple of the 'file://' URL of the bare repository and a dict of
+        the files, python lines, warnings and bytes written
+    """
+    rng = random.Random(shape.seed)
+    work_tree = os.path.join(root, 'work')
+    bare = os.path.join(root, 'origin.git')
+    os.makedirs(work_tree)
+    stats = {'files': 0, 'python_files': shape.files, 'lines': 0, 'warnings': 0, 'bytes': 0}
+
+    def write(path, data):
+        file_path = os.path.join(work_tree, path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'wb') as f:
+            f.write(data)
+        stats['files'] += 1
+        stats['bytes'] += len(data)
+
+    write('README.md', b'# Synthetic repository\n')
+    write('setup.cfg', b'[pycodestyle]\nmax-line-length = 100\n')
+    for number in range(shape.files):
+        lines, warnings = _module_lines(rng, shape)
+        write(_module_path(number, shape.depth), ''.join(lines).encode())
+        stats['lines'] += len(lines)
+        stats['warnings'] += warnings
+    for number in range(shape.blobs):
+        file_path = os.path.join(work_tree, 'assets', 'blob_{}.bin'.format(number))
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        with open(file_path, 'wb') as f:
+            for start in range(0, shape.blob_size, BLOB_CHUNK_SIZE):
+                size = min(BLOB_CHUNK_SIZE, shape.blob_size - start)
+                f.write(rng.getrandbits(size * 8).to_bytes(size, 'little'))
+        stats['files'] += 1
+        stats['bytes'] += shape.blob_size
+
+    _git(['init', '-q'], work_tree)
+    _git(['add', '-A'], work_tree)
+    _git(['commit', '-q', '-m', 'Synthetic repository'], work_tree)
+    _git(['clone', '-q', '--bare', work_tree, bare], root)
+    _git(['config', 'uploadpack.allowFilter', 'true'], bare)
+    return 'file://' + bare, stats
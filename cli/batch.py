@@ -0,0 +1,210 @@
+"""
+Batch grading of many repositories on a pool of worker processes
+"""
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from analyzer import analyze
+from config import Config
+from vcs.git import clone_url
+from vcs.repository import _make_git_protocol_url
+
+# Config attributes passed on to the worker processes, which are spawned with the defaults
+WORKER_CONFIG = (
+    "LINT_CACHE_DIR",
+    "LINT_CACHE_BUDGET",
+    "MYPY_CACHE_DIR",
+    "MYPY_CACHE_BUDGET",
+    "CLONE_SPARSE",
+    "CLONE_MAX_BLOB_SIZE",
+)
+
+
+def read_targets(targets, input_file=None):
+    """Gather the repositories to grade
+
+    Args:
+        targets (list): Local paths or repository URLs given as arguments
+        input_file (file): File listing more targets, one per line, blank
+            lines and lines starting with '#' are skipped
+
+    Returns:
+        list: Targets in the given order without duplicates
+    """
+    gathered = list(targets)
+    if input_file is not None:
+        for line in input_file:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                gathered.append(line)
+    return list(dict.fromkeys(gathered))
+
+
+def _git_url(target):
+    """Get the git remote URL of a target, None if it is a local path"""
+    if os.path.isdir(target):
+        return None
+    if "://" in target or target.startswith("git@"):
+        return target
+    return _make_git_protocol_url(target)
+
+
+def grade_target(target, workers=None, processes=None):
+    """Clone the target if it is remote, analyze it and time each stage
+
+    Args:
+        target (str): Local path, 'github.com/<user>/<name>' or git remote URL
+        workers (int): Number of analyzers to run at once
+        processes (int): Number of processes linting shards of the files
+
+    Returns:
+        dict: The target, its status, timings and results or error message
+    """
+    started = time.monotonic()
+    record = {"target": target}
+    clone_dir = None
+    try:
+        git_url = _git_url(target)
+        path = target
+        if git_url is not None:
+            clone_dir = tempfile.mkdtemp(prefix="pyreportcard-")
+            path = os.path.join(clone_dir, "repository")
+            record["clone_seconds"] = clone_url(
+                git_url,
+                path,
+                sparse=Config.CLONE_SPARSE,
+                max_blob_size=Config.CLONE_MAX_BLOB_SIZE,
+            )["seconds"]
+        analyze_started = time.monotonic()
+        results = analyze(path, workers=workers, processes=processes, key=git_url)
+        record["analyze_seconds"] = round(time.monotonic() - analyze_started, 3)
+        record["status"] = "ok"
+        record["results"] = results
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = str(e) or type(e).__name__
+    finally:
+        if clone_dir is not None:
+            shutil.rmtree(clone_dir, ignore_errors=True)
+    record["seconds"] = round(time.monotonic() - started, 3)
+    return record
+
+
+def _init_worker(config):
+    """Set the config of this process in a worker process"""
+    for name, value in config.items():
+        setattr(Config, name, value)
+
+
+def grade_targets(targets, jobs=None, workers=None, processes=1):
+    """Grade targets on a pool of worker processes
+
+    Args:
+        targets (list): Local paths or repository URLs
+        jobs (int): Number of worker processes, defaults to the CPU count
+        workers (int): Number of analyzers to run at once in each process
+        processes (int): Number of processes linting shards of each target
+
+    Yields:
+        dict: A record of each target as soon as it is graded
+    """
+    jobs = min(jobs or os.cpu_count() or 1, max(len(targets), 1))
+    config = {name: getattr(Config, name) for name in WORKER_CONFIG}
+    with ProcessPoolExecutor(
+        max_workers=jobs,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(config,),
+    ) as executor:
+        futures = [
+            executor.submit(grade_target, target, workers, processes)
+            for target in targets
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def summarize(records, seconds):
+    """Aggregate the records of a batch run
+
+    Args:
+        records (list): Records returned by `grade_target`
+        seconds (float): Wall-clock seconds of the whole run
+
+    Returns:
+        dict: Counts, grade distribution and timings
+    """
+    graded = [record for record in records if record["status"] == "ok"]
+    timings = sorted(record["seconds"] for record in records)
+    grades = {}
+    for record in graded:
+        grade = record["results"]["report_grade"]
+        grades[grade] = grades.get(grade, 0) + 1
+    return {
+        "targets": len(records),
+        "graded": len(graded),
+        "failed": len(records) - len(graded),
+        "grades": dict(sorted(grades.items())),
+        "seconds": round(seconds, 3),
+        "target_seconds": {
+            "total": round(sum(timings), 3),
+            "mean": round(sum(timings) / len(timings), 3) if timings else 0,
+            "median": timings[len(timings) // 2] if timings else 0,
+            "max": timings[-1] if timings else 0,
+        },
+        "lines_per_second": round(
+            sum(record["results"]["count"]["line_count"] for record in graded)
+            / seconds
+        )
+        if seconds
+        else 0,
+    }
+
+
+def format_summary(summary):
+    """Return the summary of a batch run as a human readable text"""
+    target_seconds = summary["target_seconds"]
+    lines = [
+        "Graded %d of %d repositories in %.1fs (%d failed)"
+        % (
+            summary["graded"],
+            summary["targets"],
+            summary["seconds"],
+            summary["failed"],
+        ),
+        "Grades: %s"
+        % (", ".join("%s %d" % item for item in summary["grades"].items()) or "-"),
+        "Per repository: mean %.1fs, median %.1fs, max %.1fs"
+        % (target_seconds["mean"], target_seconds["median"], target_seconds["max"]),
+        "Throughput: %d lines/s" % summary["lines_per_second"],
+    ]
+    return "\n".join(lines)
+
+
+def run_batch(targets, output=None, jobs=None, workers=None, processes=1):
+    """Grade targets, streaming one JSON line per target to the output
+
+    Args:
+        targets (list): Local paths or repository URLs
+        output (file): Stream to write the JSON lines to, stdout by default
+        jobs (int): Number of worker processes
+        workers (int): Number of analyzers to run at once in each process
+        processes (int): Number of processes linting shards of each target
+
+    Returns:
+        dict: The summary of the run
+    """
+    output = output or sys.stdout
+    started = time.monotonic()
+    records = []
+    for record in grade_targets(targets, jobs, workers, processes):
+        records.append(record)
+        output.write(json.dumps(record, default=str) + "\n")
+        output.flush()
+    return summarize(records, time.monotonic() - started)
@@ -1,26 +1,52 @@
 """
 CLI formatting code
 """
+import abc
+import json
+import re
+import shutil
+import tempfile
+
+from analyzer.code import group_errors, iter_errors
 
 INDENT_PREFIX = "        "
 
+# Bytes of the encoded errors of an analyzer kept in memory before they are spooled to disk
+SPOOL_MAX_SIZE = 1024 * 1024
 
-def format_results(results, verbose=False):
-    """Return results as a human readable text
+FORMATS = ("text", "json", "ndjson", "sarif")
+
+SARIF_SCHEMA = "https://json.schemastore.org/sarif-2.1.0.json"
+
+# Lint tool behind each lint document, used as the SARIF tool driver
+SARIF_TOOLS = {
+    "pep8_lint": ("pycodestyle", "https://github.com/PyCQA/pycodestyle"),
+    "pyflakes_lint": ("pyflakes", "https://github.com/PyCQA/pyflakes"),
+    "mypy_lint": ("mypy", "https://github.com/python/mypy"),
+}
+
+# 'E225 missing whitespace around operator' or 'error: ... [arg-type]'
+RULE_ID_PATTERN = re.compile(r"^(?P<code>[A-Z]\d{3})\s|\[(?P<tag>[\w-]+)\]$")
+
+# 'error: message' or 'note: message' from mypy
+SEVERITY_PATTERN = re.compile(r"^(?P<severity>error|warning|note):\s")
+
+
+def iter_text_lines(results, verbose=False):
+    """Yield the results as human readable lines
 
     Args:
         results (dict): Dictionary of results
         verbose (bool): List all errors and warnings if True
 
-    Returns:
-        str: Human readable CLI output string
+    Yields:
+        str: Lines of the human readable CLI output
     """
-    text = "Grade: %s\n" "Files: %d" % (
+    yield "Grade: %s\n" "Files: %d" % (
         results["report_grade"],
         results["count"]["file_count"],
     )
 
-    lines = [text]
     for key, result in sorted(results.items()):
         if key in {"report_grade", "count"}:
             continue
@@ -32,21 +58,232 @@ def format_results(results, verbose=False):
             else:
                 score = 0
 
-        lines.append("%s: %d%%" % (key, score))
+        yield "%s: %d%%" % (key, score)
 
         if verbose:
-            error_list = result.get("error_list", tuple())
-            sorted_errors = (
-                (err["location"], int(err["line"]), err["message"].strip())
-                for err in error_list
-            )
             previous_filename = None
-            for filename, line_nb, msg in sorted_errors:
+            for filename, line_nb, msg in iter_errors(result):
+                msg = msg.strip()
                 if filename != previous_filename:
-                    lines.append("%s%s" % (INDENT_PREFIX, filename))
+                    yield "%s%s" % (INDENT_PREFIX, filename)
                     previous_filename = filename
-                lines.append(
-                    "%s%sLine %d: %s" % (INDENT_PREFIX, INDENT_PREFIX, line_nb, msg)
-                )
+                yield "%s%sLine %d: %s" % (INDENT_PREFIX, INDENT_PREFIX, line_nb, msg)
+
+
+def format_results(results, verbose=False):
+    """Return results as a human readable text
+
+    Args:
+        results (dict): Dictionary of results
+        verbose (bool): List all errors and warnings if True
+
+    Returns:
+        str: Human readable CLI output string
+    """
+    return "\n".join(iter_text_lines(results, verbose))
+
+
+def _lint_documents(results):
+    """Yield the name and document of each lint result"""
+    for key, result in sorted(results.items()):
+        if isinstance(result, dict) and (
+            "error_files" in result or "error_list" in result
+        ):
+            yield key, result
+
+
+class ResultWriter(abc.ABC):
+    """Writes the results to a stream as they are produced
+
+    Errors given to `write_errors` may be written right away, or set aside,
+    and the rest is written by `write_results` once the analysis is done.
+
+    output: Stream to write to
+    """
+
+    def __init__(self, output):
+        self.output = output
+
+    def write_errors(self, analyzer_name, errors):
+        """Write the LintError list of an analyzer as soon as it finishes
 
-    return "\n".join(lines)
+        Returns:
+            bool: True if the errors were taken, so the results passed to
+            `write_results` may leave them out
+        """
+        return False
+
+    @abc.abstractmethod
+    def write_results(self, results):
+        """Write the results of the finished analysis"""
+
+
+class TextWriter(ResultWriter):
+    """Human readable text, line by line"""
+
+    def __init__(self, output, verbose=False):
+        super().__init__(output)
+        self.verbose = verbose
+
+    def write_results(self, results):
+        for line in iter_text_lines(results, self.verbose):
+            self.output.write(line + "\n")
+
+
+class JSONWriter(ResultWriter):
+    """A single JSON document of all results, encoded in chunks
+
+    The errors of each lint analyzer are encoded as soon as it finishes
+    into a spool file, and copied into its document when the results are
+    written, so they are never kept in memory all at once.
+    """
+
+    def __init__(self, output):
+        super().__init__(output)
+        self._spools = {}
+
+    def write_errors(self, analyzer_name, errors):
+        spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, mode="w+")
+        spool.write("[")
+        error_files = group_errors((err.location, err.line, err.message) for err in errors)
+        for i, error_file in enumerate(error_files):
+            spool.write(", " if i else "")
+            spool.write(json.dumps(error_file, default=str))
+        spool.write("]")
+        self._spools[analyzer_name] = spool
+        return True
+
+    def write_results(self, results):
+        write = self.output.write
+        write("{")
+        for i, (key, result) in enumerate(results.items()):
+            write(", " if i else "")
+            write(json.dumps(key) + ": ")
+            spool = self._spools.pop(key, None)
+            if spool is None:
+                json.dump(result, self.output, default=str)
+                continue
+            with spool:
+                write(json.dumps(result, default=str)[:-1] + (", " if result else "") + '"error_files": ')
+                spool.seek(0)
+                shutil.copyfileobj(spool, self.output)
+            write("}")
+        write("}\n")
+
+
+class NDJSONWriter(ResultWriter):
+    """One JSON record per line
+
+    The error records of each lint analyzer are written as soon as it
+    finishes, then a score record per analyzer, the count and the grade.
+    """
+
+    def __init__(self, output):
+        super().__init__(output)
+        self._written = set()
+
+    def _write(self, record):
+        self.output.write(json.dumps(record, default=str) + "\n")
+
+    def write_errors(self, analyzer_name, errors):
+        for err in errors:
+            self._write(
+                {
+                    "type": "error",
+                    "analyzer": analyzer_name,
+                    "location": err.location,
+                    "line": err.line,
+                    "message": err.message,
+                }
+            )
+        self.output.flush()
+        self._written.add(analyzer_name)
+        return True
+
+    def write_results(self, results):
+        for key, result in _lint_documents(results):
+            if key not in self._written:
+                for location, line, message in iter_errors(result):
+                    self._write(
+                        {
+                            "type": "error",
+                            "analyzer": key,
+                            "location": location,
+                            "line": line,
+                            "message": message,
+                        }
+                    )
+        for key, result in sorted(results.items()):
+            if key == "report_grade":
+                continue
+            if key == "count":
+                self._write(dict(result, type="count"))
+            else:
+                record = {
+                    k: v
+                    for k, v in result.items()
+                    if k not in ("error_files", "error_list")
+                }
+                self._write(dict(record, type="result", analyzer=key))
+        self._write({"type": "grade", "report_grade": results["report_grade"]})
+
+
+def _sarif_result(location, line, message):
+    """Make a SARIF result of a lint error"""
+    result = {}
+    matched = RULE_ID_PATTERN.search(message)
+    if matched is not None:
+        result["ruleId"] = matched.group("code") or matched.group("tag")
+    severity = SEVERITY_PATTERN.match(message)
+    result["level"] = severity.group("severity") if severity is not None else "warning"
+    result["message"] = {"text": message.strip()}
+    result["locations"] = [
+        {
+            "physicalLocation": {
+                "artifactLocation": {"uri": location, "uriBaseId": "SRCROOT"},
+                "region": {"startLine": max(int(line), 1)},
+            }
+        }
+    ]
+    return result
+
+
+class SARIFWriter(ResultWriter):
+    """A SARIF 2.1.0 log with a run per lint tool, written result by result"""
+
+    def write_results(self, results):
+        write = self.output.write
+        write('{"$schema": %s, "version": "2.1.0", "runs": [' % json.dumps(SARIF_SCHEMA))
+        for i, (key, result) in enumerate(_lint_documents(results)):
+            name, uri = SARIF_TOOLS.get(key, (key, None))
+            driver = {"name": name}
+            if uri:
+                driver["informationUri"] = uri
+            run = {
+                "tool": {"driver": driver},
+                "properties": {"document": key, "score": result.get("score")},
+            }
+            write(", " if i else "")
+            write(json.dumps(run)[:-1] + ', "results": [')
+            for j, (location, line, message) in enumerate(iter_errors(result)):
+                write(", " if j else "")
+                write(json.dumps(_sarif_result(location, line, message)))
+            write("]}")
+        write("]}\n")
+
+
+def make_writer(output_format, output, verbose=False):
+    """Make the writer of an output format
+
+    Args:
+        output_format (str): One of `FORMATS`
+        output (file): Stream to write to
+        verbose (bool): List all errors and warnings in the text format
+
+    Returns:
+        ResultWriter: The writer
+    """
+    if output_format == "text":
+        return TextWriter(output, verbose)
+    writers = {"json": JSONWriter, "ndjson": NDJSONWriter, "sarif": SARIFWriter}
+    return writers[output_format](output)
@@ -1,14 +1,36 @@
 #!/usr/bin/env python
 
-from argparse import ArgumentParser
+import sys
+from argparse import ArgumentParser, FileType
 
 from analyzer import analyze
-from cli.formatting import format_results
+from cli.batch import format_summary, read_targets, run_batch
+from cli.formatting import FORMATS, make_writer
 
 if __name__ == "__main__":
     parser = ArgumentParser(
         description="Analyze the Python code quality with various tools."
     )
+    parser.add_argument(
+        "targets",
+        nargs="*",
+        help="Local paths or repository URLs to grade in batch mode, "
+        "printing one JSON line per repository",
+    )
+    parser.add_argument(
+        "--input",
+        "-i",
+        type=FileType("r"),
+        default=None,
+        help="File listing more targets for batch mode, one per line ('-' for stdin)",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=None,
+        help="Number of repositories graded at once in batch mode (default CPU count)",
+    )
     parser.add_argument(
         "--directory",
         "-d",
@@ -16,10 +38,47 @@ if __name__ == "__main__":
         default=".",
         help="Root directory of your Python application (default '.')",
     )
+    parser.add_argument(
+        "--workers",
+        "-w",
+        type=int,
+        default=None,
+        help="Number of analyzers to run at once (default from config)",
+    )
+    parser.add_argument(
+        "--processes",
+        "-p",
+        type=int,
+        default=None,
+        help="Number of processes linting shards of the files (default from config)",
+    )
+    parser.add_argument(
+        "--format",
+        "-f",
+        choices=FORMATS,
+        default="text",
+        help="Output format, errors are streamed as analyzers finish in ndjson "
+        "(default 'text', batch mode always writes JSON lines)",
+    )
     parser.add_argument(
         "--verbose", "-v", action="store_true", default=False, help="Verbose output"
     )
     arguments = parser.parse_args()
+    if arguments.targets or arguments.input:
+        summary = run_batch(
+            read_targets(arguments.targets, arguments.input),
+            jobs=arguments.jobs,
+            workers=arguments.workers,
+            processes=arguments.processes or 1,
+        )
+        print(format_summary(summary), file=sys.stderr)
+        sys.exit(1 if summary["failed"] else 0)
     path = arguments.directory
-    results = analyze(path)
-    print(format_results(results, verbose=arguments.verbose))
+    writer = make_writer(arguments.format, sys.stdout, verbose=arguments.verbose)
+    results = analyze(
+        path,
+        workers=arguments.workers,
+        processes=arguments.processes,
+        on_lint_errors=writer.write_errors,
+    )
+    writer.write_results(results)
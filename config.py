@@ -1,3 +1,6 @@
+import os
+
+
 class Config:
     try:
         from config_secret import SecretConfig
@@ -15,6 +18,88 @@ class Config:
         MONGO_PORT = 27017
         MONGO_URI = 'mongodb://{}:{}/{}'.format(MONGO_HOST, MONGO_PORT, MONGO_DBNAME)
 
+    # MongoDB client pool config
+    MONGO_MAX_POOL_SIZE = 50
+    MONGO_MIN_POOL_SIZE = 0
+    MONGO_CONNECT_TIMEOUT_MS = 5000
+    MONGO_SERVER_SELECTION_TIMEOUT_MS = 5000
+    MONGO_SOCKET_TIMEOUT_MS = 30000
+
+    # Lint errors are stored apart from the repositories, at most this many per document
+    LINT_ERRORS_PER_DOCUMENT = 500
+    # Lint errors shown per page of the report, whatever files and documents they are in
+    LINT_ERROR_PAGE_SIZE = 200
+    # Compress the stored lint errors with 'zlib' or 'zstd', stored raw if empty;
+    # 'zstd' needs the msgpack and zstandard packages and falls back to 'zlib' without them
+    RESULTS_CODEC = 'zlib'
+
+    # In-memory caches of the latest commit hashes and the rendered reports
+    HEAD_CACHE_SIZE = 1024
+    HEAD_CACHE_TTL = 60
+    REPORT_CACHE_SIZE = 512
+    REPORT_CACHE_TTL = 600
+
+    # Remote HEAD resolving config
+    HEAD_RESOLVE_TIMEOUT = 10
+    HEAD_RESOLVE_WORKERS = 16
+
     # Cloning config
+    # Remote url of a repository given its owner and name
+    GIT_URL_TEMPLATE = 'git://github.com/{username}/{name}.git'
     CLONE_TMP_DIR = 'tmp'
     CLONE_TIMEOUT = 30
+    # Fetch and check out only the files the analyzers read
+    CLONE_SPARSE = True
+    # Never fetch blobs bigger than this in sparse mode, unlimited if None
+    CLONE_MAX_BLOB_SIZE = 1024 * 1024
+    # Keep bare mirrors updated by incremental fetches instead of cloning each time, disabled if empty. Set it to a
+    # directory outside of the app checkout, like os.path.join(CACHE_HOME, 'mirrors')
+    MIRROR_DIR = ''
+    # Maximum total size in bytes of the mirrors, the least recently used ones are evicted beyond
+    MIRROR_BUDGET = 10 * 1024 * 1024 * 1024
+    # Analyze the objects of the mirrors in place instead of checking out work trees, needs MIRROR_DIR
+    ANALYZE_FROM_OBJECTS = False
+    # Relint only the files changed since the last analyzed commit when analyzing from objects
+    ANALYZE_INCREMENTAL = False
+
+    # Background analysis job config
+    JOB_WORKERS = 4
+    JOB_RETENTION = 3600
+
+    # Push webhook config, the webhook is disabled unless the secret signing the payloads is set
+    WEBHOOK_SECRET = ''
+
+    # Background re-grading config, seconds between scheduling rounds or disabled if 0. The scheduler is started by
+    # the server entrypoint; run it in a single process, as the jobs are only coalesced within a process
+    REGRADE_INTERVAL = 0
+    # Maximum number of re-grading jobs queued or running at once
+    REGRADE_MAX_RUNNING = 2
+    # Re-grading jobs started per second on average and at once at most
+    REGRADE_RATE = 0.2
+    REGRADE_BURST = 2
+    # Check the latest commit of a cached repository again after this many seconds
+    REGRADE_STALE_AFTER = 6 * 3600
+    # Seconds between scans of the cached repositories and maximum repositories checked per scan
+    REGRADE_SCAN_INTERVAL = 600
+    REGRADE_SCAN_LIMIT = 200
+
+    # Analyzing config
+    ANALYZER_WORKERS = 6
+    # Per-user directory of the caches kept across analyses
+    CACHE_HOME = os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'pyreportcard')
+    # Per-file lint result cache, disabled if empty
+    LINT_CACHE_DIR = os.path.join(CACHE_HOME, 'lint')
+    # Maximum total size in bytes of the lint cache, the least recently used entries are removed beyond
+    LINT_CACHE_BUDGET = 512 * 1024 * 1024
+    # Worker processes linting shards of large repositories, disabled if 1. They are shared by the analyses
+    # running at once, so the JOB_WORKERS jobs never run more lint processes than this in total
+    LINT_PROCESSES = os.cpu_count() or 1
+    LINT_SHARD_MIN_FILES = 100
+    # Per-repository mypy incremental cache, disabled if empty
+    MYPY_CACHE_DIR = os.path.join(CACHE_HOME, 'mypy')
+    # Maximum total size in bytes of the mypy caches, those of the least recently analyzed repositories are
+    # removed beyond
+    MYPY_CACHE_BUDGET = 2 * 1024 * 1024 * 1024
+    # Keep a dmypy daemon per repository, stopped after the timeout in seconds
+    MYPY_DAEMON = False
+    MYPY_DAEMON_TIMEOUT = 600
@@ -0,0 +1,151 @@
+"""
+A compact binary codec for the detailed analysis results stored in mongodb
+"""
+import json
+import zlib
+
+from bson.binary import Binary
+
+from config import Config
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CODECS = ('zlib', 'zstd')
+
+# Message templates of the lint tools primed into the compressors, so even
+# the few errors of a single file compress well. A dictionary is never
+# changed once used; a new one is added under the next id.
+DICTIONARIES = {
+    1: json.dumps([
+        'E101 indentation contains mixed spaces and tabs',
+        'E111 indentation is not a multiple of four',
+        'E117 over-indented',
+        'E127 continuation line over-indented for visual indent',
+        'E128 continuation line under-indented for visual indent',
+        "E201 whitespace after '('",
+        "E202 whitespace before ')'",
+        "E203 whitespace before ':'",
+        'E225 missing whitespace around operator',
+        'E226 missing whitespace around arithmetic operator',
+        "E231 missing whitespace after ','",
+        'E251 unexpected spaces around keyword / parameter equals',
+        'E261 at least two spaces before inline comment',
+        "E262 inline comment should start with '# '",
+        "E265 block comment should start with '# '",
+        'E301 expected 1 blank line, found 0',
+        'E302 expected 2 blank lines, found 1',
+        'E303 too many blank lines (3)',
+        'E305 expected 2 blank lines after class or function definition, found 1',
+        'E402 module level import not at top of file',
+        'E501 line too long (80 > 79 characters)',
+        "E711 comparison to None should be 'if cond is None:'",
+        "E722 do not use bare 'except'",
+        "E741 ambiguous variable name 'l'",
+        'W291 trailing whitespace',
+        'W292 no newline at end of file',
+        'W293 whitespace on blank line',
+        'W391 blank line at end of file',
+        'W503 line break before binary operator',
+        'W504 line break after binary operator',
+        "W605 invalid escape sequence '\\d'",
+        "'os' imported but unused",
+        "undefined name 'x'",
+        "local variable 'e' is assigned to but never used",
+        "redefinition of unused 'x' from line 1",
+        "'from module import *' used; unable to detect undefined names",
+        'f-string is missing placeholders',
+        'invalid syntax',
+        'error: Incompatible types in assignment (expression has type "str", variable has type "int")  [assignment]',
+        'error: Name "x" is not defined  [name-defined]',
+        'error: Argument 1 to "f" has incompatible type "str"; expected "int"  [arg-type]',
+        'error: Function is missing a return type annotation  [no-untyped-def]',
+        'error: Module "a" has no attribute "b"  [attr-defined]',
+        'error: Skipping analyzing "a": module is installed, but missing library stubs or py.typed marker  '
+        '[import-untyped]',
+        'note: See https://mypy.readthedocs.io/en/stable/running_mypy.html#missing-imports',
+    ]).encode(),
+}
+
+DICTIONARY_ID = max(DICTIONARIES)
+
+
+def _zstd_dictionary(dictionary_id):
+    return zstandard.ZstdCompressionDict(DICTIONARIES[dictionary_id], dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+
+
+def available_codec(codec):
+    """Get the codec to encode with, falling back to 'zlib' without its dependencies
+
+    Args:
+        codec: One of `CODECS`, or empty to store values as they are
+
+    Returns:
+        The codec name, or empty
+
+    Raises:
+        ValueError: The codec is unknown
+    """
+    if codec and codec not in CODECS:
+        raise ValueError('Unknown results codec: {}'.format(codec))
+    if codec == 'zstd' and (msgpack is None or zstandard is None):
+        return 'zlib'
+    return codec
+
+
+def encode(value, codec=None):
+    """Encode a value to a compressed binary document
+
+    'zlib' serializes the value as JSON, and 'zstd' as msgpack. Both are
+    compressed with the dictionary of message templates.
+
+    Args:
+        value: A JSON serializable value
+        codec: One of `CODECS`, `Config.RESULTS_CODEC` by default
+
+    Returns:
+        A {'codec', 'dictionary', 'data'} document, or the value itself if
+        the codec is empty
+    """
+    codec = available_codec(Config.RESULTS_CODEC if codec is None else codec)
+    if not codec:
+        return value
+    if codec == 'zstd':
+        compressor = zstandard.ZstdCompressor(dict_data=_zstd_dictionary(DICTIONARY_ID))
+        data = compressor.compress(msgpack.packb(value))
+    else:
+        compressor = zlib.compressobj(zlib.Z_BEST_COMPRESSION, zdict=DICTIONARIES[DICTIONARY_ID])
+        data = compressor.compress(json.dumps(value, separators=(',', ':')).encode()) + compressor.flush()
+    return {'codec': codec, 'dictionary': DICTIONARY_ID, 'data': Binary(data)}
+
+
+def is_encoded(value):
+    """Check if a value was encoded by `encode`"""
+    return isinstance(value, dict) and 'codec' in value and 'data' in value
+
+
+def decode(value):
+    """Decode a value encoded by `encode`, values never encoded are returned as they are
+
+    Raises:
+        ValueError: The value was encoded by a codec unavailable here
+    """
+    if not is_encoded(value):
+        return value
+    data = bytes(value['data'])
+    if value['codec'] == 'zstd':
+        if msgpack is None or zstandard is None:
+            raise ValueError("The 'zstd' results codec needs the msgpack and zstandard packages")
+        decompressor = zstandard.ZstdDecompressor(dict_data=_zstd_dictionary(value['dictionary']))
+        return msgpack.unpackb(decompressor.decompress(data), raw=False)
+    if value['codec'] == 'zlib':
+        decompressor = zlib.decompressobj(zdict=DICTIONARIES[value['dictionary']])
+        return json.loads(decompressor.decompress(data) + decompressor.flush())
+    raise ValueError('Unknown results codec: {}'.format(value['codec']))
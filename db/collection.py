@@ -1,14 +1,117 @@
 """
 A simple mongodb helper
 """
-from pymongo import MongoClient
+import os
+import threading
+
+from pymongo import ASCENDING, DESCENDING, MongoClient
+from pymongo.monitoring import ConnectionPoolListener
 
 from config import Config
 
 
+class ConnectionCounter(ConnectionPoolListener):
+    """Count the connections opened and closed by the client pools
+
+    opened: The number of connections opened
+    closed: The number of connections closed
+    """
+
+    def __init__(self):
+        self.opened = 0
+        self.closed = 0
+        self._lock = threading.Lock()
+
+    def connection_created(self, event):
+        with self._lock:
+            self.opened += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.closed += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        pass
+
+    def connection_checked_out(self, event):
+        pass
+
+    def connection_checked_in(self, event):
+        pass
+
+
+connection_counter = ConnectionCounter()
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Getting the process-wide mongodb client
+
+    The client is created on the first call and shared by all threads.
+    A forked process creates its own client instead of using the pools
+    inherited from its parent.
+    """
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is None or _client_pid != pid:
+        with _client_lock:
+            if _client is None or _client_pid != pid:
+                _client = MongoClient(Config.MONGO_HOST, Config.MONGO_PORT,
+                                      maxPoolSize=Config.MONGO_MAX_POOL_SIZE,
+                                      minPoolSize=Config.MONGO_MIN_POOL_SIZE,
+                                      connectTimeoutMS=Config.MONGO_CONNECT_TIMEOUT_MS,
+                                      serverSelectionTimeoutMS=Config.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+                                      socketTimeoutMS=Config.MONGO_SOCKET_TIMEOUT_MS,
+                                      connect=False,
+                                      event_listeners=[connection_counter])
+                _client_pid = pid
+    return _client
+
+
+def get_db():
+    """Getting the application database"""
+    return get_client()[Config.MONGO_DBNAME]
+
+
 def get_repo_collection():
     """Getting 'repositories' collection"""
-    client = MongoClient(Config.MONGO_HOST, Config.MONGO_PORT)
-    db = client[Config.MONGO_DBNAME]
-    repositories = db['repositories']
-    return repositories
+    return get_db()['repositories']
+
+
+def get_error_collection():
+    """Getting 'lint_errors' collection"""
+    return get_db()['lint_errors']
+
+
+def ensure_indexes():
+    """Create the indexes used by the cache lookups, stale scans and error pages if they do not exist"""
+    repositories = get_repo_collection()
+    repositories.create_index([('url', ASCENDING), ('last_latest_hash', ASCENDING)], name='url_last_latest_hash')
+    repositories.create_index([('checked', ASCENDING), ('views', DESCENDING)], name='checked_views')
+    get_error_collection().create_index([('url', ASCENDING), ('commit', ASCENDING), ('analyzer', ASCENDING),
+                                         ('location', ASCENDING), ('chunk', ASCENDING)],
+                                        name='url_commit_analyzer_location')
+    get_error_collection().create_index([('url', ASCENDING), ('commit', ASCENDING), ('analyzer', ASCENDING),
+                                         ('start', ASCENDING)],
+                                        name='url_commit_analyzer_start')
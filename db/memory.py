@@ -0,0 +1,78 @@
+"""
+A bounded in-process cache with time-based expiry
+"""
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """A thread-safe LRU cache whose entries expire after a while
+
+    The least recently used entry is evicted when the cache is full, and
+    entries older than the ttl are never returned.
+
+    maxsize: Maximum number of entries
+    ttl:     Seconds an entry stays valid
+    hits:    The number of lookups found in the cache
+    misses:  The number of lookups not found in the cache
+    """
+
+    def __init__(self, maxsize, ttl, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def get(self, key, default=None):
+        """Get a cached value
+
+        Args:
+            key: A hashable cache key
+            default: Value to return if not cached or expired
+
+        Returns:
+            The cached value if valid, default otherwise
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > self._clock():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        """Cache a value, evicting the least recently used one if full
+
+        Args:
+            key: A hashable cache key
+            value: Value to cache
+        """
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (self._clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        """Remove a cached value if exists"""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
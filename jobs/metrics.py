@@ -0,0 +1,203 @@
+"""
+Metrics of the analysis pipeline, exposed in the Prometheus text format
+"""
+import threading
+
+# Upper bounds of the histogram buckets of durations in seconds
+DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join('{}="{}"'.format(name, value) for name, value in escaped) + '}'
+
+
+class Metric:
+    """A metric family with a value per combination of label values
+
+    name:       Metric name
+    help:       Description of the metric
+    labelnames: Names of the labels
+    """
+    metric_type = 'untyped'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError('Expected the labels {} for {}'.format(self.labelnames, self.name))
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """List the samples of the metric
+
+        Returns:
+            A list of (name suffix, label pairs, value) tuples
+        """
+        with self._lock:
+            values = sorted(self._values.items())
+        return [('', list(zip(self.labelnames, key)), value) for key, value in values]
+
+    def render(self):
+        """Render the metric family in the text format
+
+        Returns:
+            A list of lines
+        """
+        lines = ['# HELP {} {}'.format(self.name, self.help), '# TYPE {} {}'.format(self.name, self.metric_type)]
+        for suffix, pairs, value in self.samples():
+            lines.append('{}{}{} {}'.format(self.name, suffix, _format_labels(pairs), _format_value(value)))
+        return lines
+
+
+class Counter(Metric):
+    """A value only going up"""
+    metric_type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def get(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Histogram(Metric):
+    """Observed values counted in cumulative buckets"""
+    metric_type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0))
+            self._values[key] = ([count + (value <= bound) for count, bound in zip(counts, self.buckets)],
+                                 total + value)
+
+    def samples(self):
+        samples = []
+        for _, pairs, (counts, total) in super().samples():
+            for bound, count in zip(self.buckets, counts):
+                samples.append(('_bucket', pairs + [('le', _format_value(bound))], count))
+            samples.append(('_sum', pairs, total))
+            samples.append(('_count', pairs, counts[-1]))
+        return samples
+
+
+class CallbackMetric(Metric):
+    """A metric whose values are read from elsewhere when rendered
+
+    callback: Function returning the value, or a dict of label value tuple
+              to the value if the metric has labels
+    """
+
+    def __init__(self, name, help, callback, metric_type='gauge', labelnames=()):
+        super().__init__(name, help, labelnames)
+        self.metric_type = metric_type
+        self.callback = callback
+
+    def samples(self):
+        values = self.callback()
+        if not self.labelnames:
+            return [('', [], values)]
+        return [('', list(zip(self.labelnames, key)), value) for key, value in sorted(values.items())]
+
+
+class Registry:
+    """The metric families to expose"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        """Add a metric family, replacing the one of the same name
+
+        Returns:
+            The metric
+        """
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self):
+        """Render all metric families in the text format
+
+        Returns:
+            The exposition text
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.register(Histogram(
+    'pyreportcard_stage_seconds', 'Wall-clock seconds of the pipeline stages', ('stage',)))
+STAGE_CPU_SECONDS = registry.register(Counter(
+    'pyreportcard_stage_cpu_seconds_total', 'CPU seconds of the pipeline stages in their thread', ('stage',)))
+STAGE_FILES = registry.register(Counter(
+    'pyreportcard_stage_files_total', 'Files handled by the pipeline stages', ('stage',)))
+STAGE_BYTES = registry.register(Counter(
+    'pyreportcard_stage_bytes_total', 'Bytes handled by the pipeline stages', ('stage',)))
+ANALYZER_SECONDS = registry.register(Histogram(
+    'pyreportcard_analyzer_seconds', 'Wall-clock seconds of the analyzer runs', ('analyzer',)))
+ANALYZER_CPU_SECONDS = registry.register(Counter(
+    'pyreportcard_analyzer_cpu_seconds_total', 'CPU seconds of the analyzer runs in their thread', ('analyzer',)))
+ANALYZER_FILES = registry.register(Counter(
+    'pyreportcard_analyzer_files_total', 'Files the lint tools were run on', ('analyzer',)))
+ANALYZER_REUSED_FILES = registry.register(Counter(
+    'pyreportcard_analyzer_reused_files_total', 'Files whose errors were reused from the previous analysis',
+    ('analyzer',)))
+LINT_CACHE_LOOKUPS = registry.register(Counter(
+    'pyreportcard_lint_cache_lookups_total', 'Lint cache lookups by result', ('analyzer', 'result')))
+JOBS = registry.register(Counter(
+    'pyreportcard_jobs_total', 'Finished analysis jobs by status', ('status',)))
+
+
+def observe_timings(timings):
+    """Add the measurements of an analysis to the metrics
+
+    Args:
+        timings: A Timings instance
+    """
+    for name, measurement in timings.stages.items():
+        STAGE_SECONDS.observe(measurement['wall_seconds'], stage=name)
+        STAGE_CPU_SECONDS.inc(measurement['cpu_seconds'], stage=name)
+        STAGE_FILES.inc(measurement['files'], stage=name)
+        STAGE_BYTES.inc(measurement['bytes'], stage=name)
+    for name, measurement in timings.analyzers.items():
+        ANALYZER_SECONDS.observe(measurement['wall_seconds'], analyzer=name)
+        ANALYZER_CPU_SECONDS.inc(measurement['cpu_seconds'], analyzer=name)
+        if 'linted_files' in measurement:
+            ANALYZER_FILES.inc(measurement['linted_files'], analyzer=name)
+            ANALYZER_REUSED_FILES.inc(measurement['reused_files'], analyzer=name)
+            LINT_CACHE_LOOKUPS.inc(measurement['cache_hits'], analyzer=name, result='hit')
+            LINT_CACHE_LOOKUPS.inc(measurement['cache_misses'], analyzer=name, result='miss')
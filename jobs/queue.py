@@ -0,0 +1,257 @@
+"""
+A background job queue running the clone and analysis pipeline of
+repositories outside of the web requests
+"""
+import contextlib
+import datetime
+import subprocess
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from analyzer import analyze, analyze_index
+from analyzer.gitindex import build_git_index, changed_paths
+from analyzer.timing import Timings
+from config import Config
+from jobs.metrics import JOBS, observe_timings
+from vcs.repository import cache, clear, clone, get_previous_document, latest_hash_cache, open_commit
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+
+def _changed_since(git_dir, previous, commit_hash):
+    """List the files changed since the previously analyzed commit
+
+    Returns:
+        A set of file paths, None if there is no previous commit to compare with
+    """
+    if previous is None or not previous.get('last_latest_hash') or not previous.get('analysis_results'):
+        return None
+    try:
+        return changed_paths(git_dir, previous['last_latest_hash'], commit_hash)
+    except subprocess.CalledProcessError:
+        return None
+
+
+def _analyze_objects(repo, timings):
+    """Analyze the latest commit straight from the mirror of the repository
+
+    Only tools reading files from disk get a temporary copy of the python
+    files, no work tree is checked out. If `Config.ANALYZE_INCREMENTAL`
+    is set and the previously analyzed commit is still in the mirror,
+    only the files changed since are linted again. The results are saved
+    under the commit actually fetched, whatever the repository was
+    expected to be at.
+    """
+    previous = get_previous_document(repo) if Config.ANALYZE_INCREMENTAL else None
+    with contextlib.ExitStack() as stack:
+        with timings.stage('fetch') as measurement:
+            git_dir, commit_hash = stack.enter_context(open_commit(repo))
+            measurement['bytes'] = repo.clone_stats['bytes']
+        repo.latest_hash = commit_hash
+        with timings.stage('index') as measurement:
+            index = build_git_index(git_dir, commit_hash, key=repo.url)
+            measurement['files'] = len(index.files)
+            measurement['bytes'] = sum(f.size or 0 for f in index.python_files)
+        changed = _changed_since(git_dir, previous, commit_hash)
+    try:
+        if changed is None:
+            return analyze_index(index, timings=timings)
+        results = analyze_index(index, previous_results=previous['analysis_results'], changed_paths=changed,
+                                timings=timings)
+        results['incremental'] = {'base_hash': previous['last_latest_hash'], 'changed_files': len(changed)}
+        return results
+    finally:
+        index.close()
+
+
+def _analyze_checkout(repo, timings):
+    """Analyze a clone of the latest commit of the repository"""
+    with timings.stage('clone') as measurement:
+        path = clone(repo)
+        measurement['bytes'] = repo.clone_stats['bytes']
+    repo.latest_hash = repo.clone_stats.get('commit_hash') or repo.latest_hash
+    try:
+        return analyze(path, key=repo.url, timings=timings)
+    finally:
+        clear(path)
+
+
+def analyze_repository(repo):
+    """Clone, analyze and cache the repository
+
+    If `Config.ANALYZE_FROM_OBJECTS` and the mirror store are enabled,
+    the files are read from the objects of the mirror instead of a clone.
+    The time of each stage and analyzer is stored with the results as
+    'timings', and added to the metrics. If the fetched commit is not the
+    one the repository was resolved at, the resolved HEAD is dropped from
+    `latest_hash_cache`, so the report looks the results up under the
+    commit they were saved under instead of submitting the job again.
+
+    Args:
+        repo: A repository instance
+    """
+    timings = Timings()
+    resolved_hash = repo.latest_hash
+    if Config.ANALYZE_FROM_OBJECTS and Config.MIRROR_DIR:
+        results = _analyze_objects(repo, timings)
+    else:
+        results = _analyze_checkout(repo, timings)
+    repo.save_analysis_results(results)
+    with timings.stage('cache'):
+        cache(repo)
+    if repo.latest_hash != resolved_hash:
+        latest_hash_cache.pop(repo.url)
+    observe_timings(timings)
+
+
+class Job:
+    """Scheme for an analysis job
+
+    id:          Job identifier
+    repo:        A repository instance to analyze
+    status:      One of queued, running, done and failed
+    error:       Error message if the job failed
+    submitted:   Submitted datetime
+    started:     Started datetime
+    finished:    Finished datetime
+    requests:    The number of submissions sharing this job
+    key:         Single-flight key of the job, the repository url and
+                 the commit hash it was submitted at
+    """
+
+    def __init__(self, repo):
+        self.id = uuid.uuid4().hex
+        self.repo = repo
+        self.status = JOB_QUEUED
+        self.error = None
+        self.submitted = datetime.datetime.now()
+        self.started = None
+        self.finished = None
+        self.requests = 1
+        self.key = repo.url, repo.latest_hash
+        self._finished_event = threading.Event()
+
+    @property
+    def is_finished(self):
+        return self.status in (JOB_DONE, JOB_FAILED)
+
+    def wait(self, timeout=None):
+        """Wait until the job is finished
+
+        Args:
+            timeout: Seconds to wait for, forever if None
+
+        Returns:
+            Whether if the job is finished or not
+        """
+        return self._finished_event.wait(timeout)
+
+    def to_document(self):
+        """Make document dict of instance to return as json"""
+        return {
+            'id': self.id,
+            'url': self.repo.url,
+            'latest_hash': self.repo.latest_hash,
+            'status': self.status,
+            'error': self.error,
+            'requests': self.requests,
+            'submitted': self.submitted.isoformat(),
+            'started': self.started.isoformat() if self.started else None,
+            'finished': self.finished.isoformat() if self.finished else None,
+        }
+
+
+class JobQueue:
+    """A pool of background workers running analysis jobs
+
+    Submissions of the same repository and commit while a job for them is
+    queued or running are coalesced into that job, so a repository is
+    never cloned and analyzed twice at the same time.
+
+    workers:   The number of jobs running at the same time
+    retention: Seconds to keep finished jobs for the status lookups
+    target:    Function running the pipeline for a repository
+    coalesced: The number of submissions that joined an existing job
+    """
+
+    def __init__(self, workers, retention=3600, target=analyze_repository):
+        self.workers = workers
+        self.retention = datetime.timedelta(seconds=retention)
+        self.target = target
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='analysis')
+        self._jobs = {}
+        self._active_jobs = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def _prune(self):
+        """Forget the jobs finished longer than the retention ago"""
+        expired = datetime.datetime.now() - self.retention
+        for job_id, job in list(self._jobs.items()):
+            if job.is_finished and job.finished < expired:
+                del self._jobs[job_id]
+
+    def _run(self, job):
+        job.status = JOB_RUNNING
+        job.started = datetime.datetime.now()
+        try:
+            self.target(job.repo)
+            job.status = JOB_DONE
+        except Exception as e:
+            job.error = str(e)
+            job.status = JOB_FAILED
+        finally:
+            JOBS.inc(status=job.status)
+            job.finished = datetime.datetime.now()
+            with self._lock:
+                if self._active_jobs.get(job.key) is job:
+                    del self._active_jobs[job.key]
+            job._finished_event.set()
+
+    def submit(self, repo):
+        """Enqueue an analysis of the repository
+
+        Args:
+            repo: A repository instance
+
+        Returns:
+            A new Job instance, or the unfinished one for the same
+            repository and commit
+        """
+        job = Job(repo)
+        with self._lock:
+            active_job = self._active_jobs.get(job.key)
+            if active_job is not None:
+                active_job.requests += 1
+                self.coalesced += 1
+                return active_job
+            self._prune()
+            self._jobs[job.id] = job
+            self._active_jobs[job.key] = job
+        self._executor.submit(self._run, job)
+        return job
+
+    def get(self, job_id):
+        """Find a job
+
+        Args:
+            job_id: Job identifier
+
+        Returns:
+            A Job instance if exists, None otherwise
+        """
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    @property
+    def depth(self):
+        """The number of jobs waiting for a worker"""
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.status == JOB_QUEUED)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,244 @@
+"""
+A scheduler re-grading the tracked repositories in the background, fed by
+push webhooks and by periodic scans for stale reports, so the analysis
+load is smoothed out instead of following the report views
+"""
+import datetime
+import heapq
+import itertools
+import logging
+import math
+import threading
+import time
+from collections import Counter
+
+from vcs.repository import (
+    GitRepository,
+    add_views,
+    find_stale_documents,
+    get_latest_commit_hashes,
+    is_cached,
+    mark_checked,
+    parse_url,
+)
+
+logger = logging.getLogger(__name__)
+
+# Priority of the repositories notified by a push webhook, before any scanned one
+PUSH_PRIORITY = float('inf')
+
+
+def regrade_priority(views, age):
+    """Calculate the priority of re-grading a repository, the higher the sooner
+
+    Popular repositories are re-graded first, and the longer a report has
+    been cached the sooner it is re-graded.
+
+    Args:
+        views: The number of views of the report
+        age: Seconds since the report was cached
+
+    Returns:
+        A priority value
+    """
+    return math.log2(2 + views) * max(age, 0)
+
+
+class TokenBucket:
+    """A token bucket rate limiter
+
+    rate:  Tokens added per second
+    burst: Maximum number of tokens
+    """
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._tokens = burst
+        self._updated = clock()
+
+    def take(self):
+        """Take a token if there is one
+
+        Returns:
+            Whether if a token was taken
+        """
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+
+class RegradeScheduler:
+    """Re-grades repositories on a job queue in priority order
+
+    Repositories are scheduled by push webhooks, and by scans of the
+    cached repositories whose latest commit was not checked for a while
+    and has changed since. Each scheduling round submits the repositories
+    of the highest priority as long as the rate limit and the cap of jobs
+    in flight allow it, skipping those already cached at their commit. The
+    views of the reports are counted in memory and
+    saved once per round, to rank the repositories by popularity.
+
+    job_queue:     JobQueue running the analysis
+    max_running:   Maximum number of re-grading jobs queued or running at once
+    rate:          Re-grading jobs started per second on average
+    burst:         Re-grading jobs started at once at most
+    stale_after:   Seconds after which the latest commit of a cached repository is checked again
+    scan_interval: Seconds between scans of the cached repositories
+    scan_limit:    Maximum number of repositories checked per scan
+    """
+
+    def __init__(self, job_queue, max_running, rate, burst=1, stale_after=6 * 3600, scan_interval=600,
+                 scan_limit=200, clock=time.monotonic, find_stale=find_stale_documents,
+                 resolve=get_latest_commit_hashes, save_checked=mark_checked, save_views=add_views,
+                 check_cached=is_cached):
+        self.job_queue = job_queue
+        self.max_running = max_running
+        self.stale_after = datetime.timedelta(seconds=stale_after)
+        self.scan_interval = scan_interval
+        self.scan_limit = scan_limit
+        self._clock = clock
+        self._find_stale = find_stale
+        self._resolve = resolve
+        self._save_checked = save_checked
+        self._save_views = save_views
+        self._check_cached = check_cached
+        self._bucket = TokenBucket(rate, burst, clock)
+        self._next_scan = clock()
+        self._heap = []
+        self._pending = {}
+        self._order = itertools.count()
+        self._running = []
+        self._views = Counter()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _add(self, repo, priority):
+        """Schedule a repository unless it is already pending at a higher priority"""
+        with self._lock:
+            pending = self._pending.get(repo.url)
+            if pending is not None and pending[0] <= -priority and pending[3].latest_hash == repo.latest_hash:
+                return
+            entry = (-priority, next(self._order), repo.url, repo)
+            self._pending[repo.url] = entry
+            heapq.heappush(self._heap, entry)
+
+    def push(self, repo):
+        """Schedule a repository notified by a push webhook ahead of the others
+
+        Args:
+            repo: A repository instance at the pushed commit
+        """
+        self._add(repo, PUSH_PRIORITY)
+        self._wakeup.set()
+
+    def record_view(self, url):
+        """Count a view of the report of a repository"""
+        with self._lock:
+            self._views[url] += 1
+
+    @property
+    def depth(self):
+        """The number of repositories waiting to be re-graded"""
+        return len(self._pending)
+
+    def _flush_views(self):
+        with self._lock:
+            view_counts, self._views = self._views, Counter()
+        if view_counts:
+            self._save_views(dict(view_counts))
+
+    def scan(self):
+        """Schedule the stale cached repositories whose latest commit has changed"""
+        now = datetime.datetime.now()
+        documents = self._find_stale(now - self.stale_after, self.scan_limit)
+        if not documents:
+            return
+        hashes = self._resolve([document['url'] for document in documents])
+        for document in documents:
+            latest_hash = hashes.get(document['url'])
+            if latest_hash is None or latest_hash == document.get('last_latest_hash'):
+                continue
+            try:
+                username, name = parse_url(document['url'])
+            except ValueError:
+                logger.warning('Skipped re-grading the invalid repository url %r', document['url'])
+                continue
+            repo = GitRepository(url=document['url'], username=username, name=name, latest_hash=latest_hash)
+            age = (now - document['date']).total_seconds() if document.get('date') else 0
+            self._add(repo, regrade_priority(document.get('views', 0), age))
+        self._save_checked([document['url'] for document in documents], now)
+
+    def _pop(self):
+        """Pop the pending repository of the highest priority if the rate limit allows it"""
+        with self._lock:
+            while self._heap and self._pending.get(self._heap[0][2]) is not self._heap[0]:
+                heapq.heappop(self._heap)
+            if not self._heap or not self._bucket.take():
+                return None
+            entry = heapq.heappop(self._heap)
+            del self._pending[entry[2]]
+            return entry[3]
+
+    def dispatch(self):
+        """Submit the pending repositories the cap and rate limit allow
+
+        Returns:
+            The list of submitted jobs
+        """
+        self._running = [job for job in self._running if not job.is_finished]
+        jobs = []
+        while len(self._running) < self.max_running:
+            repo = self._pop()
+            if repo is None:
+                break
+            if self._check_cached(repo):
+                continue
+            job = self.job_queue.submit(repo)
+            self._running.append(job)
+            jobs.append(job)
+        return jobs
+
+    def tick(self):
+        """Run a scheduling round
+
+        Returns:
+            The list of submitted jobs
+        """
+        self._flush_views()
+        if self._clock() >= self._next_scan:
+            self._next_scan = self._clock() + self.scan_interval
+            self.scan()
+        return self.dispatch()
+
+    def _loop(self, interval):
+        while not self._stopped.is_set():
+            try:
+                self.tick()
+            except Exception:
+                logger.exception('Re-grading round failed')
+            self._wakeup.wait(interval)
+            self._wakeup.clear()
+
+    def start(self, interval):
+        """Run the scheduling rounds on a background thread
+
+        Args:
+            interval: Seconds between the rounds, a push webhook runs one at once
+        """
+        self._thread = threading.Thread(target=self._loop, args=(interval,), name='regrade', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background scheduling rounds"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
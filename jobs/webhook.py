@@ -0,0 +1,56 @@
+"""
+Handling of the push webhook payloads sent by the repository host
+"""
+import hashlib
+import hmac
+import re
+
+from vcs.repository import GitRepository, parse_url
+
+COMMIT_HASH_PATTERN = re.compile(r'^[0-9a-f]{40}$')
+
+# The 'after' commit of a push deleting the branch
+NULL_COMMIT_HASH = '0' * 40
+
+
+def verify_signature(secret, body, signature):
+    """Verify the 'X-Hub-Signature-256' header of a webhook request
+
+    Args:
+        secret: Webhook secret shared with the host
+        body: Raw request body
+        signature: Value of the signature header
+
+    Returns:
+        Whether if the body was signed with the secret
+    """
+    expected = 'sha256=' + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature or '')
+
+
+def parse_push_event(payload):
+    """Make a repository instance at the pushed commit from a push event payload
+
+    Args:
+        payload: Decoded JSON payload of the push event
+
+    Returns:
+        A GitRepository instance, None if the push is not a new commit on
+        the default branch
+
+    Raises:
+        ValueError: The payload is not a valid push event
+    """
+    if not isinstance(payload, dict) or not isinstance(payload.get('repository'), dict):
+        raise ValueError('The payload is not a push event')
+    repository = payload['repository']
+    url = 'github.com/{}'.format(repository.get('full_name', ''))
+    username, name = parse_url(url)
+
+    commit_hash = payload.get('after', '')
+    if not COMMIT_HASH_PATTERN.match(commit_hash):
+        raise ValueError('The pushed commit hash is not valid')
+    default_branch = repository.get('default_branch') or repository.get('master_branch') or 'master'
+    if payload.get('ref') != 'refs/heads/' + default_branch or commit_hash == NULL_COMMIT_HASH:
+        return None
+    return GitRepository(url=url, username=username, name=name, latest_hash=commit_hash)
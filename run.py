@@ -1,9 +1,10 @@
 #!/usr/bin/env python
 from argparse import ArgumentParser
 
-from app import app
-
 if __name__ == "__main__":
+    # The app is imported here only, as the spawned lint workers import this module again
+    from app import app, start_background
+
     parser = ArgumentParser(
         description="Run a web server to analyze Python applications and report results."
     )
@@ -28,4 +29,5 @@ if __name__ == "__main__":
         help="Enable multi threading.",
     )
     arguments = parser.parse_args()
+    start_background()
     app.run(**vars(arguments))
@@ -0,0 +1,418 @@
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+from analyzer import analyze, analyze_index
+from analyzer.cache import DirectoryBudget, LintCache
+from analyzer.code import (CountAnalyzer, LintAnalyzer, LintError, MyPyAnalyser, PEP8LintAnalyzer, PyflakesLintAnalyzer,
+                           group_errors, iter_errors)
+from config import Config
+from analyzer.gitindex import build_git_index, changed_paths
+from analyzer.index import build_index
+from analyzer.sharding import LintPool, get_lint_pool, shard_files, shutdown_lint_pools
+from analyzer.timing import Timings
+
+
+def _write(root, relpath, content):
+    path = os.path.join(root, relpath)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def _commit_all(root):
+    """Commit all files of the directory to a new git repository and return the commit hash"""
+    git = ['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com']
+    subprocess.check_call(git + ['init', '-q', root])
+    subprocess.check_call(git + ['add', '-A', '-f'], cwd=root)
+    subprocess.check_call(git + ['commit', '-q', '-m', 'commit'], cwd=root)
+    return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=root).decode().strip()
+
+
+class AnalyzeTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        _write(self.path, 'main.py', 'import os\nx=1\n')
+        _write(self.path, 'pkg/util.py', 'def f( a ):\n  return b\n')
+        _write(self.path, 'README.md', '# sample\n')
+        self.cache_dir = tempfile.mkdtemp()
+        self.config_patch = mock.patch.multiple(Config, LINT_CACHE_DIR=self.cache_dir, MYPY_CACHE_DIR='')
+        self.config_patch.start()
+
+    def tearDown(self):
+        self.config_patch.stop()
+        shutil.rmtree(self.path)
+        shutil.rmtree(self.cache_dir)
+
+    def test_analyze_concurrent_matches_serial(self):
+        serial = analyze(self.path, workers=1)
+        concurrent = analyze(self.path, workers=6)
+        self.assertEqual(serial, concurrent)
+
+    def test_analyze_results(self):
+        results = analyze(self.path)
+        self.assertEqual(results['count']['file_count'], 2)
+        self.assertEqual(results['count']['line_count'], 4)
+        self.assertTrue(results['readme']['has_readme'])
+        self.assertFalse(results['license']['has_license'])
+        self.assertIn('report_grade', results)
+
+    def test_analyze_timings(self):
+        cold = analyze(self.path, timings=Timings())
+        warm = analyze(self.path, timings=Timings())
+        self.assertEqual(list(cold['timings']['stages']), ['index', 'analyze'])
+        self.assertEqual(cold['timings']['stages']['analyze']['files'], 2)
+        self.assertEqual(set(cold['timings']['analyzers']),
+                         {'count', 'pep8_lint', 'pyflakes_lint', 'mypy_lint', 'license', 'readme'})
+        pep8 = warm['timings']['analyzers']['pep8_lint']
+        self.assertEqual((pep8['linted_files'], pep8['cache_hits'], pep8['cache_misses']), (0, 2, 0))
+        self.assertNotIn('timings', analyze(self.path))
+
+
+class CountAnalyzerTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_count(self):
+        _write(self.path, 'a.py', 'a = 1\nb = 2\nc = 3')
+        _write(self.path, 'pkg/b.py', '\n' * 5)
+        _write(self.path, 'notes.txt', 'ignored\n')
+        count_analyzer = CountAnalyzer()
+        count_analyzer.run(build_index(self.path))
+        self.assertEqual(count_analyzer.file_count, 2)
+        self.assertEqual(count_analyzer.total_line_count, 7)
+        self.assertEqual(count_analyzer.average_line_count, 4)
+        self.assertEqual(count_analyzer.line_counts, {'a.py': 2, os.path.join('pkg', 'b.py'): 5})
+
+    def test_count_without_python_files(self):
+        count_analyzer = CountAnalyzer()
+        count_analyzer.run(build_index(self.path))
+        self.assertEqual(count_analyzer.file_count, 0)
+        self.assertEqual(count_analyzer.average_line_count, 0)
+
+
+class RepositoryIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_build_index(self):
+        _write(self.path, 'setup.py', 'import setuptools\n')
+        _write(self.path, 'LICENSE', 'MIT\n')
+        _write(self.path, 'pkg/__init__.py', '')
+        _write(self.path, 'docs/README.rst', 'docs\n')
+        index = build_index(self.path)
+        self.assertEqual([f.path for f in index.python_files], [os.path.join('pkg', '__init__.py'), 'setup.py'])
+        self.assertEqual(index.top_level_files, ['LICENSE', 'setup.py'])
+        self.assertTrue(index.has_file(('license',)))
+        self.assertTrue(index.has_file(('readme.rst',)))
+        self.assertFalse(index.has_file(('readme.md',)))
+
+    def test_build_index_excludes_dirs(self):
+        _write(self.path, 'main.py', 'x = 1\n')
+        _write(self.path, '.git/hooks/hook.py', 'x = 1\n')
+        _write(self.path, 'build/lib/main.py', 'x = 1\n')
+        _write(self.path, 'env/pyvenv.cfg', 'home = /usr/bin\n')
+        _write(self.path, 'env/lib/site.py', 'x = 1\n')
+        index = build_index(self.path)
+        self.assertEqual([f.path for f in index.files], ['main.py'])
+
+
+class LintCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cache_dir = tempfile.mkdtemp()
+        _write(self.path, 'a.py', 'import os\nx=1\n')
+        _write(self.path, 'b.py', 'def f( a ):\n  return b\n')
+        _write(self.path, 'c.py', 'x = 1\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        shutil.rmtree(self.cache_dir)
+
+    def _lint(self, analyzer_class, lint_cache=None):
+        analyzer = analyzer_class(lint_cache)
+        analyzer.run(build_index(self.path))
+        return [err.to_document() for err in analyzer.lint_error_list]
+
+    def test_cached_results_match_uncached(self):
+        for analyzer_class in (PEP8LintAnalyzer, PyflakesLintAnalyzer):
+            lint_cache = LintCache(self.cache_dir)
+            uncached = self._lint(analyzer_class)
+            self.assertEqual(self._lint(analyzer_class, lint_cache), uncached)
+            self.assertEqual(self._lint(analyzer_class, lint_cache), uncached)
+            self.assertEqual(lint_cache.hits, 3)
+            self.assertEqual(lint_cache.misses, 3)
+
+    def test_changed_file_is_relinted(self):
+        lint_cache = LintCache(self.cache_dir)
+        self._lint(PEP8LintAnalyzer, lint_cache)
+        _write(self.path, 'c.py', 'x=1\n')
+        error_docs = self._lint(PEP8LintAnalyzer, lint_cache)
+        self.assertEqual(lint_cache.hits, 2)
+        self.assertEqual(lint_cache.misses, 4)
+        self.assertEqual(error_docs, self._lint(PEP8LintAnalyzer))
+        self.assertIn('c.py', [doc['location'] for doc in error_docs])
+
+    def test_budget_removes_least_recently_used(self):
+        lint_cache = LintCache(self.cache_dir, budget=120)
+        error_docs = [[1, 'E225 missing whitespace around operator']]
+        keys = [LintCache.make_key('pep8_lint', '1', (), str(i)) for i in range(3)]
+        for i, key in enumerate(keys[:2]):
+            lint_cache.set(key, error_docs)
+            os.utime(lint_cache._entry_path(key), (i, i))
+        lint_cache.get(keys[0])
+        lint_cache.set(keys[2], error_docs)
+        self.assertEqual(lint_cache.get(keys[0]), error_docs)
+        self.assertIsNone(lint_cache.get(keys[1]))
+        self.assertEqual(lint_cache.get(keys[2]), error_docs)
+
+    def test_directory_budget(self):
+        budget = DirectoryBudget(self.cache_dir, budget=15)
+        removed = []
+        for i, name in enumerate(('a', 'b')):
+            with budget.use(name, on_remove=removed.append) as subdir:
+                _write(subdir, 'cache.json', '01234')
+            os.utime(subdir, (i, i))
+        with budget.use('c', on_remove=removed.append) as subdir:
+            _write(subdir, 'cache.json', '0123456')
+        self.assertEqual(removed, [os.path.join(self.cache_dir, 'a')])
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), ['b', 'c'])
+
+
+class LintAnalyzerTest(unittest.TestCase):
+    def test_parse_lint_message(self):
+        testcases = [
+            ('./a.py:2:1: E225 missing whitespace', ('a.py', 2, 'E225 missing whitespace')),
+            ('a.py:1: error: Name "b" is not defined', ('a.py', 1, 'error: Name "b" is not defined')),
+            ('C:\\src\\a.py:3:5: F401 \'os\' imported: unused', ('C:\\src\\a.py', 3, "F401 'os' imported: unused")),
+            ('Success: no issues found in 2 source files', None),
+            ('Found 2 errors in 1 file (checked 2 source files)', None),
+        ]
+        analyzer = LintAnalyzer()
+        for line, expected in testcases:
+            self.assertEqual(analyzer._parse_lint_message(line), expected)
+
+    def test_pyflakes_syntax_error(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        _write(path, 'broken.py', 'def f(:\n')
+        analyzer = PyflakesLintAnalyzer()
+        analyzer.run(build_index(path))
+        self.assertEqual([(err.location, err.line) for err in analyzer.lint_error_list], [('broken.py', 1)])
+
+    def test_pep8_reads_repository_config_only(self):
+        parent = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, parent)
+        _write(parent, 'tox.ini', '[pycodestyle]\nmax-line-length = 120\n')
+        path = os.path.join(parent, 'clone')
+        _write(path, 'main.py', 'x = {!r}\n'.format('x' * 90))
+        analyzer = PEP8LintAnalyzer()
+        analyzer.run(build_index(path))
+        self.assertEqual([err.message[:4] for err in analyzer.lint_error_list], ['E501'])
+
+        _write(path, 'setup.cfg', '[pycodestyle]\nmax-line-length = 100\n')
+        analyzer = PEP8LintAnalyzer()
+        analyzer.run(build_index(path))
+        self.assertEqual(analyzer.lint_error_list, [])
+
+    def test_group_errors(self):
+        errors = [LintError('a.py', '3', 'E1'), LintError('b.py', '1', 'E2'), LintError('a.py', '5', 'E3')]
+        self.assertIs(errors[0].location, errors[2].location)
+        error_files = group_errors((err.location, err.line, err.message) for err in errors)
+        self.assertEqual(error_files, [{'location': 'a.py', 'errors': [[3, 'E1'], [5, 'E3']]},
+                                       {'location': 'b.py', 'errors': [[1, 'E2']]}])
+        self.assertEqual(list(iter_errors({'error_files': error_files})),
+                         [('a.py', 3, 'E1'), ('a.py', 5, 'E3'), ('b.py', 1, 'E2')])
+        legacy = {'error_list': [{'location': 'a.py', 'line': '3', 'message': 'E1'}]}
+        self.assertEqual(list(iter_errors(legacy)), [('a.py', 3, 'E1')])
+
+
+class ShardingTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        for i in range(12):
+            _write(self.path, 'pkg%d/mod%d.py' % (i % 3, i), 'import os\nx=%d\n' % i + '\n' * i * 10)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_shard_files(self):
+        index = build_index(self.path)
+        shards = shard_files(index.python_files, 4)
+        self.assertEqual(len(shards), 4)
+        self.assertEqual(sorted(f.path for shard in shards for f in shard), [f.path for f in index.python_files])
+        sizes = [sum(f.size for f in shard) for shard in shards]
+        self.assertLessEqual(max(sizes) - min(sizes), max(f.size for f in index.python_files))
+
+    def test_sharded_results_match_serial(self):
+        index = build_index(self.path)
+        with LintPool(3) as lint_pool:
+            for analyzer_class in (PEP8LintAnalyzer, PyflakesLintAnalyzer):
+                serial = analyzer_class()
+                serial.run(index)
+                sharded = analyzer_class(lint_pool=lint_pool)
+                sharded.run(index)
+                self.assertEqual([err.to_document() for err in sharded.lint_error_list],
+                                 [err.to_document() for err in serial.lint_error_list])
+
+    def test_lint_pool_shared_by_analyses(self):
+        self.addCleanup(shutdown_lint_pools)
+        with mock.patch.multiple(Config, LINT_SHARD_MIN_FILES=1, LINT_CACHE_DIR='', MYPY_CACHE_DIR=''):
+            serial = analyze(self.path, processes=1)
+            self.assertEqual(analyze(self.path, processes=2), serial)
+            lint_pool = get_lint_pool(2)
+            self.assertEqual(analyze(self.path, processes=2), serial)
+        self.assertIs(get_lint_pool(2), lint_pool)
+        self.assertIsNot(get_lint_pool(3), lint_pool)
+
+
+class GitObjectIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        _write(self.path, 'main.py', 'import os\nx=1\n')
+        _write(self.path, 'pkg/util.py', 'def f( a ):\n  return b\n')
+        _write(self.path, 'README.md', '# sample\n')
+        _write(self.path, 'setup.cfg', '[pycodestyle]\nignore = E201\n')
+        _write(self.path, 'build/lib/main.py', 'x = 1\n')
+        _write(self.path, 'env/pyvenv.cfg', 'home = /usr/bin\n')
+        _write(self.path, 'env/lib/site.py', 'x = 1\n')
+        self.commit_hash = _commit_all(self.path)
+        self.cache_dir = tempfile.mkdtemp()
+        self.config_patch = mock.patch.multiple(Config, LINT_CACHE_DIR=self.cache_dir, MYPY_CACHE_DIR='')
+        self.config_patch.start()
+
+    def tearDown(self):
+        self.config_patch.stop()
+        shutil.rmtree(self.path)
+        shutil.rmtree(self.cache_dir)
+
+    def test_index_matches_checkout(self):
+        git_index = build_git_index(self.path, self.commit_hash)
+        index = build_index(self.path)
+        self.assertEqual([(f.path, f.size, f.line_count, f.blob_hash) for f in git_index.python_files],
+                         [(f.path, f.size, f.line_count, f.blob_hash) for f in index.python_files])
+        self.assertTrue(git_index.has_file(['readme.md']))
+        self.assertEqual(git_index.read_source(git_index.python_files[0]).lines, ['import os\n', 'x=1\n'])
+
+    def test_analyze_index_matches_checkout(self):
+        git_index = build_git_index(self.path, self.commit_hash, key=self.path)
+        try:
+            self.assertEqual(analyze_index(git_index), analyze(self.path))
+            local_path = git_index.local_path()
+            for relpath in ('main.py', 'pkg/util.py', 'setup.cfg'):
+                self.assertTrue(os.path.isfile(os.path.join(local_path, relpath)))
+            self.assertFalse(os.path.exists(os.path.join(local_path, 'README.md')))
+        finally:
+            git_index.close()
+        self.assertFalse(os.path.exists(local_path))
+
+    def test_incremental_matches_full(self):
+        Config.LINT_CACHE_DIR = ''
+        previous = analyze_index(build_git_index(self.path, self.commit_hash))
+        _write(self.path, 'main.py', 'import sys\nx = 1\n')
+        _write(self.path, 'pkg/new.py', 'y=2\n')
+        os.remove(os.path.join(self.path, 'pkg', 'util.py'))
+        commit_hash = _commit_all(self.path)
+        changed = changed_paths(self.path, self.commit_hash, commit_hash)
+        self.assertEqual(changed, {'main.py', 'pkg/new.py', 'pkg/util.py'})
+
+        _write(self.path, 'kept.py', 'import os\n')
+        commit_hash = _commit_all(self.path)
+        changed = changed_paths(self.path, self.commit_hash, commit_hash) - {'kept.py'}
+        previous['pyflakes_lint']['error_files'].append({'location': 'kept.py', 'errors': [[1, 'reused']]})
+        index = build_git_index(self.path, commit_hash)
+        lint_files = PyflakesLintAnalyzer._lint_files
+        with mock.patch.object(PyflakesLintAnalyzer, '_lint_files', autospec=True, side_effect=lint_files) as linted:
+            incremental = analyze_index(index, previous_results=previous, changed_paths=changed)
+        self.assertEqual([f.path for f in linted.call_args[0][2]], ['main.py', 'pkg/new.py'])
+        self.assertIn(('kept.py', 1, 'reused'), list(iter_errors(incremental['pyflakes_lint'])))
+
+        previous['pyflakes_lint']['tool'] = 'other version'
+        self.assertEqual(analyze_index(index, previous_results=previous, changed_paths=changed),
+                         analyze_index(index))
+
+    def test_subset_is_picklable(self):
+        git_index = build_git_index(self.path, self.commit_hash)
+        subset = pickle.loads(pickle.dumps(git_index.subset(git_index.python_files[1:])))
+        analyzer = PEP8LintAnalyzer()
+        try:
+            analyzer._lint_files(subset, subset.python_files)
+        finally:
+            subset.close()
+        self.assertEqual([err.line for err in analyzer.lint_error_list], [1, 2])
+
+
+class MyPyAnalyserTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.cache_dir = tempfile.mkdtemp()
+        _write(self.path, 'a.py', 'x: int = 1\n')
+        _write(self.path, 'pkg/b.py', 'y: int = "y"\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+        shutil.rmtree(self.cache_dir)
+
+    def _run(self):
+        analyzer = MyPyAnalyser()
+        analyzer.run(build_index(self.path))
+        return analyzer
+
+    def test_run_without_cache(self):
+        with mock.patch.object(Config, 'MYPY_CACHE_DIR', ''):
+            analyzer = self._run()
+        self.assertIsNone(analyzer.cache_stats)
+        self.assertEqual([(err.location, err.line) for err in analyzer.lint_error_list],
+                         [(os.path.join('pkg', 'b.py'), 1)])
+
+    def test_incremental_cache(self):
+        with mock.patch.object(Config, 'MYPY_CACHE_DIR', self.cache_dir):
+            cold = self._run()
+            warm = self._run()
+        self.assertEqual(cold.cache_stats, {'fresh_files': 0, 'stale_files': 2})
+        self.assertEqual(warm.cache_stats, {'fresh_files': 2, 'stale_files': 0})
+        self.assertEqual([err.to_document() for err in warm.lint_error_list],
+                         [err.to_document() for err in cold.lint_error_list])
+
+    @unittest.skipIf(shutil.which('dmypy') is None, 'dmypy is not installed')
+    def test_daemon_restarted_in_moved_directory(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        first_path, moved_path = os.path.join(root, 'first'), os.path.join(root, 'moved')
+        shutil.copytree(self.path, first_path)
+        shutil.copytree(self.path, moved_path)
+        with mock.patch.multiple(Config, MYPY_CACHE_DIR=self.cache_dir, MYPY_DAEMON=True):
+            first = MyPyAnalyser()
+            try:
+                first.run(build_index(first_path, 'key'))
+                shutil.rmtree(first_path)
+                moved = MyPyAnalyser()
+                moved.run(build_index(moved_path, 'key'))
+            finally:
+                subprocess.run(first._daemon_command(first._cache_dir(build_index(moved_path, 'key'))) + ['stop'],
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.assertEqual(len(first.lint_error_list), 1)
+        self.assertEqual([err.to_document() for err in moved.lint_error_list],
+                         [err.to_document() for err in first.lint_error_list])
+
+    def test_crash_raises(self):
+        with mock.patch.object(MyPyAnalyser, '_make_command', return_value=[sys.executable, '-c', 'exit(2)']):
+            with self.assertRaises(subprocess.CalledProcessError):
+                self._run()
+
+    def test_blocking_error_is_reported(self):
+        _write(self.path, 'broken.py', 'def f(:\n')
+        with mock.patch.object(Config, 'MYPY_CACHE_DIR', ''):
+            analyzer = self._run()
+        self.assertEqual({err.location for err in analyzer.lint_error_list}, {'broken.py'})
@@ -0,0 +1,55 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from benchmarks.pipeline import FORMAT_VERSION, compare
+from benchmarks.synthetic import Shape, make_repository
+
+
+class SyntheticRepositoryTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _make(self, name, shape):
+        root = os.path.join(self.root, name)
+        os.makedirs(root)
+        git_url, stats = make_repository(root, shape)
+        commit_hash = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=git_url[len('file://'):])
+        return commit_hash, stats
+
+    def test_same_shape_same_commit(self):
+        shape = Shape(files=5, lines=30, warning_density=0.5, depth=3, blobs=1, blob_size=100)
+        commit_hash, stats = self._make('first', shape)
+        self.assertEqual(self._make('second', shape)[0], commit_hash)
+        self.assertEqual(stats['files'], 8)
+        self.assertEqual(stats['python_files'], 5)
+        self.assertEqual(stats['lines'], 150)
+        self.assertGreater(stats['warnings'], 0)
+        self.assertNotEqual(self._make('seed', Shape(files=5, lines=30, warning_density=0.5, seed=1))[0],
+                            commit_hash)
+
+    def test_scaled(self):
+        shape = Shape(files=10, blobs=2, blob_size=1000).scaled(0.05)
+        self.assertEqual((shape.files, shape.blobs, shape.blob_size), (1, 2, 50))
+
+
+class CompareTest(unittest.TestCase):
+    @staticmethod
+    def _report(seconds, scale=1.0):
+        return {'format': FORMAT_VERSION, 'scale': scale,
+                'scenarios': {'small': {'stages': {'clone': {'wall_seconds': seconds}, 'count': {}}}}}
+
+    def test_regression(self):
+        comparison = compare(self._report(1.5), self._report(1.0), 0.2)
+        self.assertEqual(comparison['ratios'], {'small': {'clone': 1.5}})
+        self.assertEqual(comparison['regressions'], [{'scenario': 'small', 'stage': 'clone', 'ratio': 1.5}])
+        self.assertEqual(compare(self._report(1.1), self._report(1.0), 0.2)['regressions'], [])
+
+    def test_other_scale(self):
+        with self.assertRaises(ValueError):
+            compare(self._report(1.0), self._report(1.0, scale=0.5), 0.2)
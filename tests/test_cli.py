@@ -0,0 +1,122 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from analyzer import analyze
+from cli.batch import format_summary, read_targets, run_batch, summarize
+from cli.formatting import ResultWriter, format_results, make_writer
+from config import Config
+from tests.test_vcs import make_bare_repository
+
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.local_path = os.path.join(self.root, 'local')
+        os.makedirs(self.local_path)
+        with open(os.path.join(self.local_path, 'main.py'), 'w') as f:
+            f.write('import os\n')
+        self.git_url, _ = make_bare_repository(self.root, {'pkg/util.py': 'x = 1\ny = 2\n'})
+        self.cache_dir = os.path.join(self.root, 'lint_cache')
+        self.config_patch = mock.patch.multiple(Config, LINT_CACHE_DIR=self.cache_dir, MYPY_CACHE_DIR='')
+        self.config_patch.start()
+
+    def tearDown(self):
+        self.config_patch.stop()
+        shutil.rmtree(self.root)
+
+    def test_read_targets(self):
+        input_file = io.StringIO('# nightly\nb\n\n  c  \na\n')
+        self.assertEqual(read_targets(['a', 'b'], input_file), ['a', 'b', 'c'])
+        self.assertEqual(read_targets(['a']), ['a'])
+
+    def test_run_batch(self):
+        output = io.StringIO()
+        targets = [self.local_path, self.git_url, 'github.com/not a repository']
+        summary = run_batch(targets, output, jobs=2)
+        records = {record['target']: record for record in map(json.loads, output.getvalue().splitlines())}
+        self.assertEqual(set(records), set(targets))
+        self.assertEqual(records[self.local_path]['results']['count']['line_count'], 1)
+        self.assertEqual(records[self.git_url]['results']['count']['line_count'], 2)
+        self.assertIn('clone_seconds', records[self.git_url])
+        self.assertEqual(records['github.com/not a repository']['status'], 'error')
+        self.assertEqual((summary['targets'], summary['graded'], summary['failed']), (3, 2, 1))
+        self.assertEqual(sum(summary['grades'].values()), 2)
+        self.assertIn('Graded 2 of 3 repositories', format_summary(summary))
+        self.assertTrue(os.listdir(self.cache_dir))
+
+    def test_summarize_without_records(self):
+        summary = summarize([], 0)
+        self.assertEqual(summary['targets'], 0)
+        self.assertEqual(summary['target_seconds']['max'], 0)
+        self.assertEqual(summary['lines_per_second'], 0)
+
+
+class FormattingTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        with open(os.path.join(self.path, 'main.py'), 'w') as f:
+            f.write('import os\nx=1\n')
+        self.config_patch = mock.patch.multiple(Config, LINT_CACHE_DIR='', MYPY_CACHE_DIR='')
+        self.config_patch.start()
+        self.results = analyze(self.path)
+
+    def tearDown(self):
+        self.config_patch.stop()
+        shutil.rmtree(self.path)
+
+    def _write(self, output_format, **kwargs):
+        output = io.StringIO()
+        writer = make_writer(output_format, output, **kwargs)
+        writer.write_results(analyze(self.path, on_lint_errors=writer.write_errors))
+        return output.getvalue()
+
+    def test_text(self):
+        self.assertEqual(self._write('text', verbose=True), format_results(self.results, verbose=True) + '\n')
+
+    def test_json(self):
+        self.assertEqual(json.loads(self._write('json')), self.results)
+
+    def test_json_leaves_written_errors_out_of_results(self):
+        output = io.StringIO()
+        writer = make_writer('json', output)
+        results = analyze(self.path, on_lint_errors=writer.write_errors)
+        self.assertNotIn('error_files', results['pep8_lint'])
+        self.assertEqual(results['pep8_lint']['error_count'], 1)
+        writer.write_results(results)
+        self.assertEqual(json.loads(output.getvalue()), self.results)
+
+    def test_ndjson_streams_errors_first(self):
+        records = [json.loads(line) for line in self._write('ndjson').splitlines()]
+        errors = [record for record in records if record['type'] == 'error']
+        self.assertEqual(records[:len(errors)], errors)
+        self.assertEqual(sorted((error['analyzer'], error['line']) for error in errors),
+                         [('pep8_lint', 2), ('pyflakes_lint', 1)])
+        self.assertEqual(records[-1], {'type': 'grade', 'report_grade': self.results['report_grade']})
+
+    def test_ndjson_without_streaming(self):
+        output = io.StringIO()
+        make_writer('ndjson', output).write_results(self.results)
+        records = [json.loads(line) for line in output.getvalue().splitlines()]
+        self.assertEqual(len([record for record in records if record['type'] == 'error']), 2)
+
+    def test_writer_needs_write_results(self):
+        with self.assertRaises(TypeError):
+            ResultWriter(io.StringIO())
+
+    def test_sarif(self):
+        self.results['mypy_lint']['error_files'].append(
+            {'location': 'main.py', 'errors': [[2, 'error: Incompatible types  [assignment]']]})
+        output = io.StringIO()
+        make_writer('sarif', output).write_results(self.results)
+        log = json.loads(output.getvalue())
+        self.assertEqual(log['version'], '2.1.0')
+        results = {run['tool']['driver']['name']: run['results'] for run in log['runs']}
+        self.assertEqual(results['pycodestyle'][0]['ruleId'], 'E225')
+        self.assertEqual(results['pycodestyle'][0]['locations'][0]['physicalLocation']['region'], {'startLine': 2})
+        self.assertNotIn('ruleId', results['pyflakes'][0])
+        self.assertEqual((results['mypy'][0]['ruleId'], results['mypy'][0]['level']), ('assignment', 'error'))
@@ -0,0 +1,73 @@
+import unittest
+from unittest import mock
+
+from config import Config
+from db import codec, collection
+from db.memory import TTLCache
+
+
+class CollectionTest(unittest.TestCase):
+    def test_shared_client(self):
+        client = collection.get_client()
+        self.assertIs(collection.get_client(), client)
+        self.assertEqual(collection.get_repo_collection().full_name, Config.MONGO_DBNAME + '.repositories')
+
+    def test_new_client_after_fork(self):
+        client = collection.get_client()
+        with mock.patch('os.getpid', return_value=-1):
+            forked_client = collection.get_client()
+        self.assertIsNot(forked_client, client)
+        self.assertEqual(forked_client.options.pool_options.max_pool_size, Config.MONGO_MAX_POOL_SIZE)
+
+
+class TTLCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 0
+        self.cache = TTLCache(2, 10, clock=lambda: self.now)
+
+    def test_get_set(self):
+        self.assertIsNone(self.cache.get('a'))
+        self.cache.set('a', 1)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+
+    def test_expire(self):
+        self.cache.set('a', 1)
+        self.now = 10
+        self.assertIsNone(self.cache.get('a'))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_evict_least_recently_used(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+        self.cache.set('c', 3)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('c'), 3)
+
+
+class CodecTest(unittest.TestCase):
+    def setUp(self):
+        self.errors = [[1, 'E225 missing whitespace around operator'], [3, "F401 'os' imported but unused"]] * 50
+
+    def test_round_trip(self):
+        for codec_name in codec.CODECS:
+            encoded = codec.encode(self.errors, codec_name)
+            self.assertTrue(codec.is_encoded(encoded))
+            self.assertLess(len(encoded['data']), len(str(self.errors)) // 10)
+            self.assertEqual(codec.decode(encoded), self.errors)
+
+    def test_raw(self):
+        self.assertIs(codec.encode(self.errors, ''), self.errors)
+        self.assertIs(codec.decode(self.errors), self.errors)
+
+    def test_zstd_fallback(self):
+        with mock.patch.object(codec, 'zstandard', None):
+            encoded = codec.encode(self.errors, 'zstd')
+        self.assertEqual(encoded['codec'], 'zlib')
+        self.assertEqual(codec.decode(encoded), self.errors)
+
+    def test_unknown_codec(self):
+        with self.assertRaises(ValueError):
+            codec.encode(self.errors, 'lzma')
@@ -0,0 +1,325 @@
+import datetime
+import hashlib
+import hmac
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from analyzer.timing import Timings
+from config import Config
+from jobs.metrics import CallbackMetric, Counter, Histogram, Registry
+from jobs.queue import JOB_DONE, JOB_FAILED, JOB_QUEUED, JobQueue, _analyze_objects, analyze_repository
+from jobs.scheduler import RegradeScheduler, TokenBucket
+from jobs.webhook import parse_push_event, verify_signature
+from tests.test_vcs import make_bare_repository
+from vcs import repository
+from vcs.git import resolve_head
+from vcs.mirror import MirrorStore
+from vcs.repository import GitRepository
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _repo(name, latest_hash='0' * 40):
+    return GitRepository(url='github.com/mingrammer/' + name, username='mingrammer', name=name,
+                         latest_hash=latest_hash)
+
+
+def _push_payload(name, commit_hash, ref='refs/heads/master'):
+    return {
+        'ref': ref,
+        'after': commit_hash,
+        'repository': {'full_name': 'mingrammer/' + name, 'default_branch': 'master'},
+    }
+
+
+class JobQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.repo = GitRepository(url='github.com/mingrammer/awesome-finder', username='mingrammer',
+                                  name='awesome-finder', latest_hash='0' * 40)
+
+    def test_submit(self):
+        analyzed = []
+        job_queue = JobQueue(2, target=analyzed.append)
+        job = job_queue.submit(self.repo)
+        job_queue.shutdown()
+        self.assertEqual(job_queue.get(job.id).status, JOB_DONE)
+        self.assertEqual(analyzed, [self.repo])
+        self.assertEqual(job.to_document()['url'], self.repo.url)
+
+    def test_failed_job(self):
+        def fail(repo):
+            raise Exception('Cloning failed error')
+
+        job_queue = JobQueue(1, target=fail)
+        job = job_queue.submit(self.repo)
+        job_queue.shutdown()
+        self.assertEqual(job.status, JOB_FAILED)
+        self.assertEqual(job.error, 'Cloning failed error')
+
+    def test_depth(self):
+        release = threading.Event()
+        job_queue = JobQueue(1, target=lambda repo: release.wait())
+        jobs = [job_queue.submit(GitRepository(url=self.repo.url, latest_hash=str(i) * 40)) for i in range(3)]
+        self.assertEqual(jobs[-1].status, JOB_QUEUED)
+        self.assertGreaterEqual(job_queue.depth, 2)
+        release.set()
+        job_queue.shutdown()
+        self.assertEqual(job_queue.depth, 0)
+        self.assertIsNone(job_queue.get('unknown'))
+
+    def test_coalesce_same_commit(self):
+        release = threading.Event()
+        analyzed = []
+
+        def target(repo):
+            release.wait()
+            analyzed.append(repo)
+
+        job_queue = JobQueue(4, target=target)
+        jobs = [job_queue.submit(self.repo) for _ in range(5)]
+        other_commit = GitRepository(url=self.repo.url, username=self.repo.username,
+                                     name=self.repo.name, latest_hash='1' * 40)
+        other_job = job_queue.submit(other_commit)
+        release.set()
+        self.assertTrue(jobs[0].wait(5))
+        self.assertTrue(other_job.wait(5))
+        next_job = job_queue.submit(self.repo)
+        job_queue.shutdown()
+        self.assertEqual({job.id for job in jobs}, {jobs[0].id})
+        self.assertNotEqual(other_job.id, jobs[0].id)
+        self.assertEqual(jobs[0].requests, 5)
+        self.assertEqual(job_queue.coalesced, 4)
+        self.assertEqual(len(analyzed), 3)
+        self.assertNotEqual(next_job.id, jobs[0].id)
+
+
+class TokenBucketTest(unittest.TestCase):
+    def test_take(self):
+        clock = FakeClock()
+        bucket = TokenBucket(0.5, 2, clock)
+        self.assertEqual([bucket.take() for _ in range(3)], [True, True, False])
+        clock.now = 1
+        self.assertFalse(bucket.take())
+        clock.now = 2
+        self.assertTrue(bucket.take())
+        clock.now = 100
+        self.assertEqual([bucket.take() for _ in range(3)], [True, True, False])
+
+
+class RegradeSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.release = threading.Event()
+        self.analyzed = []
+        self.job_queue = JobQueue(4, target=self._target)
+        self.stale_documents = []
+        self.checked = []
+        self.views = []
+        self.cached = set()
+
+    def tearDown(self):
+        self.release.set()
+        self.job_queue.shutdown()
+
+    def _target(self, repo):
+        self.release.wait()
+        self.analyzed.append(repo.name)
+
+    def _scheduler(self, max_running=2, rate=1, burst=1):
+        return RegradeScheduler(self.job_queue, max_running, rate, burst, scan_interval=60, clock=self.clock,
+                                find_stale=lambda before, limit: self.stale_documents,
+                                resolve=lambda urls: {url: '1' * 40 for url in urls},
+                                save_checked=lambda urls, checked: self.checked.extend(urls),
+                                save_views=self.views.append, check_cached=self._is_cached)
+
+    def _is_cached(self, repo):
+        return repo.name in self.cached
+
+    def test_rate_limit_and_cap(self):
+        scheduler = self._scheduler()
+        for name in ('a', 'b', 'c'):
+            scheduler.push(_repo(name))
+        jobs = scheduler.tick()
+        self.assertEqual(len(jobs), 1)
+        self.assertEqual(scheduler.tick(), [])
+        self.clock.now = 1
+        jobs += scheduler.tick()
+        self.assertEqual(len(jobs), 2)
+        self.clock.now = 2
+        self.assertEqual(scheduler.tick(), [])
+        self.assertEqual(scheduler.depth, 1)
+
+        self.release.set()
+        self.assertTrue(all(job.wait(5) for job in jobs))
+        self.assertEqual([job.repo.name for job in scheduler.tick()], ['c'])
+        self.assertEqual(scheduler.depth, 0)
+
+    def test_scan_priority(self):
+        now = datetime.datetime.now()
+        self.stale_documents = [
+            {'url': 'github.com/mingrammer/popular', 'last_latest_hash': '0' * 40,
+             'date': now - datetime.timedelta(hours=1), 'views': 100},
+            {'url': 'github.com/mingrammer/old', 'last_latest_hash': '0' * 40,
+             'date': now - datetime.timedelta(hours=10)},
+            {'url': 'github.com/mingrammer/unchanged', 'last_latest_hash': '1' * 40,
+             'date': now - datetime.timedelta(hours=100)},
+        ]
+        scheduler = self._scheduler(max_running=5, burst=5)
+        scheduler.push(_repo('pushed'))
+        scheduler.record_view('github.com/mingrammer/popular')
+        scheduler.record_view('github.com/mingrammer/popular')
+        jobs = scheduler.tick()
+        self.assertEqual([job.repo.name for job in jobs], ['pushed', 'old', 'popular'])
+        self.assertEqual(jobs[1].repo.latest_hash, '1' * 40)
+        self.assertEqual(len(self.checked), 3)
+        self.assertEqual(self.views, [{'github.com/mingrammer/popular': 2}])
+
+        self.clock.now = 30
+        self.assertEqual(scheduler.tick(), [])
+        self.assertEqual(len(self.checked), 3)
+
+    def test_scan_skips_invalid_url(self):
+        self.stale_documents = [
+            {'url': 'gitlab.com/mingrammer/invalid', 'last_latest_hash': '0' * 40},
+            {'url': 'github.com/mingrammer/valid', 'last_latest_hash': '0' * 40},
+        ]
+        jobs = self._scheduler().tick()
+        self.assertEqual([job.repo.name for job in jobs], ['valid'])
+        self.assertEqual(len(self.checked), 2)
+
+    def test_cached_push_is_skipped(self):
+        self.cached.add('cached')
+        scheduler = self._scheduler(burst=2)
+        scheduler.push(_repo('cached'))
+        scheduler.push(_repo('pushed'))
+        self.assertEqual([job.repo.name for job in scheduler.tick()], ['pushed'])
+        self.assertEqual(scheduler.depth, 0)
+
+
+class WebhookTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.git_url, _ = make_bare_repository(os.path.join(self.root, 'mingrammer', 'sample'),
+                                               {'main.py': 'import os\nx = 1\n', 'README.md': '# sample\n'})
+        self.commit_hash = resolve_head(self.git_url)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_verify_signature(self):
+        body = b'{"zen": "Keep it logically awesome."}'
+        signature = 'sha256=' + hmac.new(b'secret', body, hashlib.sha256).hexdigest()
+        self.assertTrue(verify_signature('secret', body, signature))
+        self.assertFalse(verify_signature('other', body, signature))
+        self.assertFalse(verify_signature('secret', body, None))
+
+    def test_parse_push_event(self):
+        repo = parse_push_event(_push_payload('sample', self.commit_hash))
+        self.assertEqual((repo.url, repo.latest_hash), ('github.com/mingrammer/sample', self.commit_hash))
+        self.assertIsNone(parse_push_event(_push_payload('sample', self.commit_hash, 'refs/heads/feature')))
+        self.assertIsNone(parse_push_event(_push_payload('sample', '0' * 40)))
+        for payload in (None, {'zen': 'hello'}, _push_payload('sample', 'HEAD'), _push_payload('a/b/c', '0' * 40)):
+            with self.assertRaises(ValueError):
+                parse_push_event(payload)
+
+    def test_push_regrades_local_repository(self):
+        results = []
+        config_patch = mock.patch.multiple(
+            Config, GIT_URL_TEMPLATE='file://' + self.root + '/{username}/{name}/origin.git',
+            ANALYZE_INCREMENTAL=False, LINT_CACHE_DIR='', MYPY_CACHE_DIR='')
+        mirror_patch = mock.patch.object(repository, 'mirror_store', MirrorStore(os.path.join(self.root, 'mirrors')))
+        with config_patch, mirror_patch:
+            job_queue = JobQueue(1, target=lambda repo: results.append(_analyze_objects(repo, Timings())))
+            scheduler = RegradeScheduler(job_queue, 1, 1, save_views=None,
+                                         find_stale=lambda before, limit: [], check_cached=lambda repo: False)
+            scheduler.push(parse_push_event(_push_payload('sample', self.commit_hash)))
+            jobs = scheduler.tick()
+            job_queue.shutdown()
+        self.assertEqual(jobs[0].status, JOB_DONE)
+        self.assertEqual(results[0]['count']['line_count'], 2)
+        self.assertTrue(results[0]['readme']['has_readme'])
+        self.assertEqual(results[0]['pyflakes_lint']['error_files'][0]['errors'][0][1], "'os' imported but unused")
+        self.assertEqual(list(results[0]['timings']['stages']), ['fetch', 'index', 'analyze'])
+        self.assertEqual(results[0]['timings']['analyzers']['pyflakes_lint']['linted_files'], 1)
+
+    def test_forged_push_saved_under_fetched_commit(self):
+        config_patch = mock.patch.multiple(
+            Config, GIT_URL_TEMPLATE='file://' + self.root + '/{username}/{name}/origin.git',
+            ANALYZE_INCREMENTAL=False, LINT_CACHE_DIR='', MYPY_CACHE_DIR='')
+        mirror_patch = mock.patch.object(repository, 'mirror_store', MirrorStore(os.path.join(self.root, 'mirrors')))
+        repo = parse_push_event(_push_payload('sample', 'ab' * 20))
+        with config_patch, mirror_patch:
+            job_queue = JobQueue(1, target=lambda repo: _analyze_objects(repo, Timings()))
+            job = job_queue.submit(repo)
+            job_queue.shutdown()
+        self.assertEqual(job.status, JOB_DONE)
+        self.assertEqual(repo.latest_hash, self.commit_hash)
+        self.assertEqual(job.key, (repo.url, 'ab' * 20))
+        self.assertEqual(job_queue._active_jobs, {})
+
+    def test_moved_head_is_resolved_again(self):
+        config_patch = mock.patch.multiple(
+            Config, GIT_URL_TEMPLATE='file://' + self.root + '/{username}/{name}/origin.git',
+            MIRROR_DIR=os.path.join(self.root, 'mirrors'), ANALYZE_FROM_OBJECTS=True, ANALYZE_INCREMENTAL=False,
+            LINT_CACHE_DIR='', MYPY_CACHE_DIR='')
+        mirror_patch = mock.patch.object(repository, 'mirror_store', MirrorStore(os.path.join(self.root, 'mirrors')))
+        repo = parse_push_event(_push_payload('sample', 'ab' * 20))
+        repository.latest_hash_cache.set(repo.url, 'ab' * 20)
+        self.addCleanup(repository.latest_hash_cache.pop, repo.url)
+        with config_patch, mirror_patch, mock.patch('jobs.queue.cache') as cache:
+            analyze_repository(repo)
+        cache.assert_called_once_with(repo)
+        self.assertEqual(repo.latest_hash, self.commit_hash)
+        self.assertIsNone(repository.latest_hash_cache.get(repo.url))
+
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter(self):
+        counter = self.registry.register(Counter('files_total', 'Files', ('stage',)))
+        counter.inc(2, stage='index')
+        counter.inc(stage='index')
+        self.assertEqual(counter.get(stage='index'), 3)
+        with self.assertRaises(ValueError):
+            counter.inc(analyzer='pep8_lint')
+        self.assertEqual(self.registry.render(),
+                         '# HELP files_total Files\n# TYPE files_total counter\nfiles_total{stage="index"} 3\n')
+
+    def test_histogram(self):
+        histogram = self.registry.register(Histogram('seconds', 'Seconds', buckets=(1, 5)))
+        for value in (0.5, 2, 10):
+            histogram.observe(value)
+        lines = self.registry.render().splitlines()
+        self.assertEqual(lines[2:], ['seconds_bucket{le="1"} 1', 'seconds_bucket{le="5"} 2',
+                                     'seconds_bucket{le="+Inf"} 3', 'seconds_sum 12.5', 'seconds_count 3'])
+
+    def test_callback(self):
+        depth = {'value': 4}
+        self.registry.register(CallbackMetric('queue_depth', 'Depth', lambda: depth['value']))
+        self.registry.register(CallbackMetric('cache_hits_total', 'Hits', lambda: {('report',): 2},
+                                              'counter', ('cache',)))
+        lines = self.registry.render().splitlines()
+        self.assertIn('queue_depth 4', lines)
+        self.assertIn('# TYPE cache_hits_total counter', lines)
+        self.assertIn('cache_hits_total{cache="report"} 2', lines)
+
+    def test_timings(self):
+        timings = Timings()
+        with timings.stage('index', size=10) as measurement:
+            measurement['files'] = 2
+        self.assertEqual(timings.stages['index']['files'], 2)
+        self.assertEqual(timings.stages['index']['bytes'], 10)
+        self.assertGreaterEqual(timings.stages['index']['wall_seconds'], 0)
+        self.assertEqual(set(timings.to_document()['timings']), {'stages', 'analyzers'})
@@ -1,10 +1,58 @@
 import os
 import shutil
+import subprocess
+import tempfile
 import unittest
+from unittest import mock
 
+from analyzer.gitindex import build_git_index, changed_paths
 from config import Config
-from db.collection import get_repo_collection
-from vcs.repository import cache, clear, clone, create_repository, is_cached, parse_url
+from db import codec
+from db.collection import get_error_collection, get_repo_collection
+from vcs import git
+from vcs.git import clone_url, git_version, missing_objects, resolve_head, resolve_heads
+from vcs.mirror import MirrorStore
+from vcs.repository import (cache, clear, clone, create_repository, get_cached_document, get_error_page, is_cached,
+                            join_errors, parse_url, slice_error_docs, split_errors)
+
+
+def _git(*args, cwd=None):
+    cmd = ['git', '-c', 'user.name=test', '-c', 'user.email=test@example.com', '-c', 'init.defaultBranch=master']
+    output = subprocess.check_output(cmd + list(args), cwd=cwd, stderr=subprocess.DEVNULL)
+    return output.decode().strip()
+
+
+def make_bare_repository(root, files):
+    """Create a local bare repository with a commit of the given files
+
+    Returns:
+        A tuple of the 'file://' URL and the work tree path to make more commits
+    """
+    work_tree = os.path.join(root, 'work')
+    bare = os.path.join(root, 'origin.git')
+    _git('init', '-q', work_tree)
+    commit_files(work_tree, files)
+    _git('clone', '-q', '--bare', work_tree, bare)
+    _git('config', 'uploadpack.allowFilter', 'true', cwd=bare)
+    _git('remote', 'add', 'origin', bare, cwd=work_tree)
+    return 'file://' + bare, work_tree
+
+
+def commit_files(work_tree, files, push=False):
+    """Commit the files, given as a dict of path to content or None to delete"""
+    for relpath, content in files.items():
+        path = os.path.join(work_tree, relpath)
+        if content is None:
+            _git('rm', '-q', relpath, cwd=work_tree)
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content.encode() if isinstance(content, str) else content)
+        _git('add', relpath, cwd=work_tree)
+    _git('commit', '-q', '-m', 'commit', cwd=work_tree)
+    if push:
+        _git('push', '-q', 'origin', 'HEAD:master', cwd=work_tree)
+    return _git('rev-parse', 'HEAD', cwd=work_tree)
 
 
 class RepositoryTest(unittest.TestCase):
@@ -15,7 +63,7 @@ class RepositoryTest(unittest.TestCase):
     def tearDown(self):
         self.repositories.delete_one({'url': self.repo.url})
         if os.path.isdir(Config.CLONE_TMP_DIR):
-            cloned_path = os.path.join(Config.CLONE_TMP_DIR, self.repo.name)
+            cloned_path = os.path.join(Config.CLONE_TMP_DIR, self.repo.username)
             if os.path.isdir(cloned_path):
                 shutil.rmtree(cloned_path)
             else:
@@ -80,9 +128,32 @@ class RepositoryTest(unittest.TestCase):
         cache(self.repo)
         self.assertEqual(is_cached(self.repo), True)
 
+    def test_get_cached_document(self):
+        self.assertIsNone(get_cached_document(self.repo))
+        cache(self.repo)
+        repo_doc = get_cached_document(self.repo)
+        self.assertEqual(repo_doc['url'], self.repo.url)
+        self.assertEqual(repo_doc['last_latest_hash'], self.repo.latest_hash)
+        self.assertNotIn('_id', repo_doc)
+
+    def test_error_page(self):
+        self.repo.save_analysis_results({'pep8_lint': {
+            'error_files': [{'location': 'b.py', 'errors': [[1, 'E1']]},
+                            {'location': 'a.py', 'errors': [[1, 'E1'], [2, 'E2'], [3, 'E3']]}],
+            'error_count': 4,
+            'score': 90,
+        }})
+        self.addCleanup(get_error_collection().delete_many, {'url': self.repo.url})
+        with mock.patch.object(Config, 'LINT_ERRORS_PER_DOCUMENT', 2):
+            cache(self.repo)
+        error_files, page_count = get_error_page(self.repo.url, self.repo.latest_hash, 'pep8_lint', 2, 3)
+        self.assertEqual(error_files, [{'location': 'b.py', 'errors': [[1, 'E1']]}])
+        self.assertEqual(page_count, 2)
+
     def test_clone(self):
         cloned_path = clone(self.repo)
-        self.assertEqual(cloned_path, os.path.join(Config.CLONE_TMP_DIR, self.repo.name))
+        self.assertEqual(cloned_path, os.path.join(Config.CLONE_TMP_DIR, self.repo.username, self.repo.name,
+                                                   self.repo.latest_hash))
 
     def test_clone_fail(self):
         self.repo.url = 'github.com/mingrammer/null'
@@ -96,3 +167,212 @@ class RepositoryTest(unittest.TestCase):
         os.mkdir(os.path.join(parent_dir, child_dir))
         clear(parent_dir)
         self.assertEqual(os.path.isdir(parent_dir), False)
+
+
+class ErrorStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.results = {
+            'report_grade': 'A',
+            'count': {'file_count': 2},
+            'pep8_lint': {
+                'error_files': [{'location': 'a.py', 'errors': [[1, 'E1'], [2, 'E2'], [3, 'E3']]},
+                                {'location': 'b.py', 'errors': [[1, 'E1']]}],
+                'error_count': 4,
+                'score': 90,
+            },
+            'pyflakes_lint': {'error_files': [], 'error_count': 0, 'score': 100},
+        }
+
+    def test_split_errors(self):
+        summary, error_docs = split_errors('github.com/a/b', 'abc', self.results, 2)
+        self.assertEqual(summary['pep8_lint'], {'error_file_count': 2, 'error_count': 4, 'score': 90})
+        self.assertEqual(summary['count'], {'file_count': 2})
+        self.assertIn('error_files', self.results['pep8_lint'])
+        self.assertEqual([(doc['analyzer'], doc['location'], doc['chunk'], doc['errors']) for doc in error_docs],
+                         [('pep8_lint', 'a.py', 0, [[1, 'E1'], [2, 'E2']]), ('pep8_lint', 'a.py', 1, [[3, 'E3']]),
+                          ('pep8_lint', 'b.py', 0, [[1, 'E1']])])
+        self.assertEqual({(doc['url'], doc['commit']) for doc in error_docs}, {('github.com/a/b', 'abc')})
+        self.assertEqual([(doc['start'], doc['end']) for doc in error_docs], [(0, 2), (2, 3), (3, 4)])
+
+    def test_slice_error_docs(self):
+        _, error_docs = split_errors('github.com/a/b', 'abc', self.results, 2)
+        self.assertEqual(slice_error_docs(error_docs, 1, 4),
+                         [{'location': 'a.py', 'errors': [[2, 'E2'], [3, 'E3']]},
+                          {'location': 'b.py', 'errors': [[1, 'E1']]}])
+        self.assertEqual(slice_error_docs(error_docs, 0, 1), [{'location': 'a.py', 'errors': [[1, 'E1']]}])
+        self.assertEqual(slice_error_docs(error_docs, 4, 6), [])
+
+    def test_join_errors(self):
+        summary, error_docs = split_errors('github.com/a/b', 'abc', self.results, 2)
+        error_docs[0]['errors'] = codec.encode(error_docs[0]['errors'], 'zlib')
+        join_errors(summary, error_docs)
+        self.assertEqual(summary['pep8_lint']['error_files'], self.results['pep8_lint']['error_files'])
+        self.assertEqual(summary['pyflakes_lint']['error_files'], [])
+
+    def test_error_page_of_unknown_analyzer(self):
+        for analyzer_name in ('count', 'pep8_lint.score', '$where'):
+            with self.assertRaises(ValueError):
+                get_error_page('github.com/a/b', 'abc', analyzer_name, 1, 20)
+
+
+class HeadResolverTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.git_url, self.work_tree = make_bare_repository(self.root, {'main.py': 'x = 1\n'})
+        for i in range(3):
+            _git('tag', 'v%d' % i, cwd=self.work_tree)
+        _git('push', '-q', '--tags', 'origin', cwd=self.work_tree)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_resolve_head(self):
+        self.assertEqual(resolve_head(self.git_url), _git('rev-parse', 'HEAD', cwd=self.work_tree))
+        latest_hash = commit_files(self.work_tree, {'main.py': 'x = 2\n'}, push=True)
+        self.assertEqual(resolve_head(self.git_url), latest_hash)
+
+    def test_resolve_head_fail(self):
+        with self.assertRaises(subprocess.CalledProcessError):
+            resolve_head('file://' + os.path.join(self.root, 'null.git'))
+
+    def test_resolve_heads(self):
+        missing_url = 'file://' + os.path.join(self.root, 'null.git')
+        hashes = resolve_heads([self.git_url, missing_url], workers=2)
+        self.assertEqual(hashes, {self.git_url: resolve_head(self.git_url), missing_url: None})
+
+
+class CloneUrlTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.git_url, _ = make_bare_repository(self.root, {
+            'pkg/main.py': 'x = 1\n',
+            'pkg/generated.py': 'x = 1\n' * 50000,
+            'README.md': '# readme\n',
+            'License': 'MIT\n',
+            'setup.cfg': '[pycodestyle]\n',
+            'data/blob.bin': os.urandom(200000),
+            'docs/index.html': '<html></html>\n',
+        })
+        self.clone_dir = os.path.join(self.root, 'clone')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _checked_out_files(self):
+        paths = set()
+        for folder, dirnames, filenames in os.walk(self.clone_dir):
+            if '.git' in dirnames:
+                dirnames.remove('.git')
+            paths.update(os.path.relpath(os.path.join(folder, f), self.clone_dir) for f in filenames)
+        return paths
+
+    def test_clone_full(self):
+        stats = clone_url(self.git_url, self.clone_dir, sparse=False)
+        self.assertIn(os.path.join('data', 'blob.bin'), self._checked_out_files())
+        self.assertGreater(stats['bytes'], 200000)
+
+    def test_clone_sparse(self):
+        stats = clone_url(self.git_url, self.clone_dir, sparse=True)
+        self.assertEqual(self._checked_out_files(), {
+            os.path.join('pkg', 'main.py'), os.path.join('pkg', 'generated.py'), 'README.md', 'License', 'setup.cfg'
+        })
+        self.assertLess(stats['bytes'], 200000)
+        self.assertGreaterEqual(stats['seconds'], 0)
+
+    def test_clone_sparse_with_old_git(self):
+        with mock.patch.object(git, 'git_version', return_value=(2, 30, 0)):
+            clone_url(self.git_url, self.clone_dir, sparse=True)
+        self.assertIn(os.path.join('data', 'blob.bin'), self._checked_out_files())
+        self.assertGreaterEqual(git_version(), (2,))
+
+    def test_clone_sparse_max_blob_size(self):
+        stats = clone_url(self.git_url, self.clone_dir, sparse=True, max_blob_size=100000)
+        self.assertEqual(self._checked_out_files(), {
+            os.path.join('pkg', 'main.py'), 'README.md', 'License', 'setup.cfg'
+        })
+        self.assertLess(stats['bytes'], 100000)
+
+    def test_clone_url_fail(self):
+        with self.assertRaises(Exception):
+            clone_url('file://' + os.path.join(self.root, 'null.git'), self.clone_dir)
+
+
+class MirrorStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        files = {'pkg/mod%d.py' % i: '# %s\n' % os.urandom(4000).hex() for i in range(10)}
+        files.update({'main.py': 'x = 1\n', 'data/blob.bin': os.urandom(100000)})
+        self.git_url, self.work_tree = make_bare_repository(self.root, files)
+        self.store = MirrorStore(os.path.join(self.root, 'mirrors'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def _checkout(self, work_dir, **kwargs):
+        return self.store.checkout('mingrammer', 'sample', self.git_url, os.path.join(self.root, work_dir), **kwargs)
+
+    def _read(self, work_dir, relpath):
+        with open(os.path.join(self.root, work_dir, relpath)) as f:
+            return f.read()
+
+    def test_incremental_fetch(self):
+        first = self._checkout('first')
+        self.assertEqual(first['commit_hash'], resolve_head(self.git_url))
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'first', 'data', 'blob.bin')))
+        shutil.rmtree(os.path.join(self.root, 'first'))
+
+        latest_hash = commit_files(self.work_tree, {'main.py': 'x = 2\n'}, push=True)
+        second = self._checkout('second', commit_hash=latest_hash)
+        self.assertEqual(second['commit_hash'], latest_hash)
+        self.assertEqual(self._read('second', 'main.py'), 'x = 2\n')
+        self.assertLess(second['bytes'], first['bytes'])
+
+    def test_checkout_without_fetch(self):
+        commit_hash = self._checkout('first')['commit_hash']
+        shutil.rmtree(self.git_url[len('file://'):])
+        stats = self._checkout('second', commit_hash=commit_hash)
+        self.assertEqual(stats['commit_hash'], commit_hash)
+        self.assertEqual(self._read('second', 'main.py'), 'x = 1\n')
+
+    def test_open_commit_reads_objects_in_place(self):
+        with self.store.open_commit('mingrammer', 'sample', self.git_url) as (git_dir, stats):
+            missing = missing_objects(git_dir, stats['commit_hash'])
+            index = build_git_index(git_dir, stats['commit_hash'])
+        self.assertEqual(git_dir, self.store.mirror_path('mingrammer', 'sample'))
+        self.assertEqual(stats['commit_hash'], resolve_head(self.git_url))
+        self.assertEqual(len(missing), 1)
+        self.assertEqual(len(index.python_files), 11)
+        self.assertEqual(index.read_source(index.python_files[0]).lines, ['x = 1\n'])
+        self.assertEqual([f.size for f in index.files if f.path == 'data/blob.bin'], [None])
+
+    def test_open_commit_keeps_previous_commit(self):
+        with self.store.open_commit('mingrammer', 'sample', self.git_url) as (_, stats):
+            base_hash = stats['commit_hash']
+        latest_hash = commit_files(self.work_tree, {'main.py': 'x = 2\n', 'pkg/mod0.py': None}, push=True)
+        with self.store.open_commit('mingrammer', 'sample', self.git_url, latest_hash) as (git_dir, stats):
+            self.assertEqual(changed_paths(git_dir, base_hash, stats['commit_hash']), {'main.py', 'pkg/mod0.py'})
+
+    def test_evict_least_recently_used(self):
+        self.store.checkout('mingrammer', 'old', self.git_url, os.path.join(self.root, 'old'))
+        self.store.checkout('mingrammer', 'new', self.git_url, os.path.join(self.root, 'new'))
+        old_path = self.store.mirror_path('mingrammer', 'old')
+        os.utime(old_path, (0, 0))
+        self.store.budget = max(size for _, size, _ in self.store.mirrors())
+        self.assertEqual(self.store.evict(), [old_path])
+        self.assertEqual([path for path, _, _ in self.store.mirrors()], [self.store.mirror_path('mingrammer', 'new')])
+
+    def test_evict_after_failed_block(self):
+        self.store.budget = 0
+        with self.assertRaises(RuntimeError):
+            with self.store.open_commit('mingrammer', 'sample', self.git_url):
+                raise RuntimeError()
+        self.assertEqual(self.store.mirrors(), [])
+
+    def test_broken_mirror_does_not_use_enclosing_repository(self):
+        subprocess.check_call(['git', 'init', '--quiet', self.root])
+        commit_hash = self._checkout('first')['commit_hash']
+        os.remove(os.path.join(self.store.mirror_path('mingrammer', 'sample'), 'HEAD'))
+        with self.assertRaises(Exception):
+            self._checkout('second', commit_hash=commit_hash)
+        self.assertFalse(os.path.exists(os.path.join(self.root, '.git', 'FETCH_HEAD')))
+        self.assertFalse(os.path.exists(os.path.join(self.root, '.git', 'worktrees')))
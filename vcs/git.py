@@ -0,0 +1,332 @@
+"""
+Low-level git operations on remote repositories: resolving the HEAD
+commit, making partial clones and fetching their blobs
+"""
+import os
+import re
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import constants
+from analyzer.index import LINT_CONFIG_FILES
+from analyzer.license import LicenseAnalyzer
+from analyzer.readme import ReadmeAnalyzer
+from config import Config
+
+# Modes of the tree entries read as files, symbolic links and submodules are left out
+FILE_MODES = frozenset(('100644', '100755'))
+
+# First git version whose sparse-checkout reads non-cone patterns from stdin
+SPARSE_CHECKOUT_GIT_VERSION = (2, 35)
+
+
+def resolve_head(git_url, timeout=None):
+    """Resolve the commit hash of the HEAD of a remote git repository
+
+    Only the HEAD ref is requested, using the ref prefix of the git
+    protocol v2, and the output is parsed without any other process.
+
+    Args:
+        git_url: A git remote URL like 'git://...' or 'file://...'
+        timeout: Seconds to wait for the remote, `Config.HEAD_RESOLVE_TIMEOUT` by default
+
+    Returns:
+        The commit hash string if successful
+
+    Raises:
+        subprocess.CalledProcessError: An error occured getting hash from remote git repository
+        subprocess.TimeoutExpired: The remote did not answer in time
+    """
+    cmd = ['git', '-c', 'protocol.version=2', 'ls-remote', git_url, 'HEAD']
+    env = dict(os.environ, GIT_TERMINAL_PROMPT='0')
+    output = subprocess.check_output(cmd,
+                                     stderr=subprocess.DEVNULL,
+                                     timeout=timeout or Config.HEAD_RESOLVE_TIMEOUT,
+                                     env=env)
+    for line in output.decode('utf-8').splitlines():
+        hash_string, _, ref = line.partition('\t')
+        if ref == 'HEAD':
+            return hash_string
+    raise subprocess.CalledProcessError(0, cmd, output)
+
+
+def resolve_heads(git_urls, workers=None, timeout=None):
+    """Resolve the HEAD commit hashes of many remote git repositories concurrently
+
+    Args:
+        git_urls: Git remote URLs
+        workers: The number of remotes to query at once, `Config.HEAD_RESOLVE_WORKERS` by default
+        timeout: Seconds to wait for each remote
+
+    Returns:
+        A dict of git URL to the commit hash, or None if it could not be resolved
+    """
+    def resolve(git_url):
+        try:
+            return resolve_head(git_url, timeout)
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
+            return None
+
+    git_urls = list(git_urls)
+    with ThreadPoolExecutor(max_workers=workers or Config.HEAD_RESOLVE_WORKERS) as executor:
+        return dict(zip(git_urls, executor.map(resolve, git_urls)))
+
+
+def _case_insensitive_pattern(name):
+    """Make a sparse checkout pattern matching the file name in any case"""
+    return ''.join('[{}{}]'.format(c.lower(), c.upper()) if c.isalpha() else c for c in name)
+
+
+def _escape_pattern(path):
+    """Escape a path to match it literally in a sparse checkout pattern"""
+    return re.sub(r'([\\*?\[\]!# ])', r'\\\1', path)
+
+
+def _sparse_patterns():
+    """Sparse checkout patterns of the files the analyzers read"""
+    doc_files = LicenseAnalyzer.LICENSE_PATTERN + ReadmeAnalyzer.README_PATTERN
+    return (['*.py'] +
+            [_case_insensitive_pattern(name) for name in doc_files] +
+            ['/' + name for name in LINT_CONFIG_FILES])
+
+
+def local_git_env(path):
+    """Environment of a git command run in a local repository directory
+
+    The repository is only looked for in the directory itself, so a
+    broken clone or mirror never falls through to a repository it is
+    nested in, like the checkout of this app.
+
+    Args:
+        path: Directory the command runs in
+
+    Returns:
+        A dict of environment variables
+    """
+    return dict(os.environ, GIT_CEILING_DIRECTORIES=os.path.dirname(os.path.abspath(path)))
+
+
+def run_git(args, deadline, cwd=None, stdin=None):
+    """Run a git command of the clone within the clone deadline
+
+    Returns:
+        The standard output bytes
+
+    Raises:
+        Exception: The command failed or the deadline expired
+    """
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+        raise Exception(constants.ERROR_CLONE_TIMEOUT_EXPIRED)
+    env = local_git_env(cwd) if cwd is not None else dict(os.environ)
+    env['GIT_TERMINAL_PROMPT'] = '0'
+    try:
+        return subprocess.run(['git'] + args,
+                              input=stdin,
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL,
+                              cwd=cwd,
+                              timeout=remaining,
+                              env=env,
+                              check=True).stdout
+    except subprocess.TimeoutExpired:
+        raise Exception(constants.ERROR_CLONE_TIMEOUT_EXPIRED)
+    except subprocess.CalledProcessError:
+        raise Exception(constants.ERROR_CLONE_FAILED)
+
+
+def directory_size(path):
+    size = 0
+    for folder, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                size += os.lstat(os.path.join(folder, filename)).st_size
+            except OSError:
+                continue
+    return size
+
+
+def _run_local_git(args, git_dir, deadline=None):
+    """Run a git command reading the local repository, within the deadline if there is one
+
+    Raises:
+        subprocess.CalledProcessError: The command failed without a deadline
+        Exception: The command failed or the deadline expired
+    """
+    if deadline is not None:
+        return run_git(args, deadline, cwd=git_dir)
+    return subprocess.run(['git'] + args,
+                          stdout=subprocess.PIPE,
+                          stderr=subprocess.DEVNULL,
+                          cwd=git_dir,
+                          env=local_git_env(git_dir),
+                          check=True).stdout
+
+
+def objects_size(git_dir, deadline=None):
+    """Measure the disk size of the objects of a repository without walking them
+
+    Args:
+        git_dir: Git directory of the repository
+        deadline: `time.monotonic()` value the command must end by, none if None
+
+    Returns:
+        The size in bytes of the loose objects, packs and garbage files
+    """
+    size = 0
+    for line in _run_local_git(['count-objects', '-v'], git_dir, deadline).decode().splitlines():
+        name, _, value = line.partition(':')
+        if name in ('size', 'size-pack', 'size-garbage'):
+            size += int(value) * 1024
+    return size
+
+
+def missing_objects(git_dir, revision, deadline=None):
+    """Find the objects of a revision left out of a partial clone
+
+    Args:
+        git_dir: Git directory of the repository
+        revision: The commit to look into
+        deadline: `time.monotonic()` value the command must end by, none if None
+
+    Returns:
+        A set of object hashes
+    """
+    objects = _run_local_git(['rev-list', '--objects', '--missing=print', revision], git_dir, deadline)
+    return {line[1:] for line in objects.decode().splitlines() if line.startswith('?')}
+
+
+def list_tree(git_dir, revision, deadline=None):
+    """List the file blobs of a revision, symbolic links and submodules are left out
+
+    Args:
+        git_dir: Git directory of the repository
+        revision: The commit to list
+        deadline: `time.monotonic()` value the command must end by, none if None
+
+    Returns:
+        A list of (path, blob hash) tuples
+    """
+    entries = []
+    tree = _run_local_git(['ls-tree', '-r', '-z', revision], git_dir, deadline)
+    for entry in tree.decode('utf-8', 'surrogateescape').split('\0'):
+        info, _, path = entry.partition('\t')
+        if not path:
+            continue
+        mode, _, blob_hash = info.split()
+        if mode in FILE_MODES:
+            entries.append((path, blob_hash))
+    return entries
+
+
+def fetch_source_blobs(git_dir, commit_hash, deadline):
+    """Fetch the missing blobs of the files the analyzers read in one request
+
+    A partial clone would otherwise fetch each blob on its own when it is
+    read from the object store without a checkout.
+
+    Args:
+        git_dir: Git directory of a partial clone
+        commit_hash: The commit to read
+        deadline: `time.monotonic()` value the fetch must end by
+    """
+    missing = missing_objects(git_dir, commit_hash, deadline)
+    if not missing:
+        return
+    blob_hashes = sorted({
+        blob_hash for path, blob_hash in list_tree(git_dir, commit_hash, deadline)
+        if blob_hash in missing and (path.endswith('.py') or path in LINT_CONFIG_FILES)
+    })
+    if blob_hashes:
+        run_git(['-c', 'fetch.negotiationAlgorithm=noop', 'fetch', '--no-tags', '--no-write-fetch-head',
+                 '--recurse-submodules=no', '--filter=blob:none', '--stdin', 'origin'],
+                deadline, cwd=git_dir, stdin=''.join(h + '\n' for h in blob_hashes).encode())
+
+
+@lru_cache(maxsize=None)
+def git_version():
+    """Get the version of the installed git command
+
+    Returns:
+        A tuple of the version numbers like (2, 39, 5), (0,) if unknown
+    """
+    try:
+        output = subprocess.run(['git', 'version'],
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL,
+                                check=True).stdout.decode()
+    except (OSError, subprocess.CalledProcessError):
+        return (0,)
+    matched = re.search(r'(\d+(?:\.\d+)+)', output)
+    if matched is None:
+        return (0,)
+    return tuple(int(number) for number in matched.group(1).split('.'))
+
+
+def sparse_checkout(work_dir, deadline, max_blob_size=None):
+    """Check out only the files the analyzers read in a partial clone
+
+    If max_blob_size is set, the files whose blob was filtered out of the
+    clone are left out, so they are never fetched. Before git 2.35 the
+    whole tree is checked out instead, fetching the missing blobs.
+
+    Args:
+        work_dir: Work tree of a clone made without checkout
+        deadline: `time.monotonic()` value the checkout must end by
+        max_blob_size: Maximum size in bytes of the blobs of the clone
+    """
+    if git_version() < SPARSE_CHECKOUT_GIT_VERSION:
+        run_git(['checkout', '--quiet'], deadline, cwd=work_dir)
+        return
+
+    patterns = _sparse_patterns()
+    if max_blob_size:
+        missing = missing_objects(work_dir, 'HEAD', deadline)
+        if missing:
+            for path, blob_hash in list_tree(work_dir, 'HEAD', deadline):
+                if blob_hash in missing:
+                    patterns.append('!/' + _escape_pattern(path))
+
+    run_git(['sparse-checkout', 'set', '--no-cone', '--stdin'], deadline, cwd=work_dir,
+            stdin='\n'.join(patterns).encode('utf-8', 'surrogateescape'))
+    run_git(['checkout', '--quiet'], deadline, cwd=work_dir)
+
+
+def clone_url(git_url, clone_dir, sparse=True, max_blob_size=None, timeout=None):
+    """Clone the latest commit of a git remote
+
+    In sparse mode it makes a partial clone without any blob, and checks
+    out only the python sources, readme, license and lint configuration
+    files, so their blobs are the only ones fetched. If max_blob_size is
+    set, blobs bigger than that are never fetched and their files are left
+    out of the checkout.
+
+    Args:
+        git_url: A git remote URL like 'git://...' or 'file://...'
+        clone_dir: Directory to clone into
+        sparse: Whether if cloning partially or not
+        max_blob_size: Maximum size in bytes of the blobs to fetch
+        timeout: Seconds the whole clone may take, `Config.CLONE_TIMEOUT` by default
+
+    Returns:
+        A dict of the bytes fetched and the seconds taken
+
+    Raises:
+        Exception: The clone failed or the timeout expired
+    """
+    started = time.monotonic()
+    deadline = started + (timeout or Config.CLONE_TIMEOUT)
+
+    if not sparse:
+        run_git(['clone', '--depth=1', git_url, clone_dir], deadline)
+    else:
+        blob_filter = 'blob:limit={}'.format(max_blob_size) if max_blob_size else 'blob:none'
+        run_git(['clone', '--depth=1', '--no-checkout', '--filter=' + blob_filter, git_url, clone_dir], deadline)
+        sparse_checkout(clone_dir, deadline, max_blob_size)
+
+    return {
+        'bytes': directory_size(os.path.join(clone_dir, '.git', 'objects')),
+        'seconds': round(time.monotonic() - started, 3),
+    }
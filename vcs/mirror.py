@@ -0,0 +1,229 @@
+"""
+A persistent store of bare repository mirrors updated by incremental
+fetches, from which throwaway work trees are checked out or objects are
+read in place for analysis
+"""
+import contextlib
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+from config import Config
+from vcs.git import fetch_source_blobs, local_git_env, objects_size, run_git, sparse_checkout
+
+
+class MirrorStore:
+    """Bare partial mirrors of repositories keyed by 'username/name'
+
+    A new repository is cloned once, and later analyses only fetch the
+    commits and trees added since, plus the blobs they check out. The
+    least recently used mirrors are evicted when the total size goes
+    over the budget. The size of a mirror is measured from its packs with
+    `git count-objects` when it is updated, and kept for the evictions.
+
+    root:          Directory of the mirrors
+    budget:        Maximum total size in bytes of the mirrors, unlimited if None
+    sparse:        Whether if fetching and checking out only the files the analyzers read
+    max_blob_size: Maximum size in bytes of the blobs to fetch in sparse mode
+    """
+
+    def __init__(self, root, budget=None, sparse=True, max_blob_size=None):
+        self.root = root
+        self.budget = budget
+        self.sparse = sparse
+        self.max_blob_size = max_blob_size
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self._sizes = {}
+
+    def mirror_path(self, username, name):
+        return os.path.abspath(os.path.join(self.root, username, name + '.git'))
+
+    def _lock(self, mirror_path):
+        with self._locks_lock:
+            return self._locks.setdefault(mirror_path, threading.Lock())
+
+    def _filter_options(self):
+        if not self.sparse:
+            return []
+        if self.max_blob_size:
+            return ['--filter=blob:limit={}'.format(self.max_blob_size)]
+        return ['--filter=blob:none']
+
+    def _has_commit(self, mirror_path, commit_hash):
+        try:
+            subprocess.check_call(['git', 'cat-file', '-e', commit_hash + '^{commit}'],
+                                  cwd=mirror_path,
+                                  env=local_git_env(mirror_path),
+                                  stdout=subprocess.DEVNULL,
+                                  stderr=subprocess.DEVNULL)
+            return True
+        except subprocess.CalledProcessError:
+            return False
+
+    def _size(self, mirror_path, deadline=None):
+        """Size in bytes of the objects of a mirror, 0 if it does not exist yet"""
+        if mirror_path not in self._sizes:
+            self._sizes[mirror_path] = objects_size(mirror_path, deadline) if os.path.isdir(mirror_path) else 0
+        return self._sizes[mirror_path]
+
+    def _update(self, mirror_path, git_url, commit_hash, deadline):
+        """Create or fetch the mirror so that it has the latest commit
+
+        Returns:
+            The latest commit hash
+        """
+        if not os.path.isdir(mirror_path):
+            os.makedirs(os.path.dirname(mirror_path), exist_ok=True)
+            run_git(['clone', '--bare', '--depth=1'] + self._filter_options() + [git_url, mirror_path], deadline)
+            return run_git(['rev-parse', 'HEAD'], deadline, cwd=mirror_path).decode().strip()
+
+        if commit_hash and self._has_commit(mirror_path, commit_hash):
+            return commit_hash
+        run_git(['fetch', '--depth=1'] + self._filter_options() + ['origin', 'HEAD'], deadline, cwd=mirror_path)
+        latest_hash = run_git(['rev-parse', 'FETCH_HEAD'], deadline, cwd=mirror_path).decode().strip()
+        run_git(['update-ref', 'HEAD', latest_hash], deadline, cwd=mirror_path)
+        return latest_hash
+
+    def checkout(self, username, name, git_url, work_dir, commit_hash=None, timeout=None):
+        """Update the mirror of a repository and check out a work tree of it
+
+        The work tree can be removed with a plain directory removal; its
+        leftover metadata is pruned on the next checkout.
+
+        Args:
+            username: Owner of repository
+            name: Repository name
+            git_url: A git remote URL like 'git://...' or 'file://...'
+            work_dir: Directory of the work tree to create
+            commit_hash: The expected latest commit hash, fetched only if the mirror lacks it
+            timeout: Seconds the whole checkout may take, `Config.CLONE_TIMEOUT` by default
+
+        Returns:
+            A dict of the bytes fetched, the seconds taken and the checked out commit hash
+
+        Raises:
+            Exception: The fetch or checkout failed or the timeout expired
+        """
+        started = time.monotonic()
+        deadline = started + (timeout or Config.CLONE_TIMEOUT)
+        mirror_path = self.mirror_path(username, name)
+        work_dir = os.path.abspath(work_dir)
+
+        with self._lock(mirror_path):
+            size_before = self._size(mirror_path, deadline)
+            latest_hash = self._update(mirror_path, git_url, commit_hash, deadline)
+            run_git(['worktree', 'prune'], deadline, cwd=mirror_path)
+            checkout_options = ['--no-checkout'] if self.sparse else []
+            run_git(['worktree', 'add', '--detach'] + checkout_options + [work_dir, latest_hash],
+                    deadline, cwd=mirror_path)
+            if self.sparse:
+                sparse_checkout(work_dir, deadline, self.max_blob_size)
+            self._sizes[mirror_path] = objects_size(mirror_path, deadline)
+            fetched = self._sizes[mirror_path] - size_before
+            os.utime(mirror_path)
+
+        self.evict()
+        return {
+            'bytes': fetched,
+            'seconds': round(time.monotonic() - started, 3),
+            'commit_hash': latest_hash,
+        }
+
+    @contextlib.contextmanager
+    def open_commit(self, username, name, git_url, commit_hash=None, timeout=None):
+        """Update the mirror of a repository to read the latest commit in place
+
+        No work tree is checked out. In sparse mode without a blob size
+        limit, the missing blobs of the files the analyzers read are
+        fetched at once, so reading them from the mirror never goes to the
+        remote. The mirror is neither updated nor evicted by others until
+        the block exits.
+
+        Args:
+            username: Owner of repository
+            name: Repository name
+            git_url: A git remote URL like 'git://...' or 'file://...'
+            commit_hash: The expected latest commit hash, fetched only if the mirror lacks it
+            timeout: Seconds the update may take, `Config.CLONE_TIMEOUT` by default
+
+        Yields:
+            A tuple of the mirror path and a dict of the bytes fetched, the
+            seconds taken and the latest commit hash
+
+        Raises:
+            Exception: The fetch failed or the timeout expired
+        """
+        started = time.monotonic()
+        deadline = started + (timeout or Config.CLONE_TIMEOUT)
+        mirror_path = self.mirror_path(username, name)
+
+        try:
+            with self._lock(mirror_path):
+                size_before = self._size(mirror_path, deadline)
+                latest_hash = self._update(mirror_path, git_url, commit_hash, deadline)
+                if self.sparse and not self.max_blob_size:
+                    fetch_source_blobs(mirror_path, latest_hash, deadline)
+                self._sizes[mirror_path] = objects_size(mirror_path, deadline)
+                fetched = self._sizes[mirror_path] - size_before
+                os.utime(mirror_path)
+                yield mirror_path, {
+                    'bytes': fetched,
+                    'seconds': round(time.monotonic() - started, 3),
+                    'commit_hash': latest_hash,
+                }
+        finally:
+            self.evict()
+
+    def mirrors(self):
+        """List the mirror paths with their size and last used time
+
+        Returns:
+            A list of (path, size, last used timestamp) tuples
+        """
+        mirrors = []
+        if not os.path.isdir(self.root):
+            return mirrors
+        for username in os.listdir(self.root):
+            user_dir = os.path.join(self.root, username)
+            if not os.path.isdir(user_dir):
+                continue
+            for mirror_name in os.listdir(user_dir):
+                mirror_path = os.path.abspath(os.path.join(user_dir, mirror_name))
+                if not mirror_name.endswith('.git') or not os.path.isdir(mirror_path):
+                    continue
+                try:
+                    mirrors.append((mirror_path, self._size(mirror_path), os.stat(mirror_path).st_mtime))
+                except (OSError, subprocess.CalledProcessError):
+                    continue
+        return mirrors
+
+    def evict(self):
+        """Remove the least recently used mirrors until they fit in the budget
+
+        Mirrors in use by a checkout are never removed.
+
+        Returns:
+            The list of removed mirror paths
+        """
+        if self.budget is None:
+            return []
+        mirrors = sorted(self.mirrors(), key=lambda mirror: mirror[2])
+        total_size = sum(size for _, size, _ in mirrors)
+        evicted = []
+        for mirror_path, size, _ in mirrors:
+            if total_size <= self.budget:
+                break
+            lock = self._lock(mirror_path)
+            if not lock.acquire(blocking=False):
+                continue
+            try:
+                shutil.rmtree(mirror_path, ignore_errors=True)
+                self._sizes.pop(mirror_path, None)
+            finally:
+                lock.release()
+            total_size -= size
+            evicted.append(mirror_path)
+        return evicted
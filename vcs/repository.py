@@ -3,15 +3,30 @@ It handles the cloning, cleaning, check caching the repository for
 analyzing that to score and to report.
 Supports 'git' protocol and 'Github' host now.
 """
+import contextlib
 import datetime
 import os
 import re
 import shutil
 import subprocess
 
-import constants
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+
+from analyzer import LINT_ANALYZER_NAMES
+from analyzer.code import group_errors, iter_errors
 from config import Config
-from db.collection import get_repo_collection
+from db import codec
+from db.collection import get_error_collection, get_repo_collection
+from db.memory import TTLCache
+from vcs.git import clone_url, resolve_head, resolve_heads
+from vcs.mirror import MirrorStore
+
+# The latest commit hash of each repository url resolved recently
+latest_hash_cache = TTLCache(Config.HEAD_CACHE_SIZE, Config.HEAD_CACHE_TTL)
+
+# The local mirrors of the analyzed repositories
+mirror_store = MirrorStore(Config.MIRROR_DIR, Config.MIRROR_BUDGET,
+                           Config.CLONE_SPARSE, Config.CLONE_MAX_BLOB_SIZE) if Config.MIRROR_DIR else None
 
 
 class GitRepository:
@@ -24,10 +39,12 @@ class GitRepository:
     latest_hash:      Last cloned latest commit hash
     date:             Cached datetime
     analysis_results: A dict of analysis results
+    clone_stats:      A dict of the bytes fetched and seconds taken by the last clone
     """
     last_latest_hash = None
     latest_hash = None
     analysis_results = {}
+    clone_stats = None
 
     def __init__(self, url=None, username=None, name=None, latest_hash=None):
         self.url = url
@@ -43,7 +60,8 @@ class GitRepository:
             'username': self.username,
             'last_latest_hash': self.last_latest_hash,
             'date': datetime.datetime.now(),
-            'analysis_results': self.analysis_results
+            'analysis_results': self.analysis_results,
+            'clone_stats': self.clone_stats
         }
 
     def save_analysis_results(self, analysis_results):
@@ -87,7 +105,7 @@ def _make_git_protocol_url(url):
         Git protocol form URL
     """
     username, name = parse_url(url)
-    git_protocol_url = 'git://github.com/{0}/{1}.git'.format(username, name)
+    git_protocol_url = Config.GIT_URL_TEMPLATE.format(username=username, name=name)
     return git_protocol_url
 
 
@@ -102,13 +120,54 @@ def _get_latest_commit_hash(url):
 
     Raises:
         subprocess.CalledProcessError: An error occured getting hash from remote git repository
+        subprocess.TimeoutExpired: The remote did not answer in time
+    """
+    return resolve_head(_make_git_protocol_url(url))
+
+
+def get_latest_commit_hash(url):
+    """Get the latest commit hash, resolving it only if not resolved recently
+
+    Args:
+        url: A repository url
+
+    Returns:
+        The commit hash string if successful
+
+    Raises:
+        subprocess.CalledProcessError: An error occured getting hash from remote git repository
+        subprocess.TimeoutExpired: The remote did not answer in time
     """
-    with subprocess.Popen(['git', 'ls-remote', _make_git_protocol_url(url)],
-                          stdout=subprocess.PIPE) as proc:
-        output = subprocess.check_output(['grep', 'HEAD'], stdin=proc.stdout)
-        output = subprocess.check_output(['cut', '-f', '1'], input=output)
-        hash_string = output.strip().decode('utf-8')
-        return hash_string
+    hash_string = latest_hash_cache.get(url)
+    if hash_string is None:
+        hash_string = _get_latest_commit_hash(url)
+        latest_hash_cache.set(url, hash_string)
+    return hash_string
+
+
+def get_latest_commit_hashes(urls, workers=None):
+    """Get the latest commit hashes of many repositories at once
+
+    Args:
+        urls: Repository urls
+        workers: The number of remotes to query at once
+
+    Returns:
+        A dict of url to the commit hash, or None if it could not be resolved
+    """
+    hashes = {}
+    git_urls = {}
+    for url in urls:
+        hash_string = latest_hash_cache.get(url)
+        if hash_string is None:
+            git_urls[_make_git_protocol_url(url)] = url
+        else:
+            hashes[url] = hash_string
+    for git_url, hash_string in resolve_heads(git_urls, workers).items():
+        hashes[git_urls[git_url]] = hash_string
+        if hash_string is not None:
+            latest_hash_cache.set(git_urls[git_url], hash_string)
+    return hashes
 
 
 def _create_writable_directory(dir_name):
@@ -127,7 +186,7 @@ def create_repository(url):
         A GitRepository instance if successful, None otherwise
     """
     try:
-        commit_hash = _get_latest_commit_hash(url)
+        commit_hash = get_latest_commit_hash(url)
         username, name = parse_url(url)
         git_repo = GitRepository(
             url=url,
@@ -136,19 +195,259 @@ def create_repository(url):
             latest_hash=commit_hash
         )
         return git_repo
-    except subprocess.CalledProcessError:
+    except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
         return None
 
 
+def split_errors(url, commit_hash, analysis_results, chunk_size):
+    """Split the errors of the lint results out of the analysis results
+
+    The errors of each file are cut into chunks, so no error document gets
+    near the document size limit however many errors a file has. Each
+    document records the range of its errors among those of the analyzer
+    ordered by file as 'start' and 'end', to read a page of errors.
+
+    Args:
+        url: A repository url
+        commit_hash: The analyzed commit hash
+        analysis_results: A dict of analysis results
+        chunk_size: Maximum number of errors per error document
+
+    Returns:
+        A tuple of the analysis results without the errors, and the list of
+        error documents
+    """
+    summary = {}
+    error_docs = []
+    for name, result in analysis_results.items():
+        if isinstance(result, dict) and 'error_files' in result:
+            result = dict(result)
+            error_files = result.pop('error_files')
+            result['error_file_count'] = len(error_files)
+            offset = 0
+            for error_file in sorted(error_files, key=lambda error_file: error_file['location']):
+                errors = error_file['errors']
+                for chunk, start in enumerate(range(0, len(errors), chunk_size)):
+                    chunk_errors = errors[start:start + chunk_size]
+                    error_docs.append({
+                        'url': url,
+                        'commit': commit_hash,
+                        'analyzer': name,
+                        'location': error_file['location'],
+                        'chunk': chunk,
+                        'start': offset,
+                        'end': offset + len(chunk_errors),
+                        'errors': chunk_errors
+                    })
+                    offset += len(chunk_errors)
+        summary[name] = result
+    return summary, error_docs
+
+
+def join_errors(analysis_results, error_docs):
+    """Put the errors stored apart back into the lint results, in place
+
+    Args:
+        analysis_results: A dict of analysis results made by `split_errors`
+        error_docs: The error documents sorted by analyzer, location and chunk
+    """
+    for result in analysis_results.values():
+        if isinstance(result, dict) and 'error_file_count' in result:
+            result.setdefault('error_files', [])
+    for doc in error_docs:
+        result = analysis_results.get(doc['analyzer'])
+        if result is None:
+            continue
+        _append_errors(result.setdefault('error_files', []), doc['location'], codec.decode(doc['errors']))
+
+
+def _append_errors(error_files, location, errors):
+    """Append the errors of a file to error files ordered by file, joining the chunks of a file"""
+    if error_files and error_files[-1]['location'] == location:
+        error_files[-1]['errors'].extend(errors)
+    else:
+        error_files.append({'location': location, 'errors': list(errors)})
+
+
+def slice_error_docs(error_docs, first, last):
+    """Cut the errors in a range out of the error documents covering it
+
+    Args:
+        error_docs: Error documents sorted by 'start', with decoded errors
+        first: Index of the first error of the range among those of the analyzer
+        last: Index of the error after the range
+
+    Returns:
+        A list of {'location', 'errors'} documents of the errors in the range
+    """
+    error_files = []
+    for doc in error_docs:
+        errors = doc['errors'][max(first - doc['start'], 0):max(last - doc['start'], 0)]
+        if errors:
+            _append_errors(error_files, doc['location'], errors)
+    return error_files
+
+
 def cache(repo):
     """Cache the given repository to reuse later
 
+    The lint errors are stored in their own collection, encoded by
+    `Config.RESULTS_CODEC`, and those of the previously cached commit are
+    removed.
+
     Args:
         repo: A repository instance
     """
     repositories = get_repo_collection()
+    errors = get_error_collection()
     repo.update_last_latest_hash()
-    repositories.replace_one({'url': repo.url}, repo.to_document(), upsert=True)
+    document = repo.to_document()
+    document['checked'] = document['date']
+    document['analysis_results'], error_docs = split_errors(repo.url, repo.last_latest_hash,
+                                                            document['analysis_results'],
+                                                            Config.LINT_ERRORS_PER_DOCUMENT)
+    for doc in error_docs:
+        doc['errors'] = codec.encode(doc['errors'])
+    errors.delete_many({'url': repo.url, 'commit': repo.last_latest_hash})
+    if error_docs:
+        errors.insert_many(error_docs, ordered=False)
+    repositories.update_one({'url': repo.url}, {'$set': document}, upsert=True)
+    errors.delete_many({'url': repo.url, 'commit': {'$ne': repo.last_latest_hash}})
+
+
+def find_stale_documents(before, limit):
+    """Find the cached repositories whose latest commit was not checked for a while
+
+    The most viewed repositories come first.
+
+    Args:
+        before: Datetime the latest commit was last checked before
+        limit: Maximum number of documents to return
+
+    Returns:
+        A list of documents with the url, last latest hash, cached date and views
+    """
+    repositories = get_repo_collection()
+    cursor = repositories.find({'checked': {'$not': {'$gte': before}}},
+                               {'_id': False, 'url': True, 'last_latest_hash': True, 'date': True, 'views': True})
+    return list(cursor.sort('views', DESCENDING).limit(limit))
+
+
+def mark_checked(urls, checked):
+    """Save when the latest commit of the repositories was last checked
+
+    Args:
+        urls: Repository urls
+        checked: Datetime of the check
+    """
+    if urls:
+        get_repo_collection().update_many({'url': {'$in': list(urls)}}, {'$set': {'checked': checked}})
+
+
+def add_views(view_counts):
+    """Add up the numbers of report views of the cached repositories
+
+    Args:
+        view_counts: A dict of repository url to the number of new views
+    """
+    if view_counts:
+        get_repo_collection().bulk_write([
+            UpdateOne({'url': url}, {'$inc': {'views': count}}) for url, count in view_counts.items()
+        ], ordered=False)
+
+
+def get_cached_document(repo, projection=None):
+    """Get the cached document of the repository at its latest commit
+
+    Args:
+        repo: A repository instance
+        projection: Fields to return, all but '_id' by default
+
+    Returns:
+        The cached document if the latest commit was cached, None otherwise
+    """
+    if projection is None:
+        projection = {'_id': False}
+    repositories = get_repo_collection()
+    return repositories.find_one({'url': repo.url, 'last_latest_hash': repo.latest_hash}, projection)
+
+
+def get_previous_document(repo):
+    """Get the cached document of the repository at whatever commit it was analyzed
+
+    The lint errors stored apart are put back into the analysis results.
+
+    Args:
+        repo: A repository instance
+
+    Returns:
+        The last cached commit hash and analysis results, None if never cached
+    """
+    repositories = get_repo_collection()
+    document = repositories.find_one({'url': repo.url},
+                                     {'_id': False, 'last_latest_hash': True, 'analysis_results': True})
+    if document is not None and document.get('analysis_results'):
+        error_docs = get_error_collection().find(
+            {'url': repo.url, 'commit': document['last_latest_hash']},
+            {'_id': False, 'analyzer': True, 'location': True, 'errors': True}
+        ).sort([('analyzer', ASCENDING), ('location', ASCENDING), ('chunk', ASCENDING)])
+        join_errors(document['analysis_results'], error_docs)
+    return document
+
+
+def get_error_page(url, commit_hash, analyzer_name, page, per_page):
+    """Get a page of the errors of a lint analyzer, ordered by file
+
+    A page holds per_page errors, whatever files and error documents they
+    are in. The errors of documents cached before they were stored apart
+    are read from the repository document.
+
+    Args:
+        url: A repository url
+        commit_hash: The cached commit hash
+        analyzer_name: Document name of the lint analyzer
+        page: The page number, from 1
+        per_page: The number of errors per page
+
+    Returns:
+        A tuple of the list of {'location', 'errors'} documents of the page,
+        and the number of pages
+
+    Raises:
+        ValueError: The analyzer name is not one of the lint analyzers
+    """
+    if analyzer_name not in LINT_ANALYZER_NAMES:
+        raise ValueError('Unknown lint analyzer: {}'.format(analyzer_name))
+    first, last = (page - 1) * per_page, page * per_page
+    query = {'url': url, 'commit': commit_hash, 'analyzer': analyzer_name}
+    errors = get_error_collection()
+    last_doc = errors.find_one(query, {'_id': False, 'end': True}, sort=[('start', DESCENDING)])
+    if last_doc is not None:
+        total = last_doc['end']
+        cursor = errors.find(dict(query, start={'$lt': last}, end={'$gt': first}),
+                             {'_id': False, 'location': True, 'start': True, 'errors': True})
+        error_docs = (dict(doc, errors=codec.decode(doc['errors'])) for doc in cursor.sort('start', ASCENDING))
+        error_files = slice_error_docs(error_docs, first, last)
+    else:
+        document = get_repo_collection().find_one({'url': url, 'last_latest_hash': commit_hash},
+                                                  {'_id': False, 'analysis_results.' + analyzer_name: True})
+        result = ((document or {}).get('analysis_results') or {}).get(analyzer_name) or {}
+        all_errors = sorted(iter_errors(result), key=lambda error: error[0])
+        total = len(all_errors)
+        error_files = group_errors(all_errors[first:last])
+    return error_files, max((total + per_page - 1) // per_page, 1)
+
+
+def is_tracked(url):
+    """Check if the repository was ever cached
+
+    Args:
+        url: A repository url
+
+    Returns:
+        Whether if there is a cached document of the repository or not
+    """
+    return get_repo_collection().find_one({'url': url}, {'_id': True}) is not None
 
 
 def is_cached(repo):
@@ -160,19 +459,28 @@ def is_cached(repo):
     Returns:
         Whether if there is cached one or not
     """
-    repositories = get_repo_collection()
-    repo_doc = repositories.find_one({'url': repo.url})
+    return get_cached_document(repo, {'_id': True}) is not None
 
-    if not repo_doc:
-        return False
-    if repo_doc['last_latest_hash'] != repo.latest_hash:
-        return False
-    return True
+
+def _clone_dir(repo):
+    """Make a clone directory path unique to the repository and commit
+
+    Args:
+        repo: A repository instance
+
+    Returns:
+        The directory path to clone into
+    """
+    return os.path.join(Config.CLONE_TMP_DIR, repo.username, repo.name, repo.latest_hash or 'HEAD')
 
 
 def clone(repo):
     """Clone the repository on temporary place and return location
     Clone is done only if there is no cache, so if there already exists clone directory, it should be removed.
+    The directory is unique to the owner, name and commit of the repository, so clones of other repositories
+    or commits are never touched. The clone statistics are saved to the repository.
+    If the mirror store is enabled, the directory is a work tree of the local mirror of the repository
+    updated by an incremental fetch instead of a new clone.
 
     Args:
         repo: A repository instance
@@ -184,23 +492,43 @@ def clone(repo):
     if not os.path.isdir(tmp_dir):
         _create_writable_directory(tmp_dir)
 
-    if os.path.exists(os.path.join(tmp_dir, repo.name)):
-        shutil.rmtree(os.path.join(tmp_dir, repo.name))
+    clone_dir = _clone_dir(repo)
+    if os.path.exists(clone_dir):
+        shutil.rmtree(clone_dir)
+    os.makedirs(os.path.dirname(clone_dir), exist_ok=True)
 
-    proc = subprocess.Popen(['git', 'clone', '--depth=1', _make_git_protocol_url(repo.url)],
-                            stdout=subprocess.PIPE,
-                            cwd=tmp_dir)
+    if mirror_store is not None:
+        repo.clone_stats = mirror_store.checkout(repo.username, repo.name, _make_git_protocol_url(repo.url), clone_dir,
+                                                 commit_hash=repo.latest_hash)
+    else:
+        repo.clone_stats = clone_url(_make_git_protocol_url(repo.url), clone_dir,
+                                     sparse=Config.CLONE_SPARSE,
+                                     max_blob_size=Config.CLONE_MAX_BLOB_SIZE)
+    return clone_dir
 
-    try:
-        _, err = proc.communicate(timeout=Config.CLONE_TIMEOUT)
-    except subprocess.TimeoutExpired:
-        proc.kill()
-        raise Exception(constants.ERROR_CLONE_TIMEOUT_EXPIRED)
 
-    if err:
-        raise Exception(constants.ERROR_CLONE_FAILED)
+@contextlib.contextmanager
+def open_commit(repo):
+    """Fetch the latest commit of the repository into its mirror without checking it out
 
-    return os.path.join(tmp_dir, repo.name)
+    The objects of the commit can be read from the mirror until the block
+    exits. The fetch statistics are saved to the repository.
+
+    Args:
+        repo: A repository instance
+
+    Yields:
+        A tuple of the git directory of the mirror and the latest commit hash
+
+    Raises:
+        ValueError: The mirror store is disabled
+    """
+    if mirror_store is None:
+        raise ValueError('The mirror store is disabled')
+    with mirror_store.open_commit(repo.username, repo.name, _make_git_protocol_url(repo.url),
+                                  commit_hash=repo.latest_hash) as (git_dir, stats):
+        repo.clone_stats = stats
+        yield git_dir, stats['commit_hash']
 
 
 def clear(path):